@@ -18,7 +18,7 @@
 #
 
 
-__all__ = ["common", "counters", "connections", "processes", "cpu", "disks", "memory", "welcome"]
+__all__ = ["common", "counters", "connections", "processes", "cpu", "disks", "memory", "quicklook", "welcome", "render", "storage", "profiling", "locking", "arraystore", "chart", "devices"]
 
 
 # EOF - __init__.py
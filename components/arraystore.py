@@ -0,0 +1,726 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# arraystore.py - round-robin data files kept in memory-mapped arrays
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Round-robin data files with the same structure as rrdtool's (data sources
+   consolidated into archives of several resolutions), implemented in Python
+   on top of memory-mapped NumPy arrays."""
+
+
+import os
+import shutil
+
+from time import time
+
+from components.common import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#
+# Each data file is a directory (named after the ".rrd" file it replaces,
+# but ending in ".ring") holding these files:
+#
+#   "meta"   - the structure, as text (see below).
+#   "clock"  - the time of the last update (a single 64-bit integer).
+#   "state"  - one row per data source, with the last value given and the
+#              data points being consolidated (64-bit floats).
+#   "rraN"   - one row per data source, with the contents of each archive.
+#
+# The "meta" file has one line for the step, one line for each data source
+# and one line for each archive, with the following formats:
+#
+#   "step seconds"
+#   "ds name type heartbeat min max"
+#   "rra function xff steps rows"
+#
+# Archive rows are written twice, at "i" and "i + rows", so that any range
+# of up to "rows" consolidated data points is a contiguous slice.
+#
+SUFFIX = ".ring"
+
+# Columns of the "state" array.
+STATE_LAST = 0         # last value given (counters).
+STATE_PDP_VALUE = 1    # rate times the seconds it was known for.
+STATE_PDP_KNOWN = 2    # seconds the rate was known for.
+STATE_ARCHIVES = 3     # then, for each archive: (value, known data points)
+
+# The largest value each kind of counter may hold, before wrapping around.
+COUNTER_LIMITS = (2.0 ** 32, 2.0 ** 64)
+
+
+class StoreError(Exception):
+    """An invalid operation on a data file."""
+    pass
+
+
+def parse_create_args(args):
+    """Return the step, start time, data sources and archives defined
+       by the same arguments as "rrdtool.create()", as a tuple."""
+    step = 300
+    start = int(time()) - 10
+    sources = []
+    archives = []
+
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+
+        if arg in ("--step", "-s"):
+            step = int(args.pop(0))
+        elif arg in ("--start", "-b"):
+            start = int(args.pop(0))
+        elif arg.startswith("DS:"):
+            name, kind, heartbeat, minimum, maximum = arg.split(":")[1:6]
+            sources.append((name, kind, int(heartbeat), _limit(minimum), _limit(maximum)))
+        elif arg.startswith("RRA:"):
+            function, xff, steps, rows = arg.split(":")[1:5]
+            archives.append((function, float(xff), int(steps), int(rows)))
+        else:
+            raise StoreError("unsupported argument \"%s\"" % arg)
+
+    return (step, start, sources, archives)
+
+
+def _limit(value):
+    if value == "U":
+        return float("nan")
+
+    return float(value)
+
+
+def _format_limit(value):
+    if value != value:
+        return "U"
+
+    return repr(value)
+
+
+def _value(text):
+    if text == "U":
+        return float("nan")
+
+    return float(text)
+
+
+class ArrayStore(object):
+    """A single data file."""
+    def __init__(self, path):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        """Map the data file, as currently described by its structure."""
+        self.version = _version(self.path)
+
+        self.step = None
+        self.sources = []
+        self.archives = []
+
+        f = open(self.path + "/meta", "r")
+
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+
+            if fields[0] == "step":
+                self.step = int(fields[1])
+            elif fields[0] == "ds":
+                self.sources.append((fields[1], fields[2], int(fields[3]), _limit(fields[4]), _limit(fields[5])))
+            elif fields[0] == "rra":
+                self.archives.append((fields[1], float(fields[2]), int(fields[3]), int(fields[4])))
+
+        f.close()
+
+        if self.step is None or not self.sources or not self.archives:
+            raise StoreError("damaged data file \"%s\"" % self.path)
+
+        self.names = tuple([source[0] for source in self.sources])
+        self.columns = dict([(name, i) for i, name in enumerate(self.names)])
+
+        # Archives read into memory (when enabled), with the time of the
+        # last update at that point: { archive : (last update, values) }
+        # The values are only copied when read a second time, before that
+        # they're None (most archives are only read once, by one graphic).
+        self.cache = None
+
+        # The columns for each template used to update the data file.
+        self.templates = {}
+
+        # Per data source settings, as vectors.
+        kinds = numpy.array([source[1] for source in self.sources])
+        self.gauges = kinds == "GAUGE"
+        self.counters = kinds == "COUNTER"
+        self.absolutes = kinds == "ABSOLUTE"
+        self.heartbeats = numpy.array([source[2] for source in self.sources], dtype=float)
+        self.minimums = numpy.array([source[3] for source in self.sources])
+        self.maximums = numpy.array([source[4] for source in self.sources])
+
+        count = len(self.sources)
+
+        self.clock = numpy.memmap(self.path + "/clock", dtype="<i8", mode="r+", shape=(1,))
+        self.state = numpy.memmap(self.path + "/state", dtype="<f8", mode="r+",
+                                  shape=(count, STATE_ARCHIVES + 2 * len(self.archives)))
+
+        self.data = []
+        for i, (function, xff, steps, rows) in enumerate(self.archives):
+            self.data.append(numpy.memmap("%s/rra%d" % (self.path, i), dtype="<f8", mode="r+", shape=(count, 2 * rows)))
+
+    def create(cls, path, *args):
+        """Create a data file, with the same arguments as "rrdtool.create()"."""
+        step, start, sources, archives = parse_create_args(args)
+
+        # Built aside and moved into place when complete, so that an interrupted
+        # create (eg. a full disk) doesn't leave behind a data file that can't
+        # be created again. Any such leftovers are cleared out first.
+        final = path
+        path = final + ".tmp"
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+        if os.path.isdir(final) and not os.path.exists(final + "/meta"):
+            shutil.rmtree(final)
+
+        os.makedirs(path)
+
+        f = open(path + "/clock", "wb")
+        numpy.array([start], dtype="<i8").tofile(f)
+        f.close()
+
+        state = numpy.zeros((len(sources), STATE_ARCHIVES + 2 * len(archives)), dtype="<f8")
+        state[:, STATE_LAST] = numpy.nan
+        for i, (function, xff, steps, rows) in enumerate(archives):
+            state[:, STATE_ARCHIVES + 2 * i] = _initial(function)
+
+        f = open(path + "/state", "wb")
+        state.tofile(f)
+        f.close()
+
+        for i, (function, xff, steps, rows) in enumerate(archives):
+            f = open("%s/rra%d" % (path, i), "wb")
+            archive = numpy.empty((len(sources), 2 * rows), dtype="<f8")
+            archive.fill(numpy.nan)
+            archive.tofile(f)
+            f.close()
+
+        # The structure goes in last, as only then is the data file complete.
+        _write_meta(path, step, sources, archives)
+
+        os.rename(path, final)
+
+    create = classmethod(create)
+
+    def last_update(self):
+        return int(self.clock[0])
+
+    def changed(self):
+        """Check if the structure of the data file has changed since it was
+           mapped (ie. data sources were added by some other process)."""
+        return _version(self.path) != self.version
+
+    def extend(self, *args):
+        """Add data sources, given as "DS:..." arguments for "rrdtool.create()".
+           Each archive file grows by as many rows, at the end of the file,
+           and the data already there stays untouched."""
+        step, start, sources, archives = parse_create_args(args)
+
+        for source in sources:
+            if source[0] in self.columns:
+                raise StoreError("data source \"%s\" already exists" % source[0])
+
+        state = numpy.zeros((len(sources), self.state.shape[1]), dtype="<f8")
+        state[:, STATE_LAST] = numpy.nan
+        for i, (function, xff, steps, rows) in enumerate(self.archives):
+            state[:, STATE_ARCHIVES + 2 * i] = _initial(function)
+
+        caching = self.cache is not None
+        self.close()
+
+        f = open(self.path + "/state", "ab")
+        state.tofile(f)
+        f.close()
+
+        for i, (function, xff, steps, rows) in enumerate(self.archives):
+            archive = numpy.empty((len(sources), 2 * rows), dtype="<f8")
+            archive.fill(numpy.nan)
+
+            f = open("%s/rra%d" % (self.path, i), "ab")
+            archive.tofile(f)
+            f.close()
+
+        _write_meta(self.path, self.step, self.sources + sources, self.archives)
+
+        self._open()
+        self.cache_reads(caching)
+
+    def drop(self, names):
+        """Remove data sources, given by name. Unlike adding them, this
+           means writing all the other rows of each file over again."""
+        keep = [i for i, name in enumerate(self.names) if name not in names]
+        if len(keep) == len(self.names):
+            return
+
+        if not keep:
+            raise StoreError("cannot remove all data sources")
+
+        sources = [self.sources[i] for i in keep]
+        keep = numpy.array(keep, dtype=int)
+
+        filenames = ["state"] + ["rra%d" % i for i in xrange(len(self.archives))]
+        for filename, array in zip(filenames, [self.state] + self.data):
+            f = open("%s/%s.tmp" % (self.path, filename), "wb")
+            array[keep].tofile(f)
+            f.close()
+
+        caching = self.cache is not None
+        self.close()
+
+        for filename in filenames:
+            os.rename("%s/%s.tmp" % (self.path, filename), "%s/%s" % (self.path, filename))
+
+        _write_meta(self.path, self.step, sources, self.archives)
+
+        self._open()
+        self.cache_reads(caching)
+
+    def update(self, template, samples):
+        """Add data points, given as a list of (timestamp, values) tuples,
+           where "values" is a string of values separated by ":", for the
+           data sources named (in the same order) in "template"."""
+        if template not in self.templates:
+            columns = []
+            for name in template.split(":"):
+                if name not in self.columns:
+                    raise StoreError("unknown data source \"%s\"" % name)
+                columns.append(self.columns[name])
+
+            self.templates[template] = numpy.array(columns, dtype=int)
+
+        columns = self.templates[template]
+
+        # Unknown values and counters starting over are to be expected.
+        errors = numpy.seterr(invalid="ignore", divide="ignore")
+
+        try:
+            for timestamp, values in samples:
+                given = numpy.empty(len(self.names))
+                given.fill(numpy.nan)
+                given[columns] = [_value(value) for value in values.split(":")]
+
+                self._update(int(timestamp), given)
+        finally:
+            numpy.seterr(**errors)
+
+    def _update(self, timestamp, given):
+        last = self.last_update()
+        elapsed = timestamp - last
+
+        if elapsed <= 0:
+            raise StoreError("illegal attempt to update using time %d when last update time is %d (minimum one second step)" \
+                             % (timestamp, last))
+
+        state = self.state
+        rate = self._rates(given, elapsed)
+
+        known = ~numpy.isnan(rate)
+        known_rate = numpy.where(known, rate, 0.0)
+
+        step = self.step
+        first = last // step + 1
+        current = timestamp // step
+
+        if current < first:
+            # Still within the same primary data point.
+            state[:, STATE_PDP_VALUE] += known_rate * elapsed
+            state[:, STATE_PDP_KNOWN] += known * elapsed
+        else:
+            # Complete the current primary data point...
+            seconds = first * step - last
+            value = state[:, STATE_PDP_VALUE] + known_rate * seconds
+            seconds_known = state[:, STATE_PDP_KNOWN] + known * seconds
+
+            with_value = seconds_known >= step / 2.0
+            completed = numpy.where(with_value, value / numpy.where(with_value, seconds_known, 1.0), numpy.nan)
+
+            # ...any other within the time elapsed all have the same rate.
+            for i in xrange(len(self.archives)):
+                self._consolidate(i, first, completed, current, rate)
+
+            seconds = timestamp - current * step
+            state[:, STATE_PDP_VALUE] = known_rate * seconds
+            state[:, STATE_PDP_KNOWN] = known * seconds
+
+        self.clock[0] = timestamp
+
+    def _rates(self, given, elapsed):
+        """Return the rate for each data source, from the values given."""
+        state = self.state
+
+        previous = state[:, STATE_LAST].copy()
+        state[:, STATE_LAST] = given
+
+        delta = given - previous
+
+        # Counters may have wrapped around since the last update.
+        wrapped = self.counters & (delta < 0)
+        for limit in COUNTER_LIMITS:
+            fixed = wrapped & (delta + limit >= 0)
+            delta[fixed] += limit
+            wrapped &= ~fixed
+
+        rate = numpy.where(self.absolutes, given, delta) / elapsed
+        rate[self.gauges] = given[self.gauges]
+
+        # Data sources not updated for too long are unknown.
+        rate[self.heartbeats < elapsed] = numpy.nan
+
+        # ...as are those out of bounds.
+        rate[rate < self.minimums] = numpy.nan
+        rate[rate > self.maximums] = numpy.nan
+
+        return rate
+
+    def _consolidate(self, archive, first, completed, last, rate):
+        """Feed an archive with the primary data points from "first" to
+           "last" (counted in steps since the epoch), the first of them
+           being "completed" and all others being "rate"."""
+        steps = self.archives[archive][2]
+
+        self._accumulate(archive, completed, 1)
+        if first % steps == 0:
+            self._complete(archive, first // steps)
+
+        if last == first:
+            return
+
+        end = (first // steps + 1) * steps
+        if last < end:
+            self._accumulate(archive, rate, last - first)
+            return
+
+        # Complete the current consolidated data point...
+        self._accumulate(archive, rate, end - first)
+        self._complete(archive, end // steps)
+
+        # ...then all the rest are the same.
+        if last // steps > end // steps:
+            self._write(archive, end // steps + 1, last // steps, rate)
+
+        remaining = last - (last // steps) * steps
+        if remaining:
+            self._accumulate(archive, rate, remaining)
+
+    def _accumulate(self, archive, values, count):
+        """Add "count" primary data points with "values" to an archive."""
+        function = self.archives[archive][0]
+        value_column = STATE_ARCHIVES + 2 * archive
+
+        known = ~numpy.isnan(values)
+        current = self.state[:, value_column]
+
+        if function == "AVERAGE":
+            self.state[:, value_column] = current + numpy.where(known, values, 0.0) * count
+        elif function == "MAX":
+            self.state[:, value_column] = numpy.fmax(current, values)
+        elif function == "MIN":
+            self.state[:, value_column] = numpy.fmin(current, values)
+        else:  # LAST
+            self.state[:, value_column] = numpy.where(known, values, current)
+
+        self.state[:, value_column + 1] += known * count
+
+    def _complete(self, archive, row):
+        """Write the consolidated data point being accumulated."""
+        function, xff, steps, rows = self.archives[archive]
+        value_column = STATE_ARCHIVES + 2 * archive
+
+        value = self.state[:, value_column]
+        count = self.state[:, value_column + 1]
+
+        with_value = (count > 0) & (count >= steps * (1.0 - xff))
+        if function == "AVERAGE":
+            value = value / numpy.where(with_value, count, 1.0)
+
+        self._write(archive, row, row, numpy.where(with_value, value, numpy.nan))
+
+        self.state[:, value_column] = _initial(function)
+        self.state[:, value_column + 1] = 0.0
+
+    def _write(self, archive, first, last, values):
+        """Write the same "values" into the rows from "first" to "last" (counted
+           in consolidated data points since the epoch) of an archive."""
+        rows = self.archives[archive][3]
+        data = self.data[archive]
+
+        # Older rows would be overwritten anyway.
+        first = max(first, last - rows + 1)
+
+        indexes = numpy.arange(first, last + 1) % rows
+        column = values.reshape(-1, 1)
+
+        data[:, indexes] = column
+        data[:, indexes + rows] = column
+
+    def archive_range(self, archive):
+        """Return the first and last rows (counted in consolidated data
+           points since the epoch) currently held by an archive."""
+        function, xff, steps, rows = self.archives[archive]
+
+        last = self.last_update() // self.step // steps
+        return (last - rows + 1, last)
+
+    def select(self, function, start, resolution=0):
+        """Return the archive best suited to fetch data from "start" on."""
+        candidates = []
+        for i, archive in enumerate(self.archives):
+            if archive[0] == function:
+                candidates.append((archive[2], i))
+
+        if not candidates:
+            raise StoreError("no archive with function \"%s\"" % function)
+
+        candidates.sort()
+
+        # The finest archive reaching far enough back in time, if any.
+        for steps, i in candidates:
+            seconds = steps * self.step
+            first, last = self.archive_range(i)
+
+            if seconds >= resolution and (first - 1) * seconds <= start + seconds:
+                return i
+
+        # Otherwise, the one reaching farther back.
+        return candidates[-1][1]
+
+    def cache_reads(self, enabled):
+        """Keep (or stop keeping) in memory each archive read, so that
+           fetching from it again doesn't touch the data file, as long as
+           it hasn't been updated in between."""
+        if enabled:
+            self.cache = self.cache or {}
+        else:
+            self.cache = None
+
+    def _cached(self, archive):
+        """Return the whole of an archive, from its oldest row on, copied into
+           memory if already read before (since the last update), otherwise
+           as a view into the data file."""
+        rows = self.archives[archive][3]
+        last_update = self.last_update()
+
+        offset = self.archive_range(archive)[0] % rows
+        values = self.data[archive][:, offset:offset + rows]
+
+        if archive not in self.cache or self.cache[archive][0] != last_update:
+            self.cache[archive] = (last_update, None)
+        elif self.cache[archive][1] is None:
+            self.cache[archive] = (last_update, numpy.array(values))
+
+        if self.cache[archive][1] is None:
+            return values
+
+        return self.cache[archive][1]
+
+    def fetch(self, function, start, end, resolution=0, sources=None):
+        """Return the data between "start" and "end" (with a step of at least
+           "resolution" seconds if possible), like "rrdtool.fetch()", except
+           for the values being an array with one row per data source. The
+           array is a view into the data file itself (or into the archive
+           kept in memory, if reads are cached), without copying, unless
+           only some "sources" (a list of names) are asked for."""
+        archive = self.select(function, start, resolution)
+        steps, rows = self.archives[archive][2:4]
+        seconds = steps * self.step
+
+        oldest, newest = self.archive_range(archive)
+
+        first = max(start // seconds + 1, oldest)
+        last = min(-(-end // seconds), newest)
+        if last < first:
+            last = first - 1
+
+        if self.cache is not None:
+            values = self._cached(archive)[:, first - oldest:last - oldest + 1]
+        else:
+            offset = first % rows
+            values = self.data[archive][:, offset:offset + last - first + 1]
+
+        names = self.names
+        if sources is not None:
+            try:
+                values = values[[self.columns[name] for name in sources]]
+            except KeyError, e:
+                raise StoreError("unknown data source %s" % e)
+
+            names = tuple(sources)
+
+        return (((first - 1) * seconds, last * seconds, seconds), names, values)
+
+    def load(self, archive, end, values):
+        """Overwrite the rows of an archive with "values" (one row per data
+           source), the last of them ending at "end". Used for importing."""
+        steps, rows = self.archives[archive][2:4]
+        seconds = steps * self.step
+
+        values = values[:, -rows:]
+        count = values.shape[1]
+        last = end // seconds
+
+        indexes = numpy.arange(last - count + 1, last + 1) % rows
+        self.data[archive][:, indexes] = values
+        self.data[archive][:, indexes + rows] = values
+
+    def set_state(self, timestamp, last_values):
+        """Set the time of the last update and the last value given for
+           each data source (eg. counters, for the rates). Used for importing."""
+        self.clock[0] = timestamp
+        self.state[:, STATE_LAST] = last_values
+
+    def close(self):
+        for array in [self.clock, self.state] + self.data:
+            array.flush()
+
+        self.clock = self.state = None
+        self.data = []
+
+
+def _write_meta(path, step, sources, archives):
+    """Write the structure of a data file, replacing the previous one at once."""
+    f = open(path + "/meta.tmp", "w")
+    f.write("step %d\n" % step)
+    for name, kind, heartbeat, minimum, maximum in sources:
+        f.write("ds %s %s %d %s %s\n" % (name, kind, heartbeat, _format_limit(minimum), _format_limit(maximum)))
+    for function, xff, steps, rows in archives:
+        f.write("rra %s %s %d %d\n" % (function, xff, steps, rows))
+    f.close()
+
+    os.rename(path + "/meta.tmp", path + "/meta")
+
+
+def _version(path):
+    """Return something that changes whenever the structure of a data file does."""
+    stat = os.stat(path + "/meta")
+    return (stat.st_ino, stat.st_mtime, stat.st_size)
+
+
+def _initial(function):
+    """Return the starting value for consolidating data points."""
+    if function == "AVERAGE":
+        return 0.0
+
+    return numpy.nan
+
+
+class ArrayBackend(object):
+    """Keeps the data files as memory-mapped arrays."""
+    def __init__(self):
+        if numpy is None:
+            raise StatsError("the \"array\" storage requires NumPy")
+
+        # Data files are kept open, so the arrays stay mapped between runs.
+        self.stores = {}
+        self.caching = False
+
+    def path(self, database):
+        """Return the directory for a data file named like an ".rrd" file."""
+        if database.endswith(".rrd"):
+            database = database[:-4]
+
+        return database + SUFFIX
+
+    def open(self, database):
+        if database in self.stores and self.stores[database].changed():
+            # Another process added data sources.
+            self.stores.pop(database).close()
+
+        if database not in self.stores:
+            path = self.path(database)
+            if not os.path.exists(path + "/meta"):
+                raise StoreError("opening '%s': No such file or directory" % path)
+
+            self.stores[database] = ArrayStore(path)
+            self.stores[database].cache_reads(self.caching)
+
+        return self.stores[database]
+
+    def exists(self, database):
+        return os.path.exists(self.path(database) + "/meta")
+
+    def databases(self, directory):
+        names = []
+        for filename in os.listdir(directory):
+            if filename.endswith(SUFFIX) and os.path.exists("%s/%s/meta" % (directory, filename)):
+                names.append(filename[:-len(SUFFIX)] + ".rrd")
+
+        return names
+
+    def create(self, database, *args):
+        ArrayStore.create(self.path(database), *args)
+
+    def sources(self, database):
+        return list(self.open(database).names)
+
+    def extend(self, database, *args):
+        self.open(database).extend(*args)
+
+    def remove(self, database, sources=None):
+        if sources is None:
+            if database in self.stores:
+                self.stores.pop(database).close()
+
+            shutil.rmtree(self.path(database))
+        else:
+            self.open(database).drop(dict.fromkeys(sources))
+
+    def update(self, database, template, samples):
+        self.open(database).update(template, samples)
+
+    def fetch(self, database, function, start, end, resolution=0, sources=None):
+        from components import storage
+
+        storage.rrdtool_calls.add()
+        return self.open(database).fetch(function, start, end, resolution, sources)
+
+    def cache_reads(self, enabled):
+        self.caching = enabled
+
+        for store in self.stores.values():
+            store.cache_reads(enabled)
+
+    def graph(self, filename, *args):
+        from components import chart, storage
+
+        # Through "storage.fetch()", so that each read is counted.
+        chart.Chart(args, storage.fetch).write(filename)
+
+    def close(self):
+        for store in self.stores.values():
+            store.close()
+
+        self.stores = {}
+
+
+# EOF - arraystore.py
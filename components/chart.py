@@ -0,0 +1,1016 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# chart.py - graphics drawn without rrdtool
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Graphics drawn with NumPy into PNG files, from the same arguments as
+   "rrdtool.graph()" (as far as the components use them), for data files
+   rrdtool can't read. Their data can also be exported into JSON files
+   (from either kind of data file), for the pages to draw them instead."""
+
+
+import os
+import re
+import zlib
+import struct
+import calendar
+
+from math import log, floor, ceil
+from time import time, localtime, mktime, strftime
+
+from components.common import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Only since Python 2.6, for exporting the data of the graphics.
+try:
+    import json
+except ImportError:
+    json = None
+
+
+#
+# A 5x8 pixel font for the printable ASCII characters, one byte per
+# column (the least significant bit at the top), 5 columns per character.
+#
+FONT = "0000000000" "00005f0000" "0007000700" "147f147f14" "242a7f2a12" \
+       "2313086462" "3649562050" "0008070300" "001c224100" "0041221c00" \
+       "2a1c7f1c2a" "08083e0808" "0080703000" "0808080808" "0000606000" \
+       "2010080402" "3e5149453e" "00427f4000" "7249494946" "2141494d33" \
+       "1814127f10" "2745454539" "3c4a494931" "4121110907" "3649494936" \
+       "464949291e" "0000140000" "0040340000" "0008142241" "1414141414" \
+       "0041221408" "0201590906" "3e415d594e" "7c1211127c" "7f49494936" \
+       "3e41414122" "7f4141413e" "7f49494941" "7f09090901" "3e41415173" \
+       "7f0808087f" "00417f4100" "2040413f01" "7f08142241" "7f40404040" \
+       "7f021c027f" "7f0408107f" "3e4141413e" "7f09090906" "3e4151215e" \
+       "7f09192946" "2649494932" "03017f0103" "3f4040403f" "1f2040201f" \
+       "3f4038403f" "6314081463" "0304780403" "6159494d43" "007f414141" \
+       "0204081020" "004141417f" "0402010204" "4040404040" "0003070800" \
+       "2054547840" "7f28444438" "3844444428" "384444287f" "3854545418" \
+       "00087e0902" "18a4a49c78" "7f08040478" "00447d4000" "2040403d00" \
+       "7f10284400" "00417f4000" "7c04780478" "7c08040478" "3844444438" \
+       "fc18242418" "18242418fc" "7c08040408" "4854545424" "04043f4424" \
+       "3c4040207c" "1c2040201c" "3c4030403c" "4428102844" "4c9090907c" \
+       "4464544c44" "0008364100" "0000770000" "0041360800" "0201020402"
+
+CHAR_WIDTH = 6
+CHAR_HEIGHT = 8
+LINE_HEIGHT = 14
+
+# Room around the graph itself, in pixels.
+MARGIN_LEFT = 74
+MARGIN_RIGHT = 20
+MARGIN_TOP = 24
+MARGIN_BOTTOM = 24
+
+# The colors not set through "--color".
+DEFAULT_COLORS = { "BACK"   : "#f0f0f0",
+                   "CANVAS" : "#ffffff",
+                   "SHADEA" : "#cfcfcf",
+                   "SHADEB" : "#9e9e9e",
+                   "GRID"   : "#e0e0e0",
+                   "MGRID"  : "#f0b0b0",
+                   "FONT"   : "#000000",
+                   "AXIS"   : "#2c4d43" }
+
+#
+# Relative times (eg. "-1day"), and the grid and labels of the time axis,
+# for graphics up to a given length: (length, grid, labels, label format)
+#
+TIME_UNITS = { "s"      : 1,
+               "min"    : 60,
+               "h"      : 3600,
+               "hour"   : 3600,
+               "day"    : 86400,
+               "d"      : 86400,
+               "week"   : 604800,
+               "w"      : 604800,
+               "month"  : 2678400,
+               "m"      : 2678400,
+               "year"   : 31536000,
+               "y"      : 31536000 }
+
+TIME_AXES = ((2 * 86400, 3600, 4 * 3600, "%H:%M"),
+             (10 * 86400, 6 * 3600, 86400, "%a"),
+             (40 * 86400, 86400, 7 * 86400, "%d %b"),
+             (None, "month", "month", "%b"))
+
+# Options taking a value, by their long and short names.
+VALUE_OPTIONS = { "--start"          : "-s",
+                  "--end"            : "-e",
+                  "--step"           : "-S",
+                  "--title"          : "-t",
+                  "--vertical-label" : "-v",
+                  "--width"          : "-w",
+                  "--height"         : "-h",
+                  "--upper-limit"    : "-u",
+                  "--lower-limit"    : "-l",
+                  "--base"           : "-b",
+                  "--units-exponent" : "-X",
+                  "--imgformat"      : "-a",
+                  "--color"          : "-c" }
+
+# Prefixes for the values on the vertical axis, by their exponent.
+PREFIXES = { -3 : "n", -2 : "u", -1 : "m", 0 : "", 1 : "k", 2 : "M", 3 : "G", 4 : "T", 5 : "P" }
+
+# Splits arguments at the colons that aren't escaped.
+FIELDS = re.compile(r"(?<!\\):")
+
+# The colors of a heatmap, evenly spread from zero to the highest value.
+HEATMAP_COLORS = ("#ffffff", "#ffe680", "#f5a000", "#d02000", "#600000")
+
+# Rows of a heatmap are as tall as the text, unless there are too many of them.
+HEATMAP_HEIGHT = 400
+
+
+def _glyphs():
+    """Return the font as an array of characters, rows and columns."""
+    glyphs = numpy.zeros((len(FONT) / 10, CHAR_HEIGHT, 5), dtype=bool)
+
+    for char in xrange(glyphs.shape[0]):
+        for column in xrange(5):
+            bits = int(FONT[char * 10 + column * 2:char * 10 + column * 2 + 2], 16)
+            for row in xrange(CHAR_HEIGHT):
+                glyphs[char, row, column] = bits & (1 << row)
+
+    return glyphs
+
+
+_font = None
+
+
+def parse_color(text):
+    """Return a "#rrggbb" (or "#rrggbbaa") color as a tuple of integers."""
+    text = text.lstrip("#")
+    return (int(text[0:2], 16), int(text[2:4], 16), int(text[4:6], 16))
+
+
+def parse_time(text, now, end=None):
+    """Return the time for an "rrdtool" time specification, as used in the
+       "--start" and "--end" options (eg. "-1day", relative to now)."""
+    reference = now
+    if text.startswith("end") or text.startswith("e-"):
+        reference = end
+        text = text[text.index("-"):]
+    elif text.startswith("now"):
+        text = text[3:] or "0"
+
+    match = re.match(r"^([+-]?)(\d+)([a-z]*)$", text)
+    if not match:
+        raise StatsError("unsupported time specification \"%s\"" % text)
+
+    sign, count, unit = match.groups()
+    seconds = int(count) * TIME_UNITS.get(unit, 1)
+
+    if not sign and not unit:
+        return seconds  # absolute (since the epoch).
+
+    if sign == "-":
+        return reference - seconds
+
+    return reference + seconds
+
+
+def unescape(text):
+    """Return the text for a legend, and whether it ends its line."""
+    newline = text.endswith("\\n")
+    if newline:
+        text = text[:-2]
+
+    return (text.replace("\\:", ":"), newline)
+
+
+def gprint_format(text):
+    """Return the format of a "GPRINT" (for the "%" operator), and whether it ends its line."""
+    return unescape(text.replace("%lf", "%f").replace("lf", "f").replace("%le", "%e").replace("%lg", "%g"))
+
+
+def format_value(values, function, text):
+    """Return the text of a "GPRINT" for a series, and whether it ends its line."""
+    text, newline = gprint_format(text)
+
+    try:
+        text = text % consolidate(values, function)
+    except (TypeError, ValueError):
+        pass
+
+    return (text, newline)
+
+
+def rpn(expression, variables):
+    """Evaluate a CDEF expression, in reverse polish notation."""
+    stack = []
+
+    for token in expression.split(","):
+        if token in variables:
+            stack.append(variables[token])
+        elif token == "UN":
+            stack.append(numpy.isnan(stack.pop()).astype(float))
+        elif token == "IF":
+            otherwise = stack.pop()
+            then = stack.pop()
+            condition = stack.pop()
+            stack.append(numpy.where(numpy.nan_to_num(condition) != 0, then, otherwise))
+        elif token == "UNKN":
+            stack.append(numpy.nan)
+        elif token == "INF":
+            stack.append(numpy.inf)
+        elif token == "NEGINF":
+            stack.append(-numpy.inf)
+        elif token == "ABS":
+            stack.append(numpy.abs(stack.pop()))
+        elif token in OPERATORS:
+            right = stack.pop()
+            left = stack.pop()
+            stack.append(OPERATORS[token](left, right))
+        else:
+            try:
+                stack.append(float(token))
+            except ValueError:
+                raise StatsError("unsupported CDEF token \"%s\"" % token)
+
+    if len(stack) != 1:
+        raise StatsError("invalid CDEF \"%s\"" % expression)
+
+    return stack[0]
+
+
+def _compare(function):
+    def compare(left, right):
+        # Comparisons with unknown values are unknown.
+        result = function(left, right).astype(float)
+        return numpy.where(numpy.isnan(left) | numpy.isnan(right), numpy.nan, result)
+
+    return compare
+
+
+if numpy is not None:
+    OPERATORS = { "+"   : numpy.add,
+                  "-"   : numpy.subtract,
+                  "*"   : numpy.multiply,
+                  "/"   : numpy.divide,
+                  "%"   : numpy.fmod,
+                  "MAX" : numpy.maximum,
+                  "MIN" : numpy.minimum,
+                  "LT"  : _compare(numpy.less),
+                  "LE"  : _compare(numpy.less_equal),
+                  "GT"  : _compare(numpy.greater),
+                  "GE"  : _compare(numpy.greater_equal),
+                  "EQ"  : _compare(numpy.equal),
+                  "NE"  : _compare(numpy.not_equal) }
+
+
+def consolidate(values, function):
+    """Return a single value for a series, as "GPRINT" does."""
+    known = values[~numpy.isnan(values)]
+    if not len(known):
+        return numpy.nan
+
+    if function == "LAST":
+        return known[-1]
+    elif function == "FIRST":
+        return known[0]
+    elif function == "MAX":
+        return known.max()
+    elif function == "MIN":
+        return known.min()
+    elif function == "TOTAL":
+        return known.sum()
+
+    return known.mean()
+
+
+def resample(series, first, step, times):
+    """Return the values of a series (starting at "first", with a data
+       point every "step" seconds) at the given times. The series may
+       also be an array with several rows, all resampled at once."""
+    count = series.shape[-1]
+    if not count:
+        return numpy.nan * numpy.ones(series.shape[:-1] + (len(times),))
+
+    indexes = numpy.ceil((times - first) / float(step)).astype(int) - 1
+    valid = (indexes >= 0) & (indexes < count)
+
+    return numpy.where(valid, series[..., numpy.clip(indexes, 0, count - 1)], numpy.nan)
+
+
+def write_png(filename, pixels):
+    """Write an array of (rows, columns, 3) bytes into a PNG file."""
+    height, width = pixels.shape[:2]
+
+    # Each row starts with its filter type (none).
+    raw = numpy.zeros((height, width * 3 + 1), dtype=numpy.uint8)
+    raw[:, 1:] = pixels.reshape(height, width * 3)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    f = open(filename, "wb")
+    f.write("\x89PNG\r\n\x1a\n")
+    f.write(chunk("IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+    f.write(chunk("IDAT", zlib.compress(raw.tostring(), 6)))
+    f.write(chunk("IEND", ""))
+    f.close()
+
+
+def value_label(value, base, exponent=None):
+    """Return a value for an axis label, with a prefix for its magnitude
+       (eg. "1.5 k"), as a power of "exponent" if given."""
+    if exponent is None:
+        exponent = 0
+        if value:
+            exponent = int(floor(log(abs(value), base)))
+        exponent = max(min(exponent, max(PREFIXES.keys())), min(PREFIXES.keys()))
+
+    scaled = value / float(base) ** exponent
+    text = ("%.1f" % scaled).rstrip("0").rstrip(".")
+
+    return ("%s %s" % (text, PREFIXES.get(exponent, ""))).rstrip()
+
+
+def json_values(values):
+    """Return a series as a list for JSON, with six significant digits
+       and None (null) for unknown (or infinite) values."""
+    result = []
+    for value, known in zip(values.tolist(), numpy.isfinite(values).tolist()):
+        if known:
+            result.append(float("%.6g" % value))
+        else:
+            result.append(None)
+
+    return result
+
+
+def latest(data, count):
+    """Return the last "count" data points of a graphic's (or heatmap's)
+       exported data, for the pages to add to the data they have."""
+    if data["kind"] == "heatmap":
+        series = data["rows"]
+        points = { "rows" : [values[-count:] for values in series] }
+    else:
+        series = data["variables"].values()
+        points = { "variables" : {} }
+        for name, values in data["variables"].items():
+            points["variables"][name] = values[-count:]
+
+    if not series:
+        return None
+
+    points.update({ "start" : data["start"],
+                    "end"   : data["end"],
+                    "first" : data["first"] + max(len(series[0]) - count, 0) * data["step"],
+                    "step"  : data["step"] })
+
+    return points
+
+
+def write_json(filename, data):
+    """Write data into a JSON file, replacing the previous one at once (a page may be reading it)."""
+    if json is None:
+        raise StatsError("exporting data requires Python 2.6 or newer")
+
+    f = open(filename + ".tmp", "w")
+    json.dump(data, f, separators=(",", ":"))
+    f.close()
+
+    os.rename(filename + ".tmp", filename)
+
+
+def time_axis(start, end):
+    """Return the grid spacing, the label spacing and the label format
+       for the time axis of a graphic from "start" to "end"."""
+    for length, spacing, label_spacing, label_format in TIME_AXES:
+        if length is None or end - start <= length:
+            break
+
+    return (spacing, label_spacing, label_format)
+
+
+def time_marks(start, end, spacing):
+    """Return the times for the marks along the time axis, every
+       "spacing" seconds (or "month"), aligned to the local time."""
+    marks = []
+
+    if spacing == "month":
+        year, month = localtime(start)[:2]
+        while True:
+            mark = mktime((year, month, 1, 0, 0, 0, 0, 0, -1))
+            if mark > end:
+                break
+            if mark >= start:
+                marks.append(mark)
+            year, month = year + month / 12, month % 12 + 1
+
+        return marks
+
+    offset = calendar.timegm(localtime(start)) - start
+    mark = start - (start + offset) % min(spacing, 86400)
+    if spacing > 86400:
+        # Weeks start on monday.
+        mark += (7 - localtime(mark)[6]) % 7 * 86400
+
+    while mark <= end:
+        if mark >= start:
+            marks.append(mark)
+        mark += spacing
+
+    return marks
+
+
+class Canvas(object):
+    """An image to draw on."""
+    def __init__(self, width, height, color):
+        self.pixels = numpy.empty((height, width, 3), dtype=numpy.uint8)
+        self.pixels[:, :] = color
+
+    def fill(self, x, y, width, height, color):
+        self.pixels[max(y, 0):max(y + height, 0), max(x, 0):max(x + width, 0)] = color
+
+    def text(self, x, y, text, color, vertical=False):
+        """Write some text, starting at the top left corner (or, if
+           "vertical", the bottom left corner, reading upwards)."""
+        global _font
+        if _font is None:
+            _font = _glyphs()
+
+        height, width = self.pixels.shape[:2]
+
+        for char in text:
+            code = ord(char) - 32
+            if code < 0 or code >= len(_font):
+                code = ord("?") - 32
+
+            glyph = _font[code]
+            if vertical:
+                glyph = numpy.rot90(glyph)
+                top, left = y - glyph.shape[0], x
+                y -= CHAR_WIDTH
+            else:
+                top, left = y, x
+                x += CHAR_WIDTH
+
+            if top < 0 or left < 0 or top + glyph.shape[0] > height or left + glyph.shape[1] > width:
+                continue
+
+            self.pixels[top:top + glyph.shape[0], left:left + glyph.shape[1]][glyph] = color
+
+    def write(self, filename):
+        write_png(filename, self.pixels)
+
+
+class Chart(object):
+    """A graphic, defined by the arguments to "rrdtool.graph()". Data
+       is read through "fetch", with the same arguments as the storage
+       backends' fetch() method."""
+    def __init__(self, args, fetch):
+        if numpy is None:
+            raise StatsError("drawing graphics requires NumPy")
+
+        self.fetch = fetch
+
+        self.options = {}
+        self.flags = []
+        self.colors = DEFAULT_COLORS.copy()
+        self.elements = []
+
+        short_names = dict([(short, name) for name, short in VALUE_OPTIONS.items()])
+
+        args = list(args)
+        while args:
+            arg = args.pop(0)
+
+            if arg.startswith("-") and not arg[1:].isdigit():
+                name = short_names.get(arg, arg)
+                if name not in VALUE_OPTIONS:
+                    self.flags.append(name)
+                    continue
+
+                value = args.pop(0)
+                if name == "--color":
+                    name, color = value.split("#", 1)
+                    self.colors[name] = "#" + color
+                else:
+                    self.options[name] = value
+            else:
+                self.elements.append([field for field in FIELDS.split(arg)])
+
+    def _option(self, name, default=None, kind=str):
+        if name not in self.options:
+            return default
+
+        return kind(self.options[name])
+
+    def _data(self, start, end, width):
+        """Return the time of each data point and the values for each
+           variable, as a tuple: (first, step, variables)"""
+        variables = {}
+
+        # Each data file is read once, for all data sources needed from it.
+        wanted = {}
+        for element in self.elements:
+            if element[0] == "DEF":
+                database = element[1].split("=", 1)[1]
+                sources = wanted.setdefault((database, element[3]), [])
+                if element[2] not in sources:
+                    sources.append(element[2])
+
+        fetched = {}
+        for (database, function), sources in wanted.items():
+            fetched[(database, function)] = self.fetch(database, function, start, end, (end - start) / width, sources)
+
+        timeline = None
+        for element in self.elements:
+            if element[0] == "DEF":
+                name, database = element[1].split("=", 1)
+                source, function = element[2:4]
+
+                (first, last, step), names, values = fetched[(database, function)]
+                series = numpy.asarray(values[list(names).index(source)], dtype=float)
+
+                if timeline is None:
+                    timeline = (first, step, len(series))
+                elif (first, step, len(series)) != timeline:
+                    # Data points are matched to those of the first definition.
+                    times = timeline[0] + timeline[1] * numpy.arange(1, timeline[2] + 1)
+                    series = resample(series, first, step, times)
+
+                variables[name] = series
+            elif element[0] == "CDEF":
+                name, expression = element[1].split("=", 1)
+                variables[name] = numpy.asarray(rpn(expression, variables), dtype=float) * numpy.ones(timeline[2])
+
+        if timeline is None:
+            timeline = (start, end - start, 0)
+
+        return (timeline[0], timeline[1], variables)
+
+    def _scale(self, values, lower, upper, rigid):
+        """Return the limits of the vertical axis and the grid step."""
+        known = [series[~numpy.isnan(series)] for series in values]
+        known = [series for series in known if len(series)]
+
+        if known:
+            highest = max([series.max() for series in known])
+            lowest = min([series.min() for series in known])
+
+            if upper is None or (not rigid and highest > upper):
+                upper = highest
+            if lower is None or (not rigid and lowest < lower):
+                lower = lowest
+
+        if lower is None:
+            lower = 0.0
+        if upper is None or upper <= lower:
+            upper = lower + 1.0
+
+        # Grid lines at "round" values, about four of them.
+        rough = (upper - lower) / 4.0
+        magnitude = 10.0 ** floor(log(rough, 10))
+        for factor in (1.0, 2.0, 5.0, 10.0):
+            grid = factor * magnitude
+            if grid >= rough:
+                break
+
+        if not rigid:
+            upper = ceil(upper / grid - 1e-9) * grid
+            lower = floor(lower / grid + 1e-9) * grid
+
+        return (lower, upper, grid)
+
+    def _range(self):
+        """Return the times shown and the width of the graphic, as a tuple: (start, end, width)"""
+        now = int(time())
+        end = parse_time(self._option("--end", "now"), now)
+        start = parse_time(self._option("--start", "end-1day"), now, end)
+
+        return (start, end, self._option("--width", 400, int))
+
+    def _axis(self, lower, upper, grid):
+        """Return the horizontal grid lines, as a list of tuples: (value, label)"""
+        base = self._option("--base", 1000, int)
+        exponent = self._option("--units-exponent", None, int)
+
+        lines = []
+        value = lower
+        while value <= upper + grid / 2.0:
+            lines.append((value, value_label(value, base, exponent)))
+            value += grid
+
+        return lines
+
+    def write(self, filename):
+        """Draw the graphic into a PNG file."""
+        start, end, width = self._range()
+        height = self._option("--height", 100, int)
+
+        first, step, variables = self._data(start, end, width)
+
+        # The time at the end of each column of pixels.
+        times = start + (numpy.arange(width) + 1) * (end - start) / float(width)
+
+        # What to draw, with their values stacked as needed.
+        shapes = []
+        previous = numpy.zeros(width)
+        legend = []
+
+        for element in self.elements:
+            kind = element[0]
+
+            if kind in ("AREA", "STACK", "TICK") or kind.startswith("LINE"):
+                name, color = (element[1].split("#", 1) + [None])[:2]
+                values = resample(variables[name], first, step, times)
+
+                text = None
+                if kind == "TICK":
+                    fraction = float(element[2])
+                    text = (element[3:] or [None])[0]
+                    shapes.append((kind, parse_color(color), values, fraction))
+                else:
+                    bottom = numpy.nan * numpy.ones(width)
+                    if kind == "STACK":
+                        bottom = previous
+                        values = previous + values
+
+                    text = (element[2:] or [None])[0]
+                    if color:
+                        shapes.append((kind, parse_color(color), values, bottom))
+                    previous = values
+
+                if text is not None:
+                    legend.append((parse_color(color or "#ffffff"), unescape(text)))
+            elif kind == "GPRINT":
+                legend.append((None, format_value(variables[element[1]], element[2], element[3])))
+            elif kind == "COMMENT":
+                legend.append((None, unescape(":".join(element[1:]))))
+
+        lower, upper, grid = self._scale([values for kind, color, values, extra in shapes if kind != "TICK"],
+                                         self._option("--lower-limit", None, float),
+                                         self._option("--upper-limit", None, float),
+                                         "--rigid" in self.flags)
+
+        # Lay out the legend, wrapping lines too long to fit.
+        lines = [[]]
+        line_width = 0
+        for color, (text, newline) in legend:
+            item_width = len(text) * CHAR_WIDTH + (color and 12 or 0) + CHAR_WIDTH
+            if line_width and line_width + item_width > width + MARGIN_LEFT:
+                lines.append([])
+                line_width = 0
+
+            lines[-1].append((color, text))
+            line_width += item_width
+
+            if newline:
+                lines.append([])
+                line_width = 0
+
+        lines = [line for line in lines if line]
+
+        image_width = MARGIN_LEFT + width + MARGIN_RIGHT
+        image_height = MARGIN_TOP + height + MARGIN_BOTTOM + len(lines) * LINE_HEIGHT + 4
+
+        colors = {}
+        for name, value in self.colors.items():
+            colors[name] = parse_color(value)
+
+        canvas = Canvas(image_width, image_height, colors["BACK"])
+        canvas.fill(0, 0, image_width, 1, colors["SHADEA"])
+        canvas.fill(0, 0, 1, image_height, colors["SHADEA"])
+        canvas.fill(0, image_height - 1, image_width, 1, colors["SHADEB"])
+        canvas.fill(image_width - 1, 0, 1, image_height, colors["SHADEB"])
+
+        plot = canvas.pixels[MARGIN_TOP:MARGIN_TOP + height, MARGIN_LEFT:MARGIN_LEFT + width]
+        plot[:, :] = colors["CANVAS"]
+
+        # The grid, and the labels for the vertical axis.
+        for value, label in self._axis(lower, upper, grid):
+            y = MARGIN_TOP + height - 1 - int(round((value - lower) / (upper - lower) * (height - 1)))
+            canvas.fill(MARGIN_LEFT, y, width, 1, colors["GRID"])
+            canvas.text(MARGIN_LEFT - 6 - len(label) * CHAR_WIDTH, y - CHAR_HEIGHT / 2, label, colors["FONT"])
+
+        spacing, label_spacing, label_format = time_axis(start, end)
+
+        for mark in time_marks(start, end, spacing):
+            x = MARGIN_LEFT + int((mark - start) * width / float(end - start))
+            canvas.fill(x, MARGIN_TOP, 1, height, colors["GRID"])
+
+        for mark in time_marks(start, end, label_spacing):
+            x = MARGIN_LEFT + int((mark - start) * width / float(end - start))
+            canvas.fill(x, MARGIN_TOP, 1, height, colors["MGRID"])
+
+            label = strftime(label_format, localtime(mark))
+            canvas.text(x - len(label) * CHAR_WIDTH / 2, MARGIN_TOP + height + 5, label, colors["FONT"])
+
+        # The data itself, all columns of pixels at once.
+        rows = numpy.arange(height).reshape(-1, 1)
+
+        def row_of(values):
+            position = (numpy.clip(values, lower, upper) - lower) / (upper - lower) * (height - 1)
+            return height - 1 - numpy.round(numpy.nan_to_num(position)).astype(int)
+
+        for kind, color, values, extra in shapes:
+            known = ~numpy.isnan(values)
+
+            if kind == "TICK":
+                shown = known & (numpy.nan_to_num(values) != 0)
+                top = height - int(round(extra * height))
+                mask = (rows >= top) & shown
+            elif kind.startswith("LINE"):
+                thickness = int(float(kind[4:] or 1))
+                y = row_of(values)
+
+                # Each column joins the previous one, when both are known.
+                y_previous = numpy.concatenate((y[:1], y[:-1]))
+                known_previous = numpy.concatenate((known[:1], known[:-1]))
+                y_previous = numpy.where(known_previous, y_previous, y)
+
+                top = numpy.minimum(y, y_previous) - (thickness - 1) / 2
+                bottom = numpy.maximum(y, y_previous) + thickness / 2
+                mask = (rows >= top) & (rows <= bottom) & known
+            else:
+                top = row_of(values)
+                bottom = row_of(numpy.where(numpy.isnan(extra), lower, extra))
+                mask = (rows >= top) & (rows <= bottom) & known
+
+            plot[mask] = color
+
+        canvas.fill(MARGIN_LEFT - 1, MARGIN_TOP, 1, height + 1, colors["AXIS"])
+        canvas.fill(MARGIN_LEFT - 1, MARGIN_TOP + height, width + 1, 1, colors["AXIS"])
+
+        # The titles.
+        title = self._option("--title", "")
+        canvas.text((image_width - len(title) * CHAR_WIDTH) / 2, 8, title, colors["FONT"])
+
+        label = self._option("--vertical-label", "")
+        canvas.text(6, MARGIN_TOP + (height + len(label) * CHAR_WIDTH) / 2, label, colors["FONT"], vertical=True)
+
+        # The legend.
+        y = MARGIN_TOP + height + MARGIN_BOTTOM
+        for line in lines:
+            x = MARGIN_LEFT / 2
+            for color, text in line:
+                if color is not None:
+                    canvas.fill(x, y, 8, 8, colors["FONT"])
+                    canvas.fill(x + 1, y + 1, 6, 6, color)
+                    x += 12
+
+                canvas.text(x, y, text, colors["FONT"])
+                x += (len(text) + 1) * CHAR_WIDTH
+
+            y += LINE_HEIGHT
+
+        canvas.write(filename)
+
+    def export(self, filename, **extra):
+        """Write the data of the graphic (and anything in "extra") into a
+           JSON file, to be drawn elsewhere (eg. by the pages, in the
+           browser), and return it. The variables drawn or printed hold
+           their values as read from the archive (or calculated from them),
+           one per data point, the "i"th ending at "first + (i + 1) * step".
+           The axes and legend come ready to draw, as in write(), along with
+           what's needed to redo them when new data points are added."""
+        start, end, width = self._range()
+        first, step, variables = self._data(start, end, width)
+
+        series = []
+        shown = []
+        previous = None
+        legend = []
+        exported = {}
+
+        for element in self.elements:
+            kind = element[0]
+
+            if kind in ("AREA", "STACK", "TICK") or kind.startswith("LINE"):
+                name, color = (element[1].split("#", 1) + [None])[:2]
+                if color:
+                    color = "#" + color
+
+                values = variables[name]
+                exported[name] = json_values(values)
+                entry = { "kind" : kind, "color" : color, "name" : name }
+
+                text = None
+                if kind == "TICK":
+                    entry["fraction"] = float(element[2])
+                    text = (element[3:] or [None])[0]
+                else:
+                    # Stacked by the client, but needed here for the scale.
+                    if kind == "STACK" and previous is not None:
+                        values = previous + values
+
+                    text = (element[2:] or [None])[0]
+                    if color:
+                        shown.append(values)
+                    previous = values
+
+                series.append(entry)
+
+                if text is not None:
+                    legend.append((color or "#ffffff",) + unescape(text))
+            elif kind == "GPRINT":
+                # Along with the text, what it's made from (to be redone).
+                name, function = element[1:3]
+                exported[name] = json_values(variables[name])
+                legend.append((None,) + format_value(variables[name], function, element[3])
+                              + (name, function, gprint_format(element[3])[0]))
+            elif kind == "COMMENT":
+                legend.append((None,) + unescape(":".join(element[1:])))
+
+        limits = (self._option("--lower-limit", None, float), self._option("--upper-limit", None, float))
+        lower, upper, grid = self._scale(shown, limits[0], limits[1], "--rigid" in self.flags)
+
+        spacing, label_spacing, label_format = time_axis(start, end)
+
+        data = { "kind"      : "graph",
+                 "title"     : self._option("--title", ""),
+                 "label"     : self._option("--vertical-label", ""),
+                 "start"     : start,
+                 "end"       : end,
+                 "width"     : width,
+                 "height"    : self._option("--height", 100, int),
+                 "first"     : first,
+                 "step"      : step,
+                 "limits"    : limits,
+                 "rigid"     : "--rigid" in self.flags,
+                 "base"      : self._option("--base", 1000, int),
+                 "exponent"  : self._option("--units-exponent", None, int),
+                 "lower"     : lower,
+                 "upper"     : upper,
+                 "axis"      : self._axis(lower, upper, grid),
+                 "time_axis" : (spacing, label_spacing, label_format),
+                 "grid"      : time_marks(start, end, spacing),
+                 "marks"     : [(mark, strftime(label_format, localtime(mark)))
+                                for mark in time_marks(start, end, label_spacing)],
+                 "colors"    : self.colors,
+                 "variables" : exported,
+                 "series"    : series,
+                 "legend"    : legend }
+
+        data.update(extra)
+        write_json(filename, data)
+
+        return data
+
+
+def write_heatmap(filename, names, first, step, values, start, end, width, title="", label="",
+                  upper=None, base=1000, colors={}):
+    """Draw a heatmap into a PNG file, with one row of pixels for each of
+       "names" and the matching row of "values" (a data point every "step"
+       seconds, starting at "first") spread across "width" columns, from
+       "start" to "end". Colors go from white (zero) to dark red ("upper",
+       or the highest value, if not given), and unknown values are blank.
+       The whole array is colored at once, however many rows there are."""
+    if numpy is None:
+        raise StatsError("drawing graphics requires NumPy")
+
+    times = start + (numpy.arange(width) + 1) * (end - start) / float(width)
+    cells = resample(numpy.asarray(values, dtype=float).reshape(len(names), -1), first, step, times)
+
+    known = ~numpy.isnan(cells)
+    if upper is None:
+        upper = 0.0
+        if known.any():
+            upper = cells[known].max()
+
+    if upper <= 0:
+        upper = 1.0
+
+    palette = numpy.array([parse_color(color) for color in HEATMAP_COLORS], dtype=float)
+    stops = numpy.linspace(0.0, 1.0, len(palette))
+    fraction = numpy.clip(numpy.nan_to_num(cells) / upper, 0.0, 1.0)
+
+    all_colors = DEFAULT_COLORS.copy()
+    all_colors.update(colors)
+    for name, value in all_colors.items():
+        all_colors[name] = parse_color(value)
+
+    row_height = max(1, min(LINE_HEIGHT, HEATMAP_HEIGHT / max(len(names), 1)))
+    height = row_height * len(names)
+
+    image_width = MARGIN_LEFT + width + MARGIN_RIGHT
+    image_height = MARGIN_TOP + height + MARGIN_BOTTOM + LINE_HEIGHT + 4
+
+    canvas = Canvas(image_width, image_height, all_colors["BACK"])
+    canvas.fill(0, 0, image_width, 1, all_colors["SHADEA"])
+    canvas.fill(0, 0, 1, image_height, all_colors["SHADEA"])
+    canvas.fill(0, image_height - 1, image_width, 1, all_colors["SHADEB"])
+    canvas.fill(image_width - 1, 0, 1, image_height, all_colors["SHADEB"])
+
+    plot = canvas.pixels[MARGIN_TOP:MARGIN_TOP + height, MARGIN_LEFT:MARGIN_LEFT + width]
+    for channel in xrange(3):
+        plot[:, :, channel] = numpy.interp(fraction, stops, palette[:, channel]).round().repeat(row_height, axis=0)
+
+    plot[~known.repeat(row_height, axis=0)] = all_colors["GRID"]
+
+    # The names, skipping rows when they don't fit.
+    every = int(ceil(float(CHAR_HEIGHT + 2) / row_height))
+    characters = (MARGIN_LEFT - 8) / CHAR_WIDTH
+    for row in xrange(0, len(names), every):
+        text = names[row][:characters]
+        canvas.text(MARGIN_LEFT - 4 - len(text) * CHAR_WIDTH,
+                    MARGIN_TOP + row * row_height + (row_height - CHAR_HEIGHT) / 2, text, all_colors["FONT"])
+
+    spacing, label_spacing, label_format = time_axis(start, end)
+
+    for mark in time_marks(start, end, label_spacing):
+        x = MARGIN_LEFT + int((mark - start) * width / float(end - start))
+        canvas.fill(x, MARGIN_TOP + height, 1, 3, all_colors["AXIS"])
+
+        text = strftime(label_format, localtime(mark))
+        canvas.text(x - len(text) * CHAR_WIDTH / 2, MARGIN_TOP + height + 5, text, all_colors["FONT"])
+
+    canvas.fill(MARGIN_LEFT - 1, MARGIN_TOP, 1, height + 1, all_colors["AXIS"])
+    canvas.fill(MARGIN_LEFT - 1, MARGIN_TOP + height, width + 1, 1, all_colors["AXIS"])
+
+    canvas.text((image_width - len(title) * CHAR_WIDTH) / 2, 8, title, all_colors["FONT"])
+
+    # The scale, from zero to the value shown in the darkest color.
+    y = MARGIN_TOP + height + MARGIN_BOTTOM
+    x = MARGIN_LEFT / 2
+    canvas.text(x, y, "0", all_colors["FONT"])
+    x += 2 * CHAR_WIDTH
+
+    scale = numpy.linspace(0.0, 1.0, 100)
+    for channel in xrange(3):
+        canvas.pixels[y:y + CHAR_HEIGHT, x:x + len(scale), channel] = numpy.interp(scale, stops, palette[:, channel]).round()
+
+    x += len(scale) + CHAR_WIDTH
+    canvas.text(x, y, ("%s %s" % (value_label(upper, base), label)).rstrip(), all_colors["FONT"])
+
+    canvas.write(filename)
+
+
+def export_heatmap(filename, names, first, step, values, start, end, width, title="", label="",
+                   upper=None, base=1000, colors={}, **extra):
+    """Write the data of a heatmap (as for write_heatmap()) and anything in
+       "extra" into a JSON file, to be drawn elsewhere, and return it. The
+       rows hold their values as read from the archive, as in Chart.export()."""
+    if numpy is None:
+        raise StatsError("exporting data requires NumPy")
+
+    values = numpy.asarray(values, dtype=float).reshape(len(names), -1)
+
+    limit = upper
+    known = ~numpy.isnan(values)
+    if upper is None:
+        upper = 0.0
+        if known.any():
+            upper = values[known].max()
+
+    if upper <= 0:
+        upper = 1.0
+
+    all_colors = DEFAULT_COLORS.copy()
+    all_colors.update(colors)
+
+    spacing, label_spacing, label_format = time_axis(start, end)
+
+    data = { "kind"       : "heatmap",
+             "title"      : title,
+             "label"      : label,
+             "start"      : start,
+             "end"        : end,
+             "width"      : width,
+             "row_height" : max(1, min(LINE_HEIGHT, HEATMAP_HEIGHT / max(len(names), 1))),
+             "first"      : first,
+             "step"       : step,
+             "limit"      : limit,
+             "base"       : base,
+             "upper"      : upper,
+             "scale"      : ("%s %s" % (value_label(upper, base), label)).rstrip(),
+             "palette"    : [parse_color(color) for color in HEATMAP_COLORS],
+             "time_axis"  : (spacing, label_spacing, label_format),
+             "marks"      : [(mark, strftime(label_format, localtime(mark)))
+                             for mark in time_marks(start, end, label_spacing)],
+             "colors"     : all_colors,
+             "names"      : list(names),
+             "rows"       : [json_values(row) for row in values] }
+
+    data.update(extra)
+    write_json(filename, data)
+
+    return data
+
+
+# EOF - chart.py
@@ -27,6 +27,7 @@ NAME="Quick Look"
 VERSION="1.1"
 
 
+import os
 import sys
 
 from socket import getfqdn
@@ -46,7 +47,60 @@ properties = { "data"       : "./data",   # base directory for the data files.
                "height"     : 120,        # height for all the graphics.
                "background" : "#e9e7dd",  # background color for the graphics.
                "border"     : "#e9e7dd",  # border color for the graphics.
-               "verbose"    : False }     # be verbose or silent.
+               "verbose"    : False,      # be verbose or silent.
+               "daemon"     : False,      # stay resident between refreshes.
+               "collect"    : True,       # collect data.
+               "render"     : True,       # generate the graphics and pages.
+               "redraw"     : 300,        # rendering interval (daemon), in seconds.
+               "jobs"       : 1,          # number of processes generating graphics.
+               "force"      : False,      # generate graphics even if unchanged.
+               "flush"      : 0,          # interval for writing buffered data, in seconds.
+               "conntrack"  : 10,         # time limit for scanning tracked connections, in seconds.
+               "talkers"    : 0,          # number of top addresses among tracked connections (0 for none).
+               "budget"     : 0,          # time limit for the graphics of each component, in seconds.
+               "root"       : "",         # directory where data sources are found, instead of "/".
+               "profile"    : None,       # directory for profiling data (runs once).
+               "start"      : None,       # time new data files start at, instead of now.
+               "storage"    : "rrdtool",  # kind of data files ("rrdtool" or "array").
+               "consolidate": False,      # keep all devices of a component in a single data file.
+               "expire"     : 604800,     # time before devices gone are forgotten, in seconds (0 never).
+               "gc"         : False,      # remove the data of devices gone (runs once).
+               "archive"    : None,       # directory to copy that data into first.
+               "include"    : {},         # glob patterns for the devices to track, by component.
+               "exclude"    : {},         # glob patterns for the devices to ignore, by component.
+               "top"        : 0,          # number of busiest devices graphed in detail (0 for all).
+               "draw"       : {},         # glob patterns for the devices always graphed, by component.
+               "heatmap"    : 16,         # number of processors graphed one by one (beyond it, only a heatmap).
+               "charts"     : "png" }     # graphics as images ("png"), data drawn by the pages ("json") or "both".
+
+
+#
+# The intervals covered by the graphics, and the step (in seconds) of the
+# archive each one is drawn from, according to the RRA definitions common
+# to all components. The daily graphics use every data point collected.
+#
+INTERVALS = ("1day", "1week", "1month", "1year")
+
+ARCHIVE_STEPS = { "1day"   : None,
+                  "1week"  : 900,
+                  "1month" : 3600,
+                  "1year"  : 43200 }
+
+#
+# When the pages draw the graphics themselves, the latest data points of
+# the daily ones are kept in a file in the directory of each component,
+# for the pages to poll and add to what they show, instead of reloading.
+#
+FEED = "feed.json"
+FEED_POINTS = 3  # in case a poll or two were missed.
+
+#
+# The script drawing the graphics, shared by all pages in the output
+# directory. Since they don't reload themselves at every refresh in that
+# case, they do it at this (longer) interval to show any new graphics.
+#
+CHARTS_SCRIPT = "charts.js"
+CHARTS_RELOAD = 3600  # seconds, at least the refresh interval.
                
 
 class StatsError(Exception):
@@ -72,26 +126,390 @@ class StatsException(Exception):
 #
 # As a rule, all components must store their output on a directory
 # named after the component, as returned by the info() method.
+# Components list the files they get their data from in "sources" (or in
+# "scanners", along with the function to scan them), and receive their
+# contents through a Snapshot taken for all components at once. This way,
+# all data is collected at (nearly) the same instant.
+#
+# Collecting data may happen in a different process than generating
+# the graphics and pages, so components import their templates from
+# make_html() only and must be able to recover, through load(), any
+# state make_graphs() and make_html() depend on.
 #
 class StatsComponent(object):
     """Abstract base class for all components."""
+    sources = []
+    scanners = {}
+
     def info(self):
         """Return some information about the component,
            as a tuple: (name, title, description)"""
         raise NotImplementedError, "method not implemented"
 
-    def update(self):
-        """Update the component's data."""
+    def load(self):
+        """Recover the state needed to generate the graphics and
+           the HTML pages, without collecting any data."""
+        pass
+
+    def update(self, snapshot):
+        """Update the component's data from a Snapshot."""
+        raise NotImplementedError, "method not implemented"
+
+    def graphs(self):
+        """Return the graphics to generate from the component's data,
+           as a list of GraphJob objects."""
         raise NotImplementedError, "method not implemented"
 
     def make_graphs(self):
         """Generate the graphics from the component's data."""
-        raise NotImplementedError, "method not implemented"
+        for job in self.graphs():
+            job.run()
 
     def make_html(self):
         """Generate the HTML pages for the component."""
         raise NotImplementedError, "method not implemented"
 
+    def collect_garbage(self, archive=None):
+        """Remove the historical data of the devices gone for longer than the
+           "expire" property (copying it into "archive" first, if given), and
+           return their names."""
+        return []
+
+
+#
+# Data sources are read through a registry, which keeps their files open
+# in daemon mode. Files under "/proc" are generated when read, so reading
+# them again from the start always returns their current contents.
+#
+class DataSource(object):
+    """A file to collect data from."""
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def blocks(self, size=65536):
+        """Return the current contents of the file, in blocks of up to "size" bytes."""
+        if self.fd is None:
+            self.fd = os.open(source_path(self.path), os.O_RDONLY)
+        else:
+            os.lseek(self.fd, 0, 0)
+
+        while True:
+            block = os.read(self.fd, size)
+            if not block:
+                break
+
+            yield block
+
+    def read(self):
+        """Return the current contents of the file."""
+        return "".join(self.blocks())
+
+    def done(self):
+        """Close the file after reading it, unless it's to be kept open."""
+        if not properties["daemon"]:
+            self.close()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class SourceRegistry(object):
+    """Hands out the contents of all data sources."""
+    def __init__(self):
+        self.sources = {}
+
+    def _get(self, path):
+        if path not in self.sources:
+            self.sources[path] = DataSource(path)
+
+        return self.sources[path]
+
+    def read(self, path):
+        source = self._get(path)
+
+        try:
+            try:
+                return source.read()
+            except OSError:
+                # The file may have been replaced (eg. when reloading a kernel
+                # module), so try again once before giving up on it.
+                source.close()
+                return source.read()
+        finally:
+            source.done()
+
+    def scan(self, path, scanner, size):
+        """Return the result of "scanner" when called with
+           an iterator over the blocks of a data source."""
+        source = self._get(path)
+
+        try:
+            try:
+                return scanner(source.blocks(size))
+            except OSError:
+                source.close()
+                return scanner(source.blocks(size))
+        finally:
+            source.done()
+
+    def close(self):
+        """Close all data sources."""
+        for source in self.sources.values():
+            source.close()
+
+        self.sources = {}
+
+
+registry = SourceRegistry()
+
+
+#
+# Some data sources may be too large to keep in memory (eg. the table of
+# tracked connections), so components can also ask for those to be
+# scanned in blocks, keeping only the result of the scan.
+#
+# A data source that can't be read (or scanned) only fails the components
+# using it, as the error is raised again whenever its contents are asked for.
+#
+READ_ERRORS = (StatsError, EnvironmentError, ValueError, IndexError)
+
+
+class Snapshot(object):
+    """The contents of a set of data sources, all read in one go."""
+    def __init__(self, sources, scanners={}, timestamp=None):
+        # All data points collected from this snapshot share this timestamp,
+        # which is only given explicitly when replaying past data.
+        if timestamp is None:
+            timestamp = int(time())
+
+        self.time = timestamp
+        self.contents = {}
+        self.views = {}
+        self.scans = {}
+        self.errors = {}
+
+        for source in sources:
+            if source in self.contents or source in self.errors:
+                continue
+
+            try:
+                self.contents[source] = registry.read(source)
+            except READ_ERRORS, e:
+                self.errors[source] = e
+
+        for source, scanner in scanners.items():
+            try:
+                self.scans[source] = registry.scan(source, scanner, 1048576)
+            except READ_ERRORS, e:
+                self.errors[source] = e
+
+    def read(self, source):
+        """Return the contents of a data source."""
+        if source in self.errors:
+            raise self.errors[source]
+
+        return self.contents[source]
+
+    def lines(self, source):
+        """Return the contents of a data source, as a list of lines."""
+        return self.read(source).splitlines()
+
+    def scanned(self, source):
+        """Return the result of scanning a data source."""
+        if source in self.errors:
+            raise self.errors[source]
+
+        return self.scans[source]
+
+    def parsed(self, source, parser):
+        """Return the contents of a data source, as returned by "parser".
+           Each source is parsed only once by the same parser, so several
+           components may share the result."""
+        key = (source, parser)
+        if key not in self.views:
+            self.views[key] = parser(self.read(source))
+
+        return self.views[key]
+
+
+#
+# Parsers for the most common data source formats, to use with
+# Snapshot.parsed(), so that different components share the result.
+#
+
+def parse_keyed(text):
+    """Parse a "key value value..." format, like "/proc/stat" or
+       "/proc/meminfo", into a dictionary of lists of values."""
+    values = {}
+
+    for line in text.splitlines():
+        fields = line.split()
+        if fields:
+            values[fields[0].rstrip(":")] = fields[1:]
+
+    return values
+
+
+def parse_fields(text):
+    """Parse a single line of values, like "/proc/loadavg"."""
+    return text.split()
+
+
+#
+# Graphics are generated from a list of jobs collected from all components,
+# so that they may be distributed among several processes. Jobs must be
+# picklable, as they are sent to the worker processes.
+#
+class GraphJob(object):
+    """A deferred call to "rrdtool.graph()" (or its equivalent, for the storage in use)."""
+    # When the data shown last changed, if no more is expected (eg. for a
+    # device that's gone), so that the graphic isn't generated again.
+    updated = None
+
+    def __init__(self, interval, filename, *args):
+        self.interval = interval
+        self.filename = filename
+        self.args = args
+
+    def step(self):
+        """Return how often (in seconds) new data is available for the graphic."""
+        return ARCHIVE_STEPS[self.interval] or properties["refresh"]
+
+    def __str__(self):
+        return self.filename
+
+    def feed(self):
+        """Return where the pages find the latest data points of the graphic,
+           as a tuple: (the feed, relative to the graphic, key in the feed)"""
+        path = self.filename[len(properties["output"]) + 1:-len(".png")].split("/")
+
+        return ("../" * (len(path) - 2) + FEED, "/".join(path[1:]))
+
+    def outputs(self):
+        """Return the files written for the graphic, as set by the "charts"
+           property: the image, the data to draw it from (".json"), or both."""
+        outputs = []
+
+        if properties["charts"] in ("png", "both"):
+            outputs.append(self.filename)
+
+        if properties["charts"] in ("json", "both"):
+            outputs.append(self.filename[:-len(".png")] + ".json")
+
+        return outputs
+
+    def run(self):
+        """Generate the graphic. If it's a daily one and its data is exported,
+           return the latest data points, for the feed (or None otherwise)."""
+        from components import storage, chart
+
+        points = None
+        for filename in self.outputs():
+            if not filename.endswith(".json"):
+                storage.graph(filename, *self.args)
+            elif self.interval != INTERVALS[0]:
+                storage.export(filename, *self.args)
+            else:
+                extra = { "feed" : self.feed() }
+                points = chart.latest(storage.export(filename, *self.args, **extra), FEED_POINTS)
+
+        return points
+
+
+class HeatmapJob(GraphJob):
+    """A deferred heatmap of the same value for many processors or devices,
+       one row each. The "rows" are tuples: (name, data file, data sources
+       added up for the value). Each data file is read only once, for all
+       the rows it holds."""
+    def __init__(self, interval, filename, rows, title="", label="", upper=None, base=1000):
+        GraphJob.__init__(self, interval, filename)
+
+        self.rows = rows
+        self.title = title
+        self.label = label
+        self.upper = upper
+        self.base = base
+
+    def run(self):
+        """Generate the heatmap (returning the latest data points, as GraphJob.run())."""
+        from components import storage, chart
+
+        # The last data point is still unknown.
+        end = int(time()) - properties["refresh"]
+        start = chart.parse_time("-" + self.interval, end)
+        width = properties["width"]
+
+        wanted = {}
+        for name, database, sources in self.rows:
+            for source in sources:
+                if source not in wanted.setdefault(database, []):
+                    wanted[database].append(source)
+
+        fetched = {}
+        timeline = None
+        for database, sources in wanted.items():
+            try:
+                (first, last, step), names, values = storage.fetch(database, "AVERAGE", start, end, (end - start) / width, sources)
+            except storage.error:
+                continue  # no data (yet), left blank.
+
+            if timeline is None:
+                timeline = (first, step, values.shape[1])
+            elif (first, step, values.shape[1]) != timeline:
+                # Data points are matched to those of the first data file.
+                values = chart.resample(values, first, step, timeline[0] + timeline[1] * (chart.numpy.arange(timeline[2]) + 1))
+
+            fetched[database] = dict(zip(names, values))
+
+        if timeline is None:
+            timeline = (start, end - start, 0)
+
+        values = chart.numpy.nan * chart.numpy.ones((len(self.rows), timeline[2]))
+        for row, (name, database, sources) in enumerate(self.rows):
+            if database in fetched:
+                values[row] = sum([fetched[database][source] for source in sources])
+
+        args = ([name for name, database, sources in self.rows], timeline[0], timeline[1], values,
+                start, end, width, self.title, self.label, self.upper, self.base,
+                { "BACK"   : properties["background"],
+                  "SHADEA" : properties["border"],
+                  "SHADEB" : properties["border"] })
+
+        points = None
+        for filename in self.outputs():
+            if not filename.endswith(".json"):
+                chart.write_heatmap(filename, *args)
+            elif self.interval != INTERVALS[0]:
+                chart.export_heatmap(filename, *args)
+            else:
+                extra = { "feed" : self.feed() }
+                points = chart.latest(chart.export_heatmap(filename, *args, **extra), FEED_POINTS)
+
+        return points
+
+
+def source_path(path):
+    """Return where to find a data source, such as "/proc/stat". This isn't
+       the path itself if the data sources are placed somewhere else
+       (eg. fake ones, for benchmarking)."""
+    return properties["root"] + path
+
+
+def monotonic():
+    """Return the seconds elapsed since some fixed point in the past,
+       unaffected by changes to the system clock."""
+    # On Linux this comes from times(2), which counts clock ticks since boot.
+    return os.times()[4]
+
+
+def cpu_time():
+    """Return the CPU time (user and system) used by this process, in seconds."""
+    user, system = os.times()[:2]
+    return user + system
+
 
 def fail(component, reason):
     """Print a reason why a component can't be loaded."""
@@ -112,10 +530,16 @@ def template_fill(template, description, is_toplevel=False):
     template.description = description
     template.is_toplevel = is_toplevel
     template.refresh = properties["refresh"]
+    template.client = properties["charts"] == "json"
+    template.reload = max(CHARTS_RELOAD, properties["refresh"])
 
 
 def template_write(template, filename):
     """Write the template to a file."""
+    if template.client:  # the pages are at different depths in the output directory.
+        template.script = os.path.relpath(os.path.join(properties["output"], CHARTS_SCRIPT),
+                                          os.path.dirname(filename))
+
     f = open(filename, "w")
     f.write(str(template))
     f.close()
@@ -24,16 +24,143 @@
 
 
 import os
-import rrdtool
+
+from itertools import chain
 
 from components.common import *
-from templates.connections.index import index as ConnectionsPage
+from components import storage
+from components.graphspec import GraphSpec
+
+
+#
+# The files where we can get our data from.
+#
+# The table of tracked connections may have millions of entries, so it is
+# only scanned for the number of connections by protocol. The total number
+# of connections is read from a much cheaper file, when available.
+#
+# Each entry starts with the protocol name on "ip_conntrack", and with the
+# network layer protocol (eg. "ipv4") followed by the protocol name on
+# "nf_conntrack" (linux >= 2.6.15), as in:
+#
+#   "ipv4     2 tcp      6 431999 ESTABLISHED src=..."
+#
+DATA_SOURCE = "/proc/net/nf_conntrack"
+DATA_SOURCE_OLD = "/proc/net/ip_conntrack"
 
+COUNT_SOURCE = "/proc/sys/net/netfilter/nf_conntrack_count"
+COUNT_SOURCE_OLD = "/proc/sys/net/ipv4/netfilter/ip_conntrack_count"
 
 #
-# The file where we get our data from.
+# The states of TCP connections we keep track of (any other state is
+# counted as "other"), as named in the table.
 #
-DATA_SOURCE = "/proc/net/ip_conntrack"
+TCP_STATES = ("SYN_SENT", "SYN_RECV", "ESTABLISHED", "FIN_WAIT",
+              "CLOSE_WAIT", "LAST_ACK", "TIME_WAIT", "CLOSE")
+
+# The colors for each TCP state in the graphics (the last is for "other").
+TCP_STATE_COLORS = ("#ffe100", "#ffa500", "#a0df05", "#3c8dc5",
+                    "#7648eb", "#dc3c14", "#808080", "#404040", "#000000")
+
+# The file where the top source and destination addresses are stored,
+# with one "direction address connections" entry per line.
+TALKERS_FILE = "talkers"
+
+# Once scanning the table was found to take too long, how far it's still
+# scanned ("protocols", or "total" for not at all) is kept in this file, so
+# that later runs don't spend the time limit finding it out again. Removing
+# the file makes them try again.
+SCAN_LIMIT_FILE = "scan-limit"
+
+
+def _protocols_graph():
+    spec = GraphSpec("network connections (by protocol)", "connections", upper=10.0)
+
+    for name in ("proto_tcp", "proto_udp", "proto_other"):
+        spec.define(name, name)
+
+    spec.define("total", "total", database="total_database")
+
+    spec.area("proto_tcp", "#a0df05", "TCP  ")
+    spec.summary("proto_tcp", "%6.0lf conn")
+    spec.area("proto_udp", "#ffe100", "UDP  ", stack=True)
+    spec.summary("proto_udp", "%6.0lf conn")
+    spec.area("proto_other", "#dc3c14", "Other", stack=True)
+    spec.summary("proto_other", "%6.0lf conn")
+    spec.line("total", "#808080", "Total")
+    spec.summary("total", "%6.0lf conn", newline=False)
+
+    return spec
+
+
+def _states_graph():
+    spec = GraphSpec("TCP connections (by state)", "connections", upper=10.0)
+
+    states = [state.lower() for state in TCP_STATES] + ["other"]
+    for state in states:
+        spec.define(state, state)
+
+    for state, color in zip(states, TCP_STATE_COLORS):
+        spec.area(state, color, "%-11s" % state.upper(), stack=(state != states[0]))
+        spec.summary(state, "%6.0lf conn")
+
+    return spec
+
+
+PROTOCOLS_GRAPH = _protocols_graph()
+STATES_GRAPH = _states_graph()
+
+
+class SpaceSaving(object):
+    """Approximate counts for the most frequent items in a stream, using a
+       fixed amount of memory (the "Space-Saving" algorithm, by Metwally et al.).
+
+       Counters are grouped into buckets by their count, so that the
+       counter to replace when there's no room left is always at hand."""
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}   # item -> count
+        self.buckets = {}  # count -> items with that count
+        self.minimum = 0
+
+    def add(self, item):
+        counts = self.counts
+
+        if item in counts:
+            count = counts[item]
+            bucket = self.buckets[count]
+            del bucket[item]
+            if not bucket:
+                del self.buckets[count]
+                if count == self.minimum:
+                    self.minimum = count + 1
+        elif len(counts) < self.capacity:
+            count = 0
+            self.minimum = 1
+        else:
+            # Replace one of the items with the lowest count, inheriting
+            # its count (which is the most this item could have had).
+            count = self.minimum
+            bucket = self.buckets[count]
+            del counts[bucket.popitem()[0]]
+            if not bucket:
+                del self.buckets[count]
+                self.minimum = count + 1
+
+        count += 1
+        counts[item] = count
+        self.buckets.setdefault(count, {})[item] = True
+
+        if count < self.minimum:
+            self.minimum = count
+
+    def top(self, n):
+        """Return the "n" most frequent items, as (item, count) tuples."""
+        items = [(count, item) for item, count in self.counts.items()]
+        items.sort()
+        items.reverse()
+
+        return [(item, count) for count, item in items[:n]]
 
 
 class NetworkConnections(StatsComponent):
@@ -41,29 +168,59 @@ class NetworkConnections(StatsComponent):
     def __init__(self):
         self.name = "connections"
 
-        if not os.path.exists(DATA_SOURCE):
+        self.sources = []
+        for source in (COUNT_SOURCE, COUNT_SOURCE_OLD):
+            if os.path.exists(source_path(source)):
+                self.sources = [source]
+                break
+
+        # Without the table, there's still the total number of connections.
+        if os.path.exists(source_path(DATA_SOURCE)):
+            self.table = DATA_SOURCE
+            self.tokens = (" tcp ", " udp ")
+            self.proto_field = 2
+        elif os.path.exists(source_path(DATA_SOURCE_OLD)):
+            self.table = DATA_SOURCE_OLD
+            self.tokens = ("\ntcp ", "\nudp ")
+            self.proto_field = 0
+        elif self.sources:
+            self.table = None
+        else:
             fail(self.name, "maybe the kernel module 'ip_conntrack' isn't loaded.")
-            raise StatsException(DATA_SOURCE + " does not exist")
-        
+            raise StatsException(DATA_SOURCE + " does not exist, neither does " + DATA_SOURCE_OLD)
+
         self.title = "Network Connections"
         self.description = "tracked connections, by protocol"
         self.data_dir = properties["data"] + "/" + self.name
         self.database = self.data_dir + "/protocol.rrd"
+        self.total_database = self.data_dir + "/total.rrd"
+        self.states_database = self.data_dir + "/states.rrd"
+        self.talkers_file = self.data_dir + "/" + TALKERS_FILE
+        self.scan_limit_file = self.data_dir + "/" + SCAN_LIMIT_FILE
         self.graphs_dir = properties["output"] + "/" + self.name
 
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
 
+        limit = self._read_scan_limit()
+
+        self.scanners = {}
+        if self.table and properties["conntrack"] > 0 and limit != "total":
+            if properties["talkers"] > 0 and limit != "protocols":
+                self.scanners[self.table] = self._scan_details
+            else:
+                self.scanners[self.table] = self._scan
+
         if not os.path.exists(self.graphs_dir):
             os.makedirs(self.graphs_dir)
 
-        if not os.path.exists(self.database):
+        if not storage.exists(self.database):
             #
             # Remember: all "time" values are expressed in seconds.
             #
             refresh = properties["refresh"]
             heartbeat = refresh * 2
-            rrdtool.create(self.database,
+            storage.create(self.database,
                            "--step", "%d" % refresh,
                            "DS:proto_tcp:GAUGE:%d:0:U" % heartbeat,
                            "DS:proto_udp:GAUGE:%d:0:U" % heartbeat,
@@ -73,80 +230,253 @@ class NetworkConnections(StatsComponent):
                            "RRA:AVERAGE:0.5:%d:744" % (3600 / refresh),   # 31 days of 1 hour averages
                            "RRA:AVERAGE:0.5:%d:730" % (43200 / refresh))  # 365 days of 1/2 day averages
 
+        if not storage.exists(self.total_database):
+            refresh = properties["refresh"]
+            heartbeat = refresh * 2
+            storage.create(self.total_database,
+                           "--step", "%d" % refresh,
+                           "DS:total:GAUGE:%d:0:U" % heartbeat,
+                           "RRA:AVERAGE:0.5:1:%d" % (86400 / refresh),    # 1 day of 'refresh' averages
+                           "RRA:AVERAGE:0.5:%d:672" % (900 / refresh),    # 7 days of 1/4 hour averages
+                           "RRA:AVERAGE:0.5:%d:744" % (3600 / refresh),   # 31 days of 1 hour averages
+                           "RRA:AVERAGE:0.5:%d:730" % (43200 / refresh))  # 365 days of 1/2 day averages
+
+        if not storage.exists(self.states_database):
+            refresh = properties["refresh"]
+            heartbeat = refresh * 2
+            args = ["--step", "%d" % refresh]
+            args.extend(["DS:%s:GAUGE:%d:0:U" % (state.lower(), heartbeat) for state in TCP_STATES])
+            args.extend(["DS:other:GAUGE:%d:0:U" % heartbeat,
+                         "RRA:AVERAGE:0.5:1:%d" % (86400 / refresh),    # 1 day of 'refresh' averages
+                         "RRA:AVERAGE:0.5:%d:672" % (900 / refresh),    # 7 days of 1/4 hour averages
+                         "RRA:AVERAGE:0.5:%d:744" % (3600 / refresh),   # 31 days of 1 hour averages
+                         "RRA:AVERAGE:0.5:%d:730" % (43200 / refresh)]) # 365 days of 1/2 day averages
+            storage.create(self.states_database, *args)
+
     def info(self):
         """Return some information about the component,
            as a tuple: (name, title, description)"""
         return (self.name, self.title, self.description)
 
-    def update(self):
-        """Update the historical data."""
-        f = open(DATA_SOURCE, "r")
+    def _read_scan_limit(self):
+        """Return how far the table is still scanned, as set by _write_scan_limit()."""
+        if not os.path.exists(self.scan_limit_file):
+            return None
+
+        f = open(self.scan_limit_file, "r")
+        limit = f.read().strip()
+        f.close()
+
+        return limit
+
+    def _write_scan_limit(self, limit):
+        f = open(self.scan_limit_file + ".tmp", "w")
+        f.write(limit + "\n")
+        f.close()
+        os.rename(self.scan_limit_file + ".tmp", self.scan_limit_file)
+
+    def _scan(self, blocks):
+        """Count the connections in the table, by protocol. Returns
+           None if this takes longer than the configured time limit."""
+        return self._count(blocks, monotonic() + properties["conntrack"])
+
+    def _count(self, blocks, deadline):
+        """Count the connections in (the rest of) the table by protocol, from
+           their tokens alone. Returns None if the deadline is reached."""
+        tcp_token, udp_token = self.tokens
+        proto_tcp = 0
+        proto_udp = 0
+        entries = 0
 
+        # Keep the end of the previous block, for the tokens split between
+        # blocks (and start with a newline, for the first entry's token).
+        tail = "\n"
+        overlap = max(len(tcp_token), len(udp_token)) - 1
+
+        for block in blocks:
+            text = tail + block
+            tail = text[-overlap:]
+
+            proto_tcp += text.count(tcp_token)
+            proto_udp += text.count(udp_token)
+            entries += block.count("\n")
+
+            if monotonic() > deadline:
+                return None
+
+        return ((proto_tcp, proto_udp, entries - proto_tcp - proto_udp), None, None, None)
+
+    def _scan_details(self, blocks):
+        """Count the connections in the table by protocol and TCP state,
+           and find the top source and destination addresses. If this takes
+           longer than half the configured time limit, the rest of the table
+           is only counted by protocol, and there are no states or addresses
+           (None). Returns None if even that takes longer than the limit."""
+        start = monotonic()
+        deadline = start + properties["conntrack"]
+        halfway = start + properties["conntrack"] / 2.0
+
+        field = self.proto_field
         proto_tcp = 0
         proto_udp = 0
         proto_other = 0
+        states = {}
 
-        for line in f:
-            data = line.split()
-            proto = data[0].lower()
+        # Keeping more counters than shown makes the top ones more accurate.
+        capacity = properties["talkers"] * 10
+        sources = SpaceSaving(capacity)
+        destinations = SpaceSaving(capacity)
 
-            if proto == "tcp":
-                proto_tcp += 1
-            elif proto == "udp":
-                proto_udp += 1
-            else:
-                proto_other += 1
+        partial = ""
+        while partial is not None:
+            try:
+                lines = (partial + blocks.next()).split("\n")
+                partial = lines.pop()  # incomplete, until the next block.
+            except StopIteration:
+                lines = [partial]
+                partial = None
+
+            for line in lines:
+                # Split only as far as the TCP state, if there is one.
+                values = line.split(None, field + 4)
+                if len(values) < field + 4:
+                    continue
+
+                proto = values[field]
+                if proto == "tcp":
+                    proto_tcp += 1
+                    state = values[field + 3]
+                    states[state] = states.get(state, 0) + 1
+                elif proto == "udp":
+                    proto_udp += 1
+                else:
+                    proto_other += 1
+
+                # The first addresses are for the original direction.
+                start = line.find("src=")
+                if start >= 0:
+                    sources.add(line[start + 4:line.find(" ", start)])
+
+                start = line.find("dst=")
+                if start >= 0:
+                    destinations.add(line[start + 4:line.find(" ", start)])
+
+            if partial is not None and monotonic() > halfway:
+                # The incomplete line starts an entry, as the blocks left do.
+                rest = self._count(chain([partial], blocks), deadline)
+                if rest is None:
+                    return None
+
+                counts = rest[0]
+                return ((proto_tcp + counts[0], proto_udp + counts[1], proto_other + counts[2]), None, None, None)
+
+        talkers = properties["talkers"]
+        return ((proto_tcp, proto_udp, proto_other), states,
+                sources.top(talkers), destinations.top(talkers))
+
+    def _write_talkers(self, sources, destinations):
+        # Write to a temporary file first, so that the pages are
+        # never generated from an incomplete file.
+        f = open(self.talkers_file + ".tmp", "w")
+
+        for direction, talkers in (("src", sources), ("dst", destinations)):
+            for address, count in talkers:
+                f.write("%s %s %d\n" % (direction, address, count))
 
         f.close()
+        os.rename(self.talkers_file + ".tmp", self.talkers_file)
+
+    def _read_talkers(self):
+        """Return the top source and destination addresses."""
+        talkers = { "src" : [],
+                    "dst" : [] }
+
+        if os.path.exists(self.talkers_file):
+            f = open(self.talkers_file, "r")
+
+            for line in f:
+                values = line.split()
+                if len(values) == 3 and values[0] in talkers:
+                    talkers[values[0]].append((values[1], int(values[2])))
+
+            f.close()
+
+        return (talkers["src"], talkers["dst"])
+
+    def update(self, snapshot):
+        """Update the historical data."""
+        counts = states = None
+        if self.table in self.scanners:
+            result = snapshot.scanned(self.table)
+
+            if result:
+                counts, states, sources, destinations = result
 
-        rrdtool.update(self.database,
-                       "--template", "proto_tcp:proto_udp:proto_other",
-                       "N:%d:%d:%d" % (proto_tcp, proto_udp, proto_other))
+            if result and states is None and self.scanners[self.table] == self._scan_details:
+                # Fall back to just counting connections by protocol (as the
+                # scan already did for this run)...
+                self.scanners[self.table] = self._scan
+                self._write_scan_limit("protocols")
+
+                if properties["verbose"]:
+                    sys.stderr.write("Scanning \"%s\" took too long, collecting TCP" \
+                                     " states and top addresses is now disabled.\n" % self.table)
+            elif not result:
+                # ...and then to counting them only by their total (if we know it).
+                del self.scanners[self.table]
+                self._write_scan_limit("total")
+
+                if properties["verbose"]:
+                    sys.stderr.write("Scanning \"%s\" took too long, counting" \
+                                     " connections by protocol is now disabled.\n" % self.table)
+
+        if self.sources:
+            total = int(snapshot.read(self.sources[0]))
+        elif counts:
+            total = counts[0] + counts[1] + counts[2]
+        else:
+            total = None
+
+        if counts:
+            storage.update(self.database,
+                           "proto_tcp:proto_udp:proto_other",
+                           "%d:%d:%d" % counts,
+                           snapshot.time)
+
+        if total is not None:
+            storage.update(self.total_database, "total", "%d" % total, snapshot.time)
+
+        if states is not None:
+            values = [states.pop(state, 0) for state in TCP_STATES]
+            values.append(sum(states.values()))
+
+            storage.update(self.states_database,
+                           ":".join([state.lower() for state in TCP_STATES]) + ":other",
+                           ":".join(["%d" % value for value in values]),
+                           snapshot.time)
+
+            self._write_talkers(sources, destinations)
+        elif os.path.exists(self.talkers_file):
+            # Don't show outdated top addresses.
+            os.unlink(self.talkers_file)
 
                        
-    def make_graphs(self):
-        """Generate the daily, weekly and monthly graphics."""
-        height = str(properties["height"])
-        width = str(properties["width"])
-        refresh = properties["refresh"]
-        background = properties["background"]
-        border = properties["border"]
-
-        for interval in ("1day", "1week", "1month", "1year"):
-            rrdtool.graph("%s/graph-%s.png" % (self.graphs_dir, interval), 
-                          "--start", "-%s" % interval,
-                          "--end", "-%d" % refresh,  # because the last data point is still *unknown*
-                          "--title", "network connections (by protocol)",
-                          "--lazy",
-                          "--base", "1000",
-                          "--height", height,
-                          "--width", width,
-                          "--lower-limit", "0",
-                          "--upper-limit", "10.0",
-                          "--imgformat", "PNG",
-                          "--vertical-label", "connections",
-                          "--color", "BACK%s" % background,
-                          "--color", "SHADEA%s" % border,
-                          "--color", "SHADEB%s" % border,
-                          "DEF:proto_tcp=%s:proto_tcp:AVERAGE" % self.database,
-                          "DEF:proto_udp=%s:proto_udp:AVERAGE" % self.database,
-                          "DEF:proto_other=%s:proto_other:AVERAGE" % self.database,
-                          "AREA:proto_tcp#a0df05:TCP  ",
-                          "GPRINT:proto_tcp:LAST:\\: %6.0lf conn (now)",
-                          "GPRINT:proto_tcp:MAX:%6.0lf conn (max)",
-                          "GPRINT:proto_tcp:AVERAGE:%6.0lf conn (avg)\\n",
-                          "STACK:proto_udp#ffe100:UDP  ",
-                          "GPRINT:proto_udp:LAST:\\: %6.0lf conn (now)",
-                          "GPRINT:proto_udp:MAX:%6.0lf conn (max)",
-                          "GPRINT:proto_udp:AVERAGE:%6.0lf conn (avg)\\n",
-                          "STACK:proto_other#dc3c14:Other",
-                          "GPRINT:proto_other:LAST:\\: %6.0lf conn (now)",
-                          "GPRINT:proto_other:MAX:%6.0lf conn (max)",
-                          "GPRINT:proto_other:AVERAGE:%6.0lf conn (avg)")
+    def graphs(self):
+        """Return the daily, weekly, monthly and yearly graphics."""
+        jobs = []
+
+        jobs.extend(PROTOCOLS_GRAPH.jobs(self.graphs_dir + "/graph-",
+                                         database=self.database, total_database=self.total_database))
+        jobs.extend(STATES_GRAPH.jobs(self.graphs_dir + "/graph-states-", database=self.states_database))
+
+        return jobs
 
     def make_html(self):
         """Generate the HTML pages."""
+        from templates.connections.index import index as ConnectionsPage
+
         template = ConnectionsPage()
+        template.sources, template.destinations = self._read_talkers()
         template_fill(template, self.description)
         template_write(template, self.graphs_dir + "/index.html")
 
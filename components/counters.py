@@ -25,13 +25,10 @@
 
 
 import os
-import re
-import rrdtool
 
 from components.common import *
-
-from templates.counters.index import index as OverviewPage
-from templates.counters.detailed import detailed as DetailsPage
+from components import devices
+from components.graphspec import GraphSpec
 
 
 #
@@ -48,196 +45,135 @@ from templates.counters.detailed import detailed as DetailsPage
 #
 DATA_SOURCE = "/proc/net/dev"
 
+# The network interfaces ignored unless set otherwise.
+DEFAULT_EXCLUDE = ("lo",)
+
+
+def _bytes_graph():
+    spec = GraphSpec("%(name)s - bytes/sec", "bytes/sec", base=1024, upper=0.5)
+    spec.define("rx", "rx_bytes")
+    spec.define("tx", "tx_bytes")
+    spec.compute("rx_kb", "rx,1024,/")
+    spec.compute("tx_kb", "tx,1024,/")
+    spec.area("rx", "#a0df05", "Incoming")
+    spec.summary("rx_kb", "%8.1lf KBps")
+    spec.line("tx", "#808080", "Outgoing")
+    spec.summary("tx_kb", "%8.1lf KBps", newline=False)
+
+    return spec
+
+
+def _packets_graph():
+    spec = GraphSpec("%(name)s - packets/sec", "packets/sec", upper=0.5)
+    spec.define("rx", "rx_packets")
+    spec.define("tx", "tx_packets")
+    spec.area("rx", "#a0df05", "Incoming")
+    spec.summary("rx", "%7.0lf packets/sec")
+    spec.line("tx", "#808080", "Outgoing")
+    spec.summary("tx", "%7.0lf packets/sec", newline=False)
+
+    return spec
+
+
+BYTES_GRAPH = _bytes_graph()
+PACKETS_GRAPH = _packets_graph()
+
+
+class NetworkInterface(devices.Device):
+    """Stores the historical data for a single network interface, either
+       in a data file of its own or in one shared with all other interfaces."""
+    sources = ("rx_bytes", "tx_bytes", "rx_packets", "tx_packets")
+
+    def graphs(self):
+        """Return the daily, weekly, monthly and yearly byte and packet rates' graphics."""
+        jobs = []
+
+        jobs.extend(BYTES_GRAPH.jobs(self.graphs_dir + "/graph-bytes-",
+                                     database=self.database, prefix=self.prefix, name=self.name))
+        jobs.extend(PACKETS_GRAPH.jobs(self.graphs_dir + "/graph-packets-",
+                                       database=self.database, prefix=self.prefix, name=self.name))
+
+        return jobs
+
+    def make_html(self):
+        """Generate the bytes and packets HTML pages."""
+        from templates.counters.detailed import detailed as DetailsPage
+
+        for kind in ("bytes", "packets"):
+            template = DetailsPage()
+            template.kind = kind
+            template_fill(template, "traffic detail for " + self.name + " (" + kind + "/sec)")
+            template_write(template, self.graphs_dir + "/" + kind + ".html")
+
 
-class NetworkCounters(StatsComponent):
+class NetworkCounters(devices.DeviceComponent):
     """Network Interface Statistics."""
-    def __init__(self):
-        self.interfaces = {}
+    device_class = NetworkInterface
+
+    throughput = ("rx_bytes", "tx_bytes")
+
+    heatmap_title = "all interfaces - bytes/sec"
+    heatmap_label = "bytes/sec"
+    heatmap_base = 1024
+    rate_unit = 1024  # KBps
 
+    def __init__(self):
         self.name = "counters"
 
-        if not os.path.exists(DATA_SOURCE):
+        if not os.path.exists(source_path(DATA_SOURCE)):
             fail(self.name, "cannot find \"%s\"." % DATA_SOURCE)
             raise StatsException(DATA_SOURCE + " does not exist")
         
+        self.sources = [DATA_SOURCE]
+
+        self.accept = devices.device_filter(self.name, DEFAULT_EXCLUDE)
+
         self.title = "Network Interfaces"
         self.description = "network traffic rates"
 
-        self.data_dir = properties["data"] + "/" + self.name
-        self.graphs_dir = properties["output"] + "/" + self.name
-
-        if not os.path.exists(self.data_dir):
-            os.makedirs(self.data_dir)
-            
-        if not os.path.exists(self.graphs_dir):
-            os.makedirs(self.graphs_dir)
-
-    def info(self):
-        """Return some information about the component,
-           as a tuple: (name, title, description)"""
-        return (self.name, self.title, self.description)
-            
-    def update(self):
+        devices.DeviceComponent.__init__(self)
+
+    def update(self, snapshot):
         """Read the system counters and update the historical
            data for all network interfaces currently \"up\"."""
-        f = open(DATA_SOURCE, "r")
-
-        # Skip both header lines.
-        f.readline()
-        f.readline()
+        accept = self.accept
 
-        regexp = re.compile("\s*(.+):(.+)")
+        updates = []
 
-        for line in f:
-            match = regexp.match(line)
-            interface_name, values = match.groups()
+        # Skip both header lines.
+        for line in snapshot.lines(DATA_SOURCE)[2:]:
+            # The counters are only split for the interfaces we track.
+            separator = line.find(":")
+            interface_name = line[:separator].strip()
 
-            # Ignore the loopback interface.
-            if interface_name == "lo":
+            if not accept(interface_name):
                 continue
 
-            if interface_name in self.interfaces:
-                interface = self.interfaces[interface_name]
-            else:
-                interface = NetworkInterface(interface_name, self.data_dir, self.graphs_dir)
-                self.interfaces[interface_name] = interface
+            interface = self._register(interface_name)
 
-            data = values.split()
-            interface.update(int(data[0]),  # tx_packets
-                             int(data[8]),  # tx_bytes
-                             int(data[1]),  # rx_packets
-                             int(data[9]))  # rx_packets
+            data = line[separator + 1:].split()
+            updates.append((interface, (int(data[0]),    # rx_bytes
+                                        int(data[8]),    # tx_bytes
+                                        int(data[1]),    # rx_packets
+                                        int(data[9]))))  # tx_packets
 
-        f.close()
+        self._store(updates, snapshot.time)
 
-    def make_graphs(self):
-        """Generate the daily, weekly and monthly graphics for all network interfaces."""
-        for interface in self.interfaces.values():
-            interface.make_graphs()
+    def _total_graphs(self):
+        return BYTES_GRAPH.jobs(self.graphs_dir + "/graph-total-", database=self.total_database, name="all interfaces")
 
-    def make_html(self):
-        """Generate the HTML pages for all network interfaces."""
-        interfaces = self.interfaces.keys()
-        interfaces.sort()
-        
-        template = OverviewPage()
-        template.interfaces = interfaces
-        
-        template_fill(template, self.description)
-        template_write(template, self.graphs_dir + "/index.html")
+    def _overview_page(self):
+        from templates.counters.index import index as OverviewPage
 
-        for interface in self.interfaces.values():
-            interface.make_html()
-        
-            
-class NetworkInterface(object):
-    """Stores the historical data for a single network interface."""
-    def __init__(self, name, data_dir, graphs_dir):
-        self.name = name
-        self.graphs_dir = graphs_dir + "/" + self.name
-        self.database = data_dir + "/" + self.name + ".rrd"
-        
-        if not os.path.exists(self.graphs_dir):
-            os.makedirs(self.graphs_dir)
-
-        if not os.path.exists(self.database):
-            #
-            # Remember: all "time" values are expressed in seconds.
-            #
-            refresh = properties["refresh"]
-            heartbeat = refresh * 2
-            rrdtool.create(self.database,
-                           "--step", "%d" % refresh,
-                           "DS:rx_bytes:DERIVE:%d:0:U" % heartbeat,
-                           "DS:tx_bytes:DERIVE:%d:0:U" % heartbeat,
-                           "DS:rx_packets:DERIVE:%d:0:U" % heartbeat,
-                           "DS:tx_packets:DERIVE:%d:0:U" % heartbeat,
-                           "RRA:AVERAGE:0.5:1:%d" % (86400 / refresh),    # 1 day of 'refresh' averages
-                           "RRA:AVERAGE:0.5:%d:672" % (900 / refresh),    # 7 days of 1/4 hour averages
-                           "RRA:AVERAGE:0.5:%d:744" % (3600 / refresh),   # 31 days of 1 hour averages
-                           "RRA:AVERAGE:0.5:%d:730" % (43200 / refresh))  # 365 days of 1/2 day averages
-
-    def __str__(self):
-        return self.name
-
-    def update(self, rx_bytes, tx_bytes, rx_packets, tx_packets):
-        """Update the historical data."""
-        rrdtool.update(self.database,
-                       "--template", "rx_bytes:tx_bytes:rx_packets:tx_packets",
-                       "N:%d:%d:%d:%d" % (rx_bytes, tx_bytes, rx_packets, tx_packets))
-
-    def make_graphs(self):
-        """Generate daily, weekly, monthly and yearly byte and packet rates' graphics."""
-        height = str(properties["height"])
-        width = str(properties["width"])
-        refresh = properties["refresh"]
-        background = properties["background"]
-        border = properties["border"]
-        
-        for interval in ("1day", "1week", "1month", "1year"):
-            # graph bytes        
-            rrdtool.graph("%s/graph-bytes-%s.png" % (self.graphs_dir, interval), 
-                          "--start", "-%s" % interval,
-                          "--end", "-%d" % refresh,  # because the last data point is still unknown
-                          "--title", "%s - bytes/sec" % self.name,
-                          "--lazy",
-                          "--base", "1024",
-                          "--height", height,
-                          "--width", width,
-                          "--lower-limit", "0",
-                          "--upper-limit", "0.5",
-                          "--imgformat", "PNG",
-                          "--vertical-label", "bytes/sec",
-                          "--color", "BACK%s" % background,
-                          "--color", "SHADEA%s" % border,
-                          "--color", "SHADEB%s" % border,
-                          "DEF:rx=%s:rx_bytes:AVERAGE" % self.database,
-                          "DEF:tx=%s:tx_bytes:AVERAGE" % self.database,
-                          "CDEF:rx_kb=rx,1024,/",
-                          "CDEF:tx_kb=tx,1024,/",
-                          "AREA:rx#a0df05:Incoming",
-                          "GPRINT:rx_kb:LAST:\\: %8.1lf KBps (now)",
-                          "GPRINT:rx_kb:MAX:%8.1lf KBps (max)",
-                          "GPRINT:rx_kb:AVERAGE:%8.1lf KBps (avg)\\n",
-                          "LINE1:tx#808080:Outgoing",
-                          "GPRINT:tx_kb:LAST:\\: %8.1lf KBps (now)",
-                          "GPRINT:tx_kb:MAX:%8.1lf KBps (max)",
-                          "GPRINT:tx_kb:AVERAGE:%8.1lf KBps (avg)")
-
-            # graph packets
-            rrdtool.graph("%s/graph-packets-%s.png" % (self.graphs_dir, interval), 
-                          "--start", "-%s" % interval,
-                          "--end", "-%d" % refresh,  # because the last data point is still unknown
-                          "--title", "%s - packets/sec" % self.name,
-                          "--lazy",
-                          "--base", "1000",
-                          "--height", height,
-                          "--width", width,
-                          "--lower-limit", "0",
-                          "--upper-limit", "0.5",
-                          "--imgformat", "PNG",
-                          "--vertical-label", "packets/sec",
-                          "--color", "BACK%s" % background,
-                          "--color", "SHADEA%s" % background,
-                          "--color", "SHADEB%s" % background,
-                          "DEF:rx=%s:rx_packets:AVERAGE" % self.database,
-                          "DEF:tx=%s:tx_packets:AVERAGE" % self.database,
-                          "AREA:rx#a0df05:Incoming",
-                          "GPRINT:rx:LAST:\\: %7.0lf packets/sec (now)",
-                          "GPRINT:rx:MAX:%7.0lf packets/sec (max)",
-                          "GPRINT:rx:AVERAGE:%7.0lf packets/sec (avg)\\n",
-                          "LINE1:tx#808080:Outgoing",
-                          "GPRINT:tx:LAST:\\: %7.0lf packets/sec (now)",
-                          "GPRINT:tx:MAX:%7.0lf packets/sec (max)",
-                          "GPRINT:tx:AVERAGE:%7.0lf packets/sec (avg)")
+        return OverviewPage()
 
-    def make_html(self):
-        """Generate the bytes and packets HTML pages."""
-        for kind in ("bytes", "packets"):
-            template = DetailsPage()
-            template.kind = kind
-            template_fill(template, "traffic detail for " + self.name + " (" + kind + "/sec)")
-            template_write(template, self.graphs_dir + "/" + kind + ".html")
+    def _make_total_html(self):
+        from templates.counters.detailed import detailed as DetailsPage
+
+        template = DetailsPage()
+        template.kind = "total"
+        template_fill(template, "traffic detail for all interfaces (bytes/sec)")
+        template_write(template, self.graphs_dir + "/total.html")
 
         
 # EOF - counters.py
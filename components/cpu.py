@@ -24,11 +24,12 @@
 
 
 import os
-import rrdtool
 import re
 
 from components.common import *
-from templates.cpu.index import index as CPUPage
+from components import storage
+from components.arraystore import numpy
+from components.graphspec import GraphSpec
 
 
 #
@@ -36,6 +37,50 @@ from templates.cpu.index import index as CPUPage
 #
 DATA_SOURCE = "/proc/stat"
 
+#
+# The accumulated times on each "cpu" line, in order (after "idle", which
+# isn't kept). Older kernels have fewer of them, the missing ones are unknown.
+#
+FIELDS = ("user", "nice", "system", "iowait", "irq", "softirq", "steal")
+FIELD_INDEXES = (0, 1, 2, 4, 5, 6, 7)
+
+# The color and legend for each field, in the graphics.
+LEGENDS = { "user"    : ("#a0df05", "User   "),
+            "system"  : ("#dc3c14", "System "),
+            "nice"    : ("#ffe100", "Nice   "),
+            "iowait"  : ("#3c8cdc", "IOwait "),
+            "irq"     : ("#8c3cb4", "IRQ    "),
+            "softirq" : ("#c896dc", "SoftIRQ"),
+            "steal"   : ("#505050", "Steal  ") }
+
+# All processors share a single data file, with the data sources for
+# each named after it (eg. "cpu12_iowait").
+CORES_DATABASE = "cores.rrd"
+
+
+def _usage_graph(title, fields):
+    """Return the graphic of the CPU usage, with the given fields."""
+    spec = GraphSpec(title, "percentage", upper=100.0)
+
+    for field in fields:
+        spec.define(field, field)
+
+    # The original three come first (in their original order), then the rest.
+    shown = [field for field in ("user", "system", "nice") + FIELDS[3:] if field in fields]
+
+    # Since the values stored into the database are in 1/100th of a
+    # second units, the resulting "rate" is already a percentage,
+    # so no extra calculations are needed.
+    for i, field in enumerate(shown):
+        color, legend = LEGENDS[field]
+        spec.area(field, color, legend, stack=(i > 0))
+        spec.summary(field, "%6.1lf%%", newline=(i < len(shown) - 1))
+
+    return spec
+
+
+CORE_GRAPH = _usage_graph("%(name)s usage (%%)", FIELDS)
+
 
 class CPUUsage(StatsComponent):
     """CPU Usage Statistics."""
@@ -44,15 +89,18 @@ class CPUUsage(StatsComponent):
         
         self.name = "cpu"
 
-        if not os.path.exists(DATA_SOURCE):
+        if not os.path.exists(source_path(DATA_SOURCE)):
             fail(self.name, "cannot find \"%s\"." % DATA_SOURCE)
             raise StatsException(DATA_SOURCE + " does not exist")
         
+        self.sources = [DATA_SOURCE]
+
         self.title = "CPU"
         self.description = "CPU usage (overview)"
 
         self.data_dir = properties["data"] + "/" + self.name
         self.database = self.data_dir + "/cpu.rrd"
+        self.cores_database = self.data_dir + "/" + CORES_DATABASE
         self.graphs_dir = properties["output"] + "/" + self.name
 
         if not os.path.exists(self.data_dir):
@@ -61,101 +109,171 @@ class CPUUsage(StatsComponent):
         if not os.path.exists(self.graphs_dir):
             os.makedirs(self.graphs_dir)
 
-        if not os.path.exists(self.database):
-            #
-            # Remember: all "time" values are expressed in jiffies (1/100 seconds).
-            #
-            refresh = properties["refresh"]
-            heartbeat = refresh * 2
-            rrdtool.create(self.database,
-                           "--step", "%d" % refresh,
-                           "DS:user:DERIVE:%d:0:U" % heartbeat,
-                           "DS:nice:DERIVE:%d:0:U" % heartbeat,
-                           "DS:system:DERIVE:%d:0:U" % heartbeat,
-                           "RRA:AVERAGE:0.5:1:%d" % (86400 / refresh),    # 1 day of 'refresh' averages
-                           "RRA:AVERAGE:0.5:%d:672" % (900 / refresh),    # 7 days of 1/4 hour averages
-                           "RRA:AVERAGE:0.5:%d:744" % (3600 / refresh),   # 31 days of 1 hour averages
-                           "RRA:AVERAGE:0.5:%d:730" % (43200 / refresh))  # 365 days of 1/2 day averages
+        # Data files from older versions only have "user", "nice" and "system".
+        self.fields = self._ensure()
+        self.graph = _usage_graph("CPU usage (%%) over %(count)d processor(s)", self.fields)
+
+        # The processors as found in the last snapshot, those of them in the data
+        # file for each processor, and their data sources ("template").
+        self.cores = []
+        self.stored_cores = None
+        self.template = None
+
+    def _definition(self, prefixes):
+        """Return the arguments to create a data file with all fields for each prefix."""
+        #
+        # Remember: all "time" values are expressed in jiffies (1/100 seconds).
+        #
+        refresh = properties["refresh"]
+        heartbeat = refresh * 2
+
+        args = ["--step", "%d" % refresh]
+        for prefix in prefixes:
+            args.extend(["DS:%s%s:DERIVE:%d:0:U" % (prefix, field, heartbeat) for field in FIELDS])
+
+        return args + ["RRA:AVERAGE:0.5:1:%d" % (86400 / refresh),    # 1 day of 'refresh' averages
+                       "RRA:AVERAGE:0.5:%d:672" % (900 / refresh),    # 7 days of 1/4 hour averages
+                       "RRA:AVERAGE:0.5:%d:744" % (3600 / refresh),   # 31 days of 1 hour averages
+                       "RRA:AVERAGE:0.5:%d:730" % (43200 / refresh)]  # 365 days of 1/2 day averages
+
+    def _ensure(self):
+        """Create the data file for all processors added up, or add the fields
+           missing from an existing one. Return the fields it has, as older
+           versions of rrdtool can't add them."""
+        try:
+            storage.ensure(self.database, *self._definition([""]))
+        except StatsError:
+            existing = storage.sources(self.database)
+            return [field for field in FIELDS if field in existing]
+
+        return list(FIELDS)
+
+    def _ensure_cores(self):
+        """Create the data file for each processor, or add the processors
+           missing from an existing one (eg. brought online since). Return
+           the processors it has, as older versions of rrdtool can't add them."""
+        try:
+            storage.ensure(self.cores_database, *self._definition([core + "_" for core in self.cores]))
+        except StatsError:
+            existing = dict.fromkeys(storage.sources(self.cores_database))
+            return [core for core in self.cores if core + "_" + FIELDS[0] in existing]
+
+        return self.cores
 
     def info(self):
         """Return some information about the component,
            as a tuple: (name, title, description)"""
         return (self.name, self.title, self.description)
 
-    def update(self):
+    def _parse(self, snapshot):
+        """Parse the accumulated CPU times for all processors added up, and
+           for each one (in "cores"), as lists of strings with the values of
+           all FIELDS, and count the processors."""
+        stat = snapshot.parsed(DATA_SOURCE, parse_keyed)
+
+        regexp = re.compile("cpu\d+$")
+        cores = [(int(key[3:]), key) for key in stat if regexp.match(key)]
+        cores.sort()
+
+        self.cores = [key for number, key in cores]
+        self.cpu_count = len(self.cores)
+
+        # All these values represent an accumulated time since boot. The
+        # unit is jiffies (1/100 seconds). They are stored as given, so
+        # they are only checked here.
+        missing = ["U"] * (max(FIELD_INDEXES) + 1)
+
+        rows = []
+        for key in ["cpu"] + self.cores:
+            row = stat.get(key, [])
+            if len(row) < 3 or not "".join(row).isdigit():
+                raise StatsError("cannot parse " + DATA_SOURCE)
+
+            row = row + missing[len(row):]
+            rows.append([row[i] for i in FIELD_INDEXES])
+
+        return (rows[0], rows[1:])
+
+    def load(self):
+        """Find the processors, for the graphics."""
+        self._parse(Snapshot(self.sources))
+
+    def update(self, snapshot):
         """Update the historical data."""
-        f = open(DATA_SOURCE, "r")
+        total, cores = self._parse(snapshot)
 
-        regexp = re.compile("cpu\s+(\d+)\s+(\d+)\s+(\d+)")
-        line = f.readline()
-        match = regexp.match(line)
-        if not match:
-            raise StatsError("cannot parse " + DATA_SOURCE)
+        storage.update(self.database,
+                       ":".join(self.fields),
+                       ":".join([total[FIELDS.index(field)] for field in self.fields]),
+                       snapshot.time)
 
-        # All these values represent an accumulated time since boot.
-        # The unit is jiffies (1/100 seconds).
-        user, nice, system = match.groups()
-        user, nice, system = int(user), int(nice), int(system)
+        if self.cpu_count < 2:
+            return  # nothing to add to the total.
 
-        regexp = re.compile("cpu\d*")
-        self.cpu_count = 0
-        for line in f:
-            if regexp.match(line):
-                self.cpu_count += 1
-            
-        f.close()
-
-        rrdtool.update(self.database,
-                       "--template", "user:nice:system",
-                       "N:%d:%d:%d" % (user, nice, system))
-        
-    def make_graphs(self):
-        """Generate the daily, weekly and monthly graphics."""
-        height = str(properties["height"])
-        width = str(properties["width"])
-        refresh = properties["refresh"]
-        background = properties["background"]
-        border = properties["border"]
-
-        # Since the values stored into the database are in 1/100th of a
-        # second units, the resulting "rate" is already a percentage,
-        # so no extra calculations are needed.
-        for interval in ("1day", "1week", "1month", "1year"):
-            rrdtool.graph("%s/graph-%s.png" % (self.graphs_dir, interval), 
-                          "--start", "-%s" % interval,
-                          "--end", "-%d" % refresh,  # because the last data point is still *unknown*
-                          "--title", "CPU usage (%%) over %d processor(s)" % self.cpu_count,
-                          "--lazy",
-                          "--height", height,
-                          "--width", width,
-                          "--lower-limit", "0",
-                          "--upper-limit", "100.0",
-                          "--imgformat", "PNG",
-                          "--vertical-label", "percentage",
-                          "--color", "BACK%s" % background,
-                          "--color", "SHADEA%s" % border,
-                          "--color", "SHADEB%s" % border,
-                          "DEF:user=%s:user:AVERAGE" % self.database,
-                          "DEF:system=%s:system:AVERAGE" % self.database,
-                          "DEF:nice=%s:nice:AVERAGE" % self.database,
-                          "AREA:user#a0df05:User  ",
-                          "GPRINT:user:LAST:\\: %6.1lf%% (now)",
-                          "GPRINT:user:MAX:%6.1lf%% (max)",
-                          "GPRINT:user:AVERAGE:%6.1lf%% (avg)\\n",
-                          "STACK:system#dc3c14:System",
-                          "GPRINT:system:LAST:\\: %6.1lf%% (now)",
-                          "GPRINT:system:MAX:%6.1lf%% (max)",
-                          "GPRINT:system:AVERAGE:%6.1lf%% (avg)\\n",
-                          "STACK:nice#ffe100:Nice  ",
-                          "GPRINT:nice:LAST:\\: %6.1lf%% (now)",
-                          "GPRINT:nice:MAX:%6.1lf%% (max)",
-                          "GPRINT:nice:AVERAGE:%6.1lf%% (avg)")
+        if self.stored_cores is None or self.cores != self.stored_cores:
+            stored = dict.fromkeys(self._ensure_cores())
+            self.stored_cores = self.cores
+            self.indexes = [i for i, core in enumerate(self.cores) if core in stored]
+            self.template = ":".join([self.cores[i] + "_" + field for i in self.indexes for field in FIELDS])
+
+        # All processors at once, with a single update.
+        values = []
+        for i in self.indexes:
+            values.extend(cores[i])
+
+        storage.update(self.cores_database, self.template, ":".join(values), snapshot.time)
+
+    def graphs(self):
+        """Return the daily, weekly, monthly and yearly graphics, for all
+           processors added up and for each one (or as a single heatmap,
+           if there are too many of them)."""
+        jobs = self.graph.jobs(self.graphs_dir + "/graph-", database=self.database, count=self.cpu_count)
+
+        if self.cpu_count < 2:
+            return jobs
+
+        # Without NumPy, there's no heatmap to show them instead.
+        if numpy is not None:
+            rows = [(core, self.cores_database, [core + "_" + field for field in FIELDS]) for core in self.cores]
+            for interval in INTERVALS:
+                jobs.append(HeatmapJob(interval, "%s/heatmap-%s.png" % (self.graphs_dir, interval), rows,
+                                       "CPU usage (%) per processor", "%", upper=100.0))
+
+            # Too many processors are only shown in the heatmap.
+            if self.cpu_count > properties["heatmap"]:
+                return jobs
+
+        for core in self.cores:
+            jobs.extend(CORE_GRAPH.jobs("%s/graph-%s-" % (self.graphs_dir, core),
+                                        database=self.cores_database, prefix=core + "_", name=core))
+
+        return jobs
                          
     def make_html(self):
         """Generate the HTML pages."""
+        from templates.cpu.index import index as CPUPage
+        from templates.cpu.cores import cores as CoresPage
+        from templates.cpu.detailed import detailed as DetailsPage
+
         template = CPUPage()
+        template.heatmap = self.cpu_count > 1 and numpy is not None
+        template.cores = self.cpu_count > 1 and (self.cpu_count <= properties["heatmap"] or numpy is None)
         template_fill(template, self.description)
         template_write(template, self.graphs_dir + "/index.html")
 
+        if not template.cores:
+            return
+
+        template = CoresPage()
+        template.cores = self.cores
+        template_fill(template, "CPU usage (per processor)")
+        template_write(template, self.graphs_dir + "/cores.html")
+
+        for core in self.cores:
+            template = DetailsPage()
+            template.core = core
+            template_fill(template, "CPU usage (%s)" % core)
+            template_write(template, "%s/%s.html" % (self.graphs_dir, core))
+
         
 # EOF - cpu.py
@@ -0,0 +1,643 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# devices.py - devices that come and go
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Bookkeeping for the components with a set of devices that changes over
+   time (disks, network interfaces): which devices to track at all, which
+   ones are busy enough to be graphed in detail, and which ones are gone
+   for good, to stop graphing them and remove their data. The components
+   themselves, and their devices, share most of their code through the
+   DeviceComponent and Device base classes."""
+
+
+import os
+import re
+import shutil
+import fnmatch
+
+from time import time
+
+from components.common import *
+from components import storage
+from components.arraystore import numpy
+
+
+#
+# The file (in each component's data directory) where we keep track
+# of when each device was last seen.
+#
+# Each line refers to a single device, with the following format:
+#
+#   "time name"
+#
+LAST_SEEN = "last-seen"
+
+# The data file for all devices of a component, with consolidated storage.
+CONSOLIDATED_DATABASE = "consolidated.rrd"
+
+#
+# The data file with the throughput of all devices of a component added up,
+# as collected, so that graphing it takes a single small file however many
+# devices there are. It's kept in a directory of its own, apart from the
+# data files of each device (which may be named anything). The rates are
+# calculated from the counters of each device in the previous snapshot,
+# kept in another file.
+#
+# The first line of that file holds the time of the snapshot, and each
+# other line refers to a single device, with the following format:
+#
+#   "value value... name"
+#
+TOTAL_DATABASE = "total/total.rrd"
+LAST_VALUES = "last-values"
+
+
+def device_filter(component, default_exclude=()):
+    """Return a function that checks if a device should be tracked, by its
+       name. Devices must match one of the glob patterns in the "include"
+       property for the component (if any) and none of those in "exclude"
+       (or "default_exclude", if none). All patterns are combined into a
+       single regular expression, so that checking is cheap."""
+    include = properties["include"].get(component, [])
+    exclude = properties["exclude"].get(component, default_exclude)
+
+    regexp = "(?:%s)\\Z" % ("|".join([_translate(pattern) for pattern in include]) or ".*")
+    if exclude:
+        regexp = "(?!(?:%s)\\Z)" % "|".join([_translate(pattern) for pattern in exclude]) + regexp
+
+    return re.compile(regexp, re.S).match
+
+
+def _translate(pattern):
+    """Return a glob pattern as a regular expression, without anchoring it at the end."""
+    regexp = fnmatch.translate(pattern)
+
+    # Python 2.7 anchors it with "\Z(?ms)", older versions with "$".
+    for suffix in ("\\Z(?ms)", "$"):
+        if regexp.endswith(suffix):
+            return regexp[:-len(suffix)]
+
+    return regexp
+
+
+class LastSeen(object):
+    """Keeps track of when each device was last seen."""
+    def __init__(self, data_dir):
+        self.filename = data_dir + "/" + LAST_SEEN
+        self.times = {}
+
+        if not os.path.exists(self.filename):
+            return
+
+        f = open(self.filename, "r")
+
+        for line in f:
+            values = line.split(None, 1)
+            if len(values) != 2:
+                continue
+
+            try:
+                self.times[values[1].rstrip("\n")] = int(values[0])
+            except ValueError:
+                continue  # a damaged entry only means the device is tracked from scratch.
+
+        f.close()
+
+    def get(self, name):
+        """Return when a device was last seen, or None if unknown."""
+        return self.times.get(name)
+
+    def latest(self):
+        """Return when any device was last seen (ie. the last snapshot)."""
+        return max(self.times.values() + [0])
+
+    def seen(self, names, timestamp):
+        for name in names:
+            self.times[name] = timestamp
+
+    def is_expired(self, name, now):
+        """Check if a device hasn't been seen for longer than the "expire"
+           property. Devices never seen (eg. with historical data from
+           before they were tracked) aren't."""
+        if not properties["expire"] or name not in self.times:
+            return False
+
+        return now - self.times[name] > properties["expire"]
+
+    def forget(self, name):
+        if name in self.times:
+            del self.times[name]
+
+    def save(self):
+        # Write to a temporary file first, so that other processes
+        # never read an incomplete list.
+        f = open(self.filename + ".tmp", "w")
+
+        for name, last in self.times.items():
+            f.write("%d %s\n" % (last, name))
+
+        f.close()
+        os.rename(self.filename + ".tmp", self.filename)
+
+
+def collect_garbage(data_dir, graphs_dir, database, last_seen, archive=None):
+    """Remove the historical data and the graphics of all devices of a
+       component not seen for longer than the "expire" property. With a
+       consolidated "database", only their data sources are removed from
+       it. If "archive" is given, the data files are copied into that
+       directory before anything is removed from them.
+
+       Return the names of the devices removed, sorted."""
+    now = time()
+
+    if database is None:
+        names = [filename[:-4] for filename in storage.databases(data_dir)]
+    elif storage.exists(database):
+        names = storage.devices(database)
+    else:
+        names = []
+
+    # The clock starts now for devices with data from before they were tracked.
+    last_seen.seen([name for name in names if last_seen.get(name) is None], now)
+
+    expired = [name for name in names if last_seen.is_expired(name, now)]
+    expired.sort()
+
+    if database is None:
+        for name in expired:
+            if archive is not None:
+                storage.archive(data_dir + "/" + name + ".rrd", archive)
+
+            storage.remove(data_dir + "/" + name + ".rrd")
+    elif expired:
+        if archive is not None:
+            storage.archive(database, archive)
+
+        if len(expired) == len(names):
+            storage.remove(database)
+        else:
+            prefixes = tuple([name + "/" for name in expired])
+            storage.remove(database, [source for source in storage.sources(database) if source.startswith(prefixes)])
+
+    # This also covers the devices which left no data behind.
+    for name in last_seen.times.keys():
+        if last_seen.is_expired(name, now):
+            shutil.rmtree(graphs_dir + "/" + name, True)
+            last_seen.forget(name)
+
+    last_seen.save()
+
+    return expired
+
+
+def device_matcher(patterns):
+    """Return a function that checks if a device name matches any of the glob patterns."""
+    if not patterns:
+        return lambda name: False
+
+    return re.compile("(?:%s)\\Z" % "|".join([_translate(pattern) for pattern in patterns]), re.S).match
+
+
+def rank(devices, sources, window=3600):
+    """Return the recent throughput of each device, as a dictionary by name,
+       added up from the average rates of its "sources" over the last "window"
+       seconds. Devices are objects with "name", "database" and "prefix" (for
+       the data source names), and those sharing a data file are read from
+       it all at once. Devices without any recent data get zero."""
+    groups = {}
+    for device in devices:
+        groups.setdefault(device.database, []).append(device)
+
+    end = int(time())
+    rates = {}
+
+    for database, group in groups.items():
+        names = []
+        for device in group:
+            names.extend([device.prefix + source for source in sources])
+
+        try:
+            values = storage.fetch(database, "AVERAGE", end - window, end, sources=names)[2]
+        except storage.error:
+            values = numpy.zeros((len(names), 0))
+
+        known = ~numpy.isnan(values)
+        averages = numpy.where(known, values, 0.0).sum(axis=1) / numpy.maximum(known.sum(axis=1), 1)
+        totals = averages.reshape(len(group), len(sources)).sum(axis=1)
+
+        for device, total in zip(group, totals):
+            rates[device.name] = float(total)
+
+    return rates
+
+
+def busiest(rates, count):
+    """Return the names of the "count" devices with the highest rates, busiest first."""
+    names = [(-rate, name) for name, rate in rates.items()]
+    names.sort()
+
+    return [name for rate, name in names[:count]]
+
+
+class DeviceComponent(StatsComponent):
+    """Base class for the components with a set of devices that changes over
+       time. Subclasses set "name" (and the rest of what a component has)
+       before calling __init__(), parse their data sources in update() for
+       the devices accepted by "accept", and pass on their values to
+       _store(). Each device is an instance of "device_class"."""
+    device_class = None
+
+    # The data sources adding up to a device's throughput, to rank the
+    # devices graphed in detail, to draw their heatmaps and, added up
+    # over all devices, for the graphics of the whole component.
+    throughput = ()
+
+    # The title, label and base for the heatmaps, and the unit for the
+    # throughput of the devices listed (not graphed) on the overview page.
+    heatmap_title = ""
+    heatmap_label = ""
+    heatmap_base = 1000
+    rate_unit = 1
+
+    def __init__(self):
+        self.devices = {}
+
+        self.data_dir = properties["data"] + "/" + self.name
+        self.graphs_dir = properties["output"] + "/" + self.name
+
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+            
+        if not os.path.exists(self.graphs_dir):
+            os.makedirs(self.graphs_dir)
+
+        # With consolidated storage, all devices share a single data file,
+        # and those registered since it was last updated must be added.
+        self.database = None
+        if properties["consolidate"]:
+            self.database = self.data_dir + "/" + CONSOLIDATED_DATABASE
+
+        self.added = []
+
+        self.last_seen = LastSeen(self.data_dir)
+
+        # The throughput of all devices added up, and what it's calculated from.
+        self.total_database = self.data_dir + "/" + TOTAL_DATABASE
+        self.last_values = None
+
+        if not os.path.exists(os.path.dirname(self.total_database)):
+            os.makedirs(os.path.dirname(self.total_database))
+
+        if not storage.exists(self.total_database):
+            refresh = properties["refresh"]
+            heartbeat = refresh * 2
+
+            args = ["--step", "%d" % refresh]
+            args.extend(["DS:%s:GAUGE:%d:0:U" % (source, heartbeat) for source in self.throughput])
+            args.extend(["RRA:AVERAGE:0.5:1:%d" % (86400 / refresh),    # 1 day of 'refresh' averages
+                         "RRA:AVERAGE:0.5:%d:672" % (900 / refresh),    # 7 days of 1/4 hour averages
+                         "RRA:AVERAGE:0.5:%d:744" % (3600 / refresh),   # 31 days of 1 hour averages
+                         "RRA:AVERAGE:0.5:%d:730" % (43200 / refresh)]) # 365 days of 1/2 day averages
+            storage.create(self.total_database, *args)
+
+        # The devices graphed in detail, and the recent rates of all
+        # devices (to rank them), when not all are graphed.
+        self.graphed = None
+        self.rates = {}
+
+        self.draw = device_matcher(properties["draw"].get(self.name))
+
+    def info(self):
+        """Return some information about the component,
+           as a tuple: (name, title, description)"""
+        return (self.name, self.title, self.description)
+
+    def _register(self, name):
+        if name in self.devices:
+            device = self.devices[name]
+        else:
+            device = self.device_class(name, self.data_dir, self.graphs_dir, self.database)
+            self.devices[name] = device
+
+            if self.database is not None:
+                self.added.append(device)
+
+        return device
+
+    def _expire(self, now):
+        """Forget about the devices not seen for too long."""
+        for name in self.devices.keys():
+            if self.last_seen.is_expired(name, now):
+                del self.devices[name]
+
+    def _store(self, updates, timestamp):
+        """Update the historical data for all devices, given as a list
+           of (device, values), with the values of all its sources."""
+        self.last_seen.seen([device.name for device, values in updates], timestamp)
+        self.last_seen.save()
+
+        self._expire(timestamp)
+        self._store_total(updates, timestamp)
+
+        if self.database is None:
+            for device, values in updates:
+                device.update(values, timestamp)
+
+            return
+
+        if self.added:
+            args = self.added[0].definition()
+            for device in self.added[1:]:
+                args.extend([arg for arg in device.definition() if arg.startswith("DS:")])
+
+            storage.ensure(self.database, *args)
+            self.added = []
+
+        # All devices at once, with a single update.
+        if updates:
+            storage.update(self.database,
+                           ":".join([device.template for device, values in updates]),
+                           ":".join([device.format(values) for device, values in updates]),
+                           timestamp)
+
+    def _read_last_values(self):
+        """Return the time of the previous snapshot (or None if unknown) and the
+           throughput counters of each device in it, as a dictionary by name."""
+        filename = self.data_dir + "/" + LAST_VALUES
+        if not os.path.exists(filename):
+            return (None, {})
+
+        f = open(filename, "r")
+
+        try:
+            try:
+                last = int(f.readline())
+            except ValueError:
+                return (None, {})  # a damaged file only means the total is unknown, once.
+
+            values = {}
+            for line in f:
+                fields = line.split(None, len(self.throughput))
+                if len(fields) == len(self.throughput) + 1:
+                    try:
+                        values[fields[-1].rstrip("\n")] = [int(value) for value in fields[:-1]]
+                    except ValueError:
+                        continue
+        finally:
+            f.close()
+
+        return (last, values)
+
+    def _write_last_values(self, timestamp, values):
+        # Write to a temporary file first, so that an interrupted
+        # write doesn't leave behind an incomplete list.
+        filename = self.data_dir + "/" + LAST_VALUES
+        f = open(filename + ".tmp", "w")
+
+        f.write("%d\n" % timestamp)
+        for name, counters in values.items():
+            f.write("%s %s\n" % (" ".join(["%d" % value for value in counters]), name))
+
+        f.close()
+        os.rename(filename + ".tmp", filename)
+
+    def _store_total(self, updates, timestamp):
+        """Update the throughput of all devices added up, from the rates of
+           each device since the previous snapshot. Devices missing from either
+           snapshot, or with counters that went back (eg. reset), are left out."""
+        if self.last_values is None:
+            self.last_values = self._read_last_values()
+
+        last, previous = self.last_values
+
+        indexes = [list(self.device_class.sources).index(source) for source in self.throughput]
+
+        current = {}
+        for device, values in updates:
+            current[device.name] = [values[i] for i in indexes]
+
+        self._write_last_values(timestamp, current)
+        self.last_values = (timestamp, current)
+
+        # As with the data files of each device, rates over too long are unknown.
+        if last is None or not 0 < timestamp - last <= properties["refresh"] * 2:
+            return
+
+        elapsed = float(timestamp - last)
+        totals = [0.0] * len(self.throughput)
+
+        for name, counters in current.items():
+            if name not in previous:
+                continue
+
+            deltas = [value - before for value, before in zip(counters, previous[name])]
+            if min(deltas) < 0:
+                continue
+
+            for i in xrange(len(deltas)):
+                totals[i] += deltas[i] / elapsed
+
+        storage.update(self.total_database,
+                       ":".join(self.throughput),
+                       ":".join(["%f" % total for total in totals]),
+                       timestamp)
+
+    def load(self):
+        """Register all devices for which there is historical
+           data, except those not seen for too long."""
+        self.last_seen = LastSeen(self.data_dir)
+
+        if self.database is None:
+            names = [filename[:-4] for filename in storage.databases(self.data_dir)]
+        elif storage.exists(self.database):
+            names = storage.devices(self.database)
+        else:
+            names = []
+
+        for name in names:
+            if self.accept(name):
+                self._register(name)
+
+        self._expire(time())
+
+    def _rank(self):
+        """Choose the devices to graph in detail: all of them or, if the "top"
+           property is set, only the busiest ones (plus those always drawn)."""
+        if not properties["top"]:
+            self.graphed = self.devices.keys()
+            self.graphed.sort()
+            self.rates = {}
+            return
+
+        self.rates = rank(self.devices.values(), self.throughput)
+
+        self.graphed = busiest(self.rates, properties["top"])
+        for name in self.devices:
+            if self.draw(name) and name not in self.graphed:
+                self.graphed.append(name)
+
+    def _heatmaps(self):
+        """Return the heatmaps of the throughput of all devices, one row each."""
+        names = self.devices.keys()
+        names.sort()
+
+        rows = []
+        for device in [self.devices[name] for name in names]:
+            rows.append((device.name, device.database, [device.prefix + source for source in self.throughput]))
+
+        return [HeatmapJob(interval, "%s/heatmap-%s.png" % (self.graphs_dir, interval), rows,
+                           self.heatmap_title, self.heatmap_label, base=self.heatmap_base) for interval in INTERVALS]
+
+    def graphs(self):
+        """Return the daily, weekly, monthly and yearly graphics for the devices
+           graphed in detail, and for all devices added up (if more than one)."""
+        jobs = []
+
+        if len(self.devices) > 1:
+            jobs.extend(self._total_graphs())
+
+            if numpy is not None:
+                jobs.extend(self._heatmaps())
+
+        self._rank()
+
+        latest = self.last_seen.latest()
+
+        for name in self.graphed:
+            device = self.devices[name]
+            updated = self.last_seen.get(name)
+
+            for job in device.graphs():
+                # Devices missing from the last snapshot have no new data.
+                if updated is not None and updated < latest:
+                    job.updated = updated
+
+                jobs.append(job)
+
+        return jobs
+
+    def collect_garbage(self, archive=None):
+        """Remove the historical data and graphics of the devices gone for too long."""
+        return collect_garbage(self.data_dir, self.graphs_dir, self.database, self.last_seen, archive)
+
+    def _total_graphs(self):
+        """Return the graphics for all devices added up (from "total_database")."""
+        raise NotImplementedError, "method not implemented"
+
+    def _overview_page(self):
+        """Return the template for the overview page."""
+        raise NotImplementedError, "method not implemented"
+
+    def _make_total_html(self):
+        """Generate the page for all devices added up."""
+        raise NotImplementedError, "method not implemented"
+
+    def make_html(self):
+        """Generate the HTML pages for all devices."""
+        if self.graphed is None:
+            self._rank()
+
+        # The devices not graphed in detail are listed, busiest first.
+        others = [(-self.rates.get(name, 0.0), name) for name in self.devices if name not in self.graphed]
+        others.sort()
+
+        template = self._overview_page()
+        template.devices = [name for name in self.graphed if name in self.devices]
+        template.total = len(self.devices) > 1
+        template.heatmap = template.total and numpy is not None
+        template.others = [(name, "%.1f" % (-rate / self.rate_unit)) for rate, name in others]
+        template.top = properties["top"]
+        
+        template_fill(template, self.description)
+        template_write(template, self.graphs_dir + "/index.html")
+
+        if template.total:
+            self._make_total_html()
+
+        # The others have no graphics (or outdated ones), so no pages either.
+        for name in template.devices:
+            self.devices[name].make_html()
+
+
+class Device(object):
+    """Stores the historical data for a single device, either in a data
+       file of its own or in one shared with all other devices of the same
+       component. Subclasses set "sources", the names of the counters kept
+       for each device (all of them as "DERIVE" data sources)."""
+    sources = ()
+
+    def __init__(self, name, data_dir, graphs_dir, database=None):
+        self.name = name
+        self.graphs_dir = graphs_dir + "/" + self.name
+
+        if database is None:
+            self.database = data_dir + "/" + self.name + ".rrd"
+            self.prefix = ""
+        else:
+            # The data sources are named after the device, in the shared file.
+            self.database = database
+            self.prefix = self.name + "/"
+
+        self.template = ":".join([self.prefix + source for source in self.sources])
+        
+        if not os.path.exists(self.graphs_dir):
+            os.makedirs(self.graphs_dir)
+
+        if database is None and not storage.exists(self.database):
+            storage.create(self.database, *self.definition())
+
+    def definition(self):
+        """Return the arguments to create the data file for this device."""
+        #
+        # Remember: all "time" values are expressed in seconds.
+        #
+        refresh = properties["refresh"]
+        heartbeat = refresh * 2
+
+        args = ["--step", "%d" % refresh]
+        args.extend(["DS:%s%s:DERIVE:%d:0:U" % (self.prefix, source, heartbeat) for source in self.sources])
+
+        return args + ["RRA:AVERAGE:0.5:1:%d" % (86400 / refresh),    # 1 day of 'refresh' averages
+                       "RRA:AVERAGE:0.5:%d:672" % (900 / refresh),    # 7 days of 1/4 hour averages
+                       "RRA:AVERAGE:0.5:%d:744" % (3600 / refresh),   # 31 days of 1 hour averages
+                       "RRA:AVERAGE:0.5:%d:730" % (43200 / refresh)]  # 365 days of 1/2 day averages
+
+    def __str__(self):
+        return self.name
+
+    def format(self, values):
+        """Return the values of all sources, as given to "storage.update()"."""
+        return ":".join(["%d" % value for value in values])
+
+    def update(self, values, timestamp):
+        """Update the historical data."""
+        storage.update(self.database, self.template, self.format(values), timestamp)
+
+    def graphs(self):
+        """Return the daily, weekly, monthly and yearly graphics."""
+        raise NotImplementedError, "method not implemented"
+
+    def make_html(self):
+        """Generate the HTML pages."""
+        raise NotImplementedError, "method not implemented"
+
+
+# EOF - devices.py
@@ -24,13 +24,10 @@
 
 
 import os
-import re
-import rrdtool
 
 from components.common import *
-
-from templates.disks.index import index as OverviewPage
-from templates.disks.detailed import detailed as DetailsPage
+from components import devices
+from components.graphspec import GraphSpec
 
 
 #
@@ -39,22 +36,72 @@ from templates.disks.detailed import detailed as DetailsPage
 DATA_SOURCE = "/proc/diskstats"
 DATA_SOURCE_OLD = "/proc/partitions"  # 2.4.x <= linux < 2.6.x
 
+# The devices ignored unless set otherwise: ramdisks (including "zram"),
+# floppies and loop devices and, as only disks matter to us, partitions on
+# 2.4.x. These match anywhere in the name (eg. "cciss/c0d0part1").
+DEFAULT_EXCLUDE = ("*ram[0-9]*", "*fd[0-9]*", "*loop[0-9]*")
+DEFAULT_EXCLUDE_OLD = DEFAULT_EXCLUDE + ("*part[0-9]*", "*[sh]d[a-z]*[0-9]*")
+
 # Number of fields on a device entry.
 DEV_FIELD_COUNT = 14
 DEV_FIELD_COUNT_OLD = 15  # 2.4.x <= linux < 2.6.x
 
 
-class DiskStats(StatsComponent):
+def _disk_graph():
+    spec = GraphSpec("%(name)s - sectors read/written", "operations/sec", upper=1.0)
+    spec.define("reads", "sector_reads")
+    spec.define("writes", "sector_writes")
+    spec.area("reads", "#a0df05", "Reads ")
+    spec.summary("reads", "%9.1lf op/sec")
+    spec.line("writes", "#808080", "Writes")
+    spec.summary("writes", "%9.1lf op/sec", newline=False)
+
+    return spec
+
+
+DISK_GRAPH = _disk_graph()
+
+
+class Disk(devices.Device):
+    """Stores the historical data for a single disk, either in a data
+       file of its own or in one shared with all other disks."""
+    sources = ("sector_reads", "sector_writes")
+
+    def graphs(self):
+        """Return the daily, weekly, monthly and yearly graphics."""
+        return DISK_GRAPH.jobs(self.graphs_dir + "/graph-",
+                               database=self.database, prefix=self.prefix, name=self.name)
+                          
+    def make_html(self):
+        """Generate the HTML pages."""
+        from templates.disks.detailed import detailed as DetailsPage
+
+        template = DetailsPage()
+        template.graph = "graph"
+        template_fill(template, "I/O details for " + self.name)
+        template_write(template, self.graphs_dir + "/index.html")
+
+
+class DiskStats(devices.DeviceComponent):
     """Disk Statistics."""
-    def __init__(self):
-        self.disks = {}
+    device_class = Disk
+
+    throughput = ("sector_reads", "sector_writes")
 
+    heatmap_title = "all disks - sectors read/written"
+    heatmap_label = "op/sec"
+
+    def __init__(self):
         self.name = "disks"
 
-        if os.path.exists(DATA_SOURCE):
+        if os.path.exists(source_path(DATA_SOURCE)):
             self.old_stats = False
-        elif os.path.exists(DATA_SOURCE_OLD):
+            self.sources = [DATA_SOURCE]
+            self.accept = devices.device_filter(self.name, DEFAULT_EXCLUDE)
+        elif os.path.exists(source_path(DATA_SOURCE_OLD)):
             self.old_stats = True
+            self.sources = [DATA_SOURCE_OLD]
+            self.accept = devices.device_filter(self.name, DEFAULT_EXCLUDE_OLD)
         else:
             fail(self.name, "cannot find \"%s\" or \"%s\"." % (DATA_SOURCE, DATA_SOURCE_OLD))
             raise StatsException(DATA_SOURCE + " does not exist, neither does " + DATA_SOURCE_OLD)
@@ -62,42 +109,19 @@ class DiskStats(StatsComponent):
         self.title = "Disk Storage"
         self.description = "I/O operation statistics"
 
-        self.data_dir = properties["data"] + "/" + self.name
-        self.graphs_dir = properties["output"] + "/" + self.name
-
-        if not os.path.exists(self.data_dir):
-            os.makedirs(self.data_dir)
-            
-        if not os.path.exists(self.graphs_dir):
-            os.makedirs(self.graphs_dir)
-
-    def info(self):
-        """Return some information about the component,
-           as a tuple: (name, title, description)"""
-        return (self.name, self.title, self.description)
+        devices.DeviceComponent.__init__(self)
 
-    def _register_disk(self, disk_name):
-        if disk_name in self.disks:
-            disk = self.disks[disk_name]
-        else:
-            disk = Disk(disk_name, self.data_dir, self.graphs_dir)
-            self.disks[disk_name] = disk
-            
-        return disk
-        
-    def _update_old(self):
+    def _update_old(self, snapshot):
         """Collect statistics on 2.4.x kernels."""
-        f = open(DATA_SOURCE_OLD, "r")
+        accept = self.accept
 
-        # Exclude partitions (only disks matter to us).
-        exclude = re.compile("(part|(s|h)d[a-z]+)\d+")
+        updates = []
 
-        f.next()  # skip the header
-        f.next()  # skip the blank line
-        
-        for line in f:
-            values = line.split()
-            if len(values) != DEV_FIELD_COUNT_OLD:
+        # Skip the header and the blank line.
+        for line in snapshot.lines(DATA_SOURCE_OLD)[2:]:
+            # The rest of the line is only split for the disks we track.
+            values = line.split(None, 4)
+            if len(values) != 5:
                 fail(self.name, "cannot parse \"%s\"." % DATA_SOURCE_OLD)
                 raise StatsException(DATA_SOURCE_OLD + ": wrong format")
             
@@ -106,137 +130,75 @@ class DiskStats(StatsComponent):
             # we must strip the "/"'s.
             disk_name = values[3].replace("/", ".")
 
-            if not exclude.search(disk_name):
-                sectors_reads = int(values[6])
-                sectors_writes = int(values[10])
+            if not accept(disk_name):
+                continue
 
-                disk = self._register_disk(disk_name)        
-                disk.update(sectors_reads, sectors_writes)
-        
-        f.close()        
+            values = values[:4] + values[4].split()
+            if len(values) != DEV_FIELD_COUNT_OLD:
+                fail(self.name, "cannot parse \"%s\"." % DATA_SOURCE_OLD)
+                raise StatsException(DATA_SOURCE_OLD + ": wrong format")
+
+            sectors_reads = int(values[6])
+            sectors_writes = int(values[10])
+
+            disk = self._register(disk_name)        
+            updates.append((disk, (sectors_reads, sectors_writes)))
+
+        self._store(updates, snapshot.time)
 
-    def _update(self):
+    def _update(self, snapshot):
         """Collect statistics on 2.6.x (or newer) kernels."""
-        f = open(DATA_SOURCE, "r")
+        accept = self.accept
 
-        # Exclude ramdisks, floppies and loop devices.
-        exclude = re.compile("(ram|fd|loop)\d+")
+        updates = []
 
-        for line in f:
-            values = line.split()
+        for line in snapshot.lines(DATA_SOURCE):
+            # The rest of the line is only split for the disks we track.
+            values = line.split(None, 3)
+            if len(values) != 4:
+                continue
 
             # Disk names may appear in an hierarchical format,
             # such as "cciss/c0d0", so we must strip the "/"'s.
             disk_name = values[2].replace("/", ".")
+
+            if not accept(disk_name):
+                continue
+
+            values = values[:3] + values[3].split()
             
-            if len(values) == DEV_FIELD_COUNT and not exclude.search(disk_name):
+            if len(values) == DEV_FIELD_COUNT:
                 sectors_reads = int(values[5])
                 sectors_writes = int(values[9])
 
-                disk = self._register_disk(disk_name)
-                disk.update(sectors_reads, sectors_writes)
-        
-        f.close()
+                disk = self._register(disk_name)
+                updates.append((disk, (sectors_reads, sectors_writes)))
+
+        self._store(updates, snapshot.time)
         
-    def update(self):
+    def update(self, snapshot):
         """Read the system counters and update the
            historical data for all disks."""
         if self.old_stats:
-            return self._update_old()
+            return self._update_old(snapshot)
         else:
-            return self._update()
+            return self._update(snapshot)
            
-    def make_graphs(self):
-        """Generate the daily, weekly and monthly graphics for all disks."""
-        for disk in self.disks.values():
-            disk.make_graphs()
+    def _total_graphs(self):
+        return DISK_GRAPH.jobs(self.graphs_dir + "/graph-total-", database=self.total_database, name="all disks")
 
-    def make_html(self):
-        """Generate the HTML pages for all disks."""
-        disks = self.disks.keys()
-        disks.sort()
-        
-        template = OverviewPage()
-        template.disks = disks
-        
-        template_fill(template, self.description)
-        template_write(template, self.graphs_dir + "/index.html")
+    def _overview_page(self):
+        from templates.disks.index import index as OverviewPage
+
+        return OverviewPage()
+
+    def _make_total_html(self):
+        from templates.disks.detailed import detailed as DetailsPage
 
-        for disk in self.disks.values():
-            disk.make_html()
-        
-            
-class Disk(object):
-    """Stores the historical data for a single disk."""
-    def __init__(self, name, data_dir, graphs_dir):
-        self.name = name
-        self.graphs_dir = graphs_dir + "/" + self.name
-        self.database = data_dir + "/" + self.name + ".rrd"
-        
-        if not os.path.exists(self.graphs_dir):
-            os.makedirs(self.graphs_dir)
-
-        if not os.path.exists(self.database):
-            refresh = properties["refresh"]
-            heartbeat = refresh * 2
-            rrdtool.create(self.database,
-                           "--step", "%d" % refresh,
-                           "DS:sector_reads:DERIVE:%d:0:U" % heartbeat,
-                           "DS:sector_writes:DERIVE:%d:0:U" % heartbeat,
-                           "RRA:AVERAGE:0.5:1:%d" % (86400 / refresh),    # 1 day of 'refresh' averages
-                           "RRA:AVERAGE:0.5:%d:672" % (900 / refresh),    # 7 days of 1/4 hour averages
-                           "RRA:AVERAGE:0.5:%d:744" % (3600 / refresh),   # 31 days of 1 hour averages
-                           "RRA:AVERAGE:0.5:%d:730" % (43200 / refresh))  # 365 days of 1/2 day averages
-
-    def __str__(self):
-        return self.name
-
-    def update(self, sector_reads, sector_writes):
-        """Update the historical data."""
-        rrdtool.update(self.database,
-                       "--template", "sector_reads:sector_writes",
-                       "N:%d:%d" % (sector_reads, sector_writes))
-
-    def make_graphs(self):
-        """Generate daily, weekly, monthly and yearly graphics."""
-        height = str(properties["height"])
-        width = str(properties["width"])
-        refresh = properties["refresh"]
-        background = properties["background"]
-        border = properties["border"]
-        
-        for interval in ("1day", "1week", "1month", "1year"):
-            rrdtool.graph("%s/graph-%s.png" % (self.graphs_dir, interval), 
-                          "--start", "-%s" % interval,
-                          "--end", "-%d" % refresh,  # because the last data point is still unknown
-                          "--title", "%s - sectors read/written" % self.name,
-                          "--lazy",
-                          "--base", "1000",
-                          "--height", height,
-                          "--width", width,
-                          "--lower-limit", "0",
-                          "--upper-limit", "1.0",
-                          "--imgformat", "PNG",
-                          "--vertical-label", "operations/sec",
-                          "--color", "BACK%s" % background,
-                          "--color", "SHADEA%s" % border,
-                          "--color", "SHADEB%s" % border,
-                          "DEF:reads=%s:sector_reads:AVERAGE" % self.database,
-                          "DEF:writes=%s:sector_writes:AVERAGE" % self.database,
-                          "AREA:reads#a0df05:Reads ",
-                          "GPRINT:reads:LAST:\\: %9.1lf op/sec (now)",
-                          "GPRINT:reads:MAX:%9.1lf op/sec (max)",
-                          "GPRINT:reads:AVERAGE:%9.1lf op/sec (avg)\\n",
-                          "LINE1:writes#808080:Writes",
-                          "GPRINT:writes:LAST:\\: %9.1lf op/sec (now)",
-                          "GPRINT:writes:MAX:%9.1lf op/sec (max)",
-                          "GPRINT:writes:AVERAGE:%9.1lf op/sec (avg)")
-                          
-    def make_html(self):
-        """Generate the HTML pages."""
         template = DetailsPage()
-        template_fill(template, "I/O details for " + self.name)
-        template_write(template, self.graphs_dir + "/index.html")
+        template.graph = "graph-total"
+        template_fill(template, "I/O details for all disks")
+        template_write(template, self.graphs_dir + "/total.html")
+
 
-        
 # EOF - disks.py
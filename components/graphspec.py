@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# graphspec.py - graphics described once, drawn many times
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Graphics described as data (what to read, how to combine it and how to
+   draw it), once by each component, instead of as arguments for
+   "rrdtool.graph()" built over again for every device and interval. The
+   arguments are compiled once per interval, and only the parts that
+   change (eg. the data file) are filled in for each graphic."""
+
+
+from components.common import *
+
+
+#
+# The values summarized below a graphic for each of its series, and how they're labeled.
+#
+SUMMARIES = (("LAST", "now"), ("MAX", "max"), ("AVERAGE", "avg"))
+
+
+class GraphSpec(object):
+    """A graphic, for any interval and possibly for many devices. The data
+       files and the prefixes for the data source names are given as
+       fields (by default, "database" and "prefix"), and so can be the
+       title and comments, as "%(field)s" placeholders (with any other
+       "%" written as "%%")."""
+    def __init__(self, title, label, base=1000, lower=0, upper=None, exponent=None):
+        self.title = title
+        self.label = label
+        self.base = base
+        self.lower = lower
+        self.upper = upper
+        self.exponent = exponent
+
+        # What the graphic shows, in order, as tuples starting with the
+        # kind of element (as in "rrdtool.graph()"):
+        #
+        #   ("DEF", name, data source, function, database field, prefix field)
+        #   ("CDEF", name, expression)
+        #   ("AREA", name, color, legend), ("STACK", name, color, legend)
+        #   ("LINE", name, color, legend, width)
+        #   ("TICK", name, color, legend, fraction)
+        #   ("SUMMARY", name, format, newline)
+        #   ("GPRINT", name, function, text)
+        #   ("COMMENT", text)
+        #
+        self.elements = []
+
+        # The arguments, once compiled, and the indexes of those with fields.
+        self.template = None
+        self.variable = None
+
+    def define(self, name, source, function="AVERAGE", database="database", prefix="prefix"):
+        """Read the data source named "source" (after a prefix) from a data file."""
+        self.elements.append(("DEF", name, source, function, database, prefix))
+
+    def compute(self, name, expression):
+        """Calculate a series from others, in reverse polish notation."""
+        self.elements.append(("CDEF", name, expression))
+
+    def area(self, name, color, legend="", stack=False):
+        """Draw a series as an area, on top of the previous one if "stack" is set."""
+        self.elements.append((stack and "STACK" or "AREA", name, color, legend))
+
+    def line(self, name, color, legend="", width=1):
+        self.elements.append(("LINE", name, color, legend, width))
+
+    def tick(self, name, color, legend="", fraction=1.0):
+        """Mark the points in time where a series isn't zero."""
+        self.elements.append(("TICK", name, color, legend, fraction))
+
+    def summary(self, name, format, newline=True):
+        """Print the last, highest and average values of a series (with "format",
+           eg. "%6.1lf MB"), after the legend of the element just added."""
+        self.elements.append(("SUMMARY", name, format, newline))
+
+    def value(self, name, function, text):
+        """Print a single value of a series, consolidated by "function", in "text"."""
+        self.elements.append(("GPRINT", name, function, text))
+
+    def comment(self, text):
+        self.elements.append(("COMMENT", text))
+
+    def sources(self, **fields):
+        """Return the data read for the graphic, as a list of tuples:
+           (name, data file, data source, function)"""
+        fields.setdefault("prefix", "")
+
+        sources = []
+        for element in self.elements:
+            if element[0] == "DEF":
+                name, source, function, database, prefix = element[1:]
+                sources.append((name, fields[database], fields[prefix] + source, function))
+
+        return sources
+
+    def _compile(self):
+        """Turn the elements into arguments, leaving out the interval."""
+        args = ["--start", None,
+                "--end", "-%d" % properties["refresh"],  # because the last data point is still unknown
+                "--title", self.title,
+                "--lazy",
+                "--base", str(self.base)]
+        variable = [5]
+
+        if self.exponent is not None:
+            args.extend(["--units-exponent", str(self.exponent)])  # disables automatic scaling of units
+
+        args.extend(["--height", str(properties["height"]),
+                     "--width", str(properties["width"]),
+                     "--lower-limit", str(self.lower)])
+
+        if self.upper is not None:
+            args.extend(["--upper-limit", str(self.upper)])
+
+        args.extend(["--imgformat", "PNG",
+                     "--vertical-label", self.label,
+                     "--color", "BACK%s" % properties["background"],
+                     "--color", "SHADEA%s" % properties["border"],
+                     "--color", "SHADEB%s" % properties["border"]])
+
+        for element in self.elements:
+            kind = element[0]
+
+            if kind == "DEF":
+                name, source, function, database, prefix = element[1:]
+                variable.append(len(args))
+                args.append("DEF:%s=%%(%s)s:%%(%s)s%s:%s" % (name, database, prefix, source, function))
+            elif kind == "CDEF":
+                args.append("CDEF:%s=%s" % element[1:])
+            elif kind in ("AREA", "STACK"):
+                name, color, legend = element[1:]
+                args.append("%s:%s%s%s" % (kind, name, color, legend and ":" + legend))
+            elif kind == "LINE":
+                name, color, legend, width = element[1:]
+                args.append("LINE%d:%s%s%s" % (width, name, color, legend and ":" + legend))
+            elif kind == "TICK":
+                name, color, legend, fraction = element[1:]
+                args.append("TICK:%s%s:%s%s" % (name, color, fraction, legend and ":" + legend))
+            elif kind == "SUMMARY":
+                name, format, newline = element[1:]
+                for function, label in SUMMARIES:
+                    args.append("GPRINT:%s:%s:%s%s (%s)" % (name, function, function == "LAST" and "\\: " or "", format, label))
+
+                if newline:
+                    args[-1] += "\\n"
+            elif kind == "GPRINT":
+                args.append("GPRINT:%s:%s:%s" % element[1:])
+            elif kind == "COMMENT":
+                variable.append(len(args))
+                args.append("COMMENT:%s" % element[1])
+
+        self.template = tuple(args)
+        self.variable = variable
+
+    def _fill(self, fields):
+        """Return the arguments with the placeholders filled in, but no interval."""
+        if self.template is None:
+            self._compile()
+
+        fields.setdefault("prefix", "")
+
+        args = list(self.template)
+        for i in self.variable:
+            args[i] = args[i] % fields
+
+        return args
+
+    def args(self, interval, **fields):
+        """Return the arguments for "rrdtool.graph()" for an interval,
+           with the placeholders filled in from "fields"."""
+        args = self._fill(fields)
+        args[1] = "-" + interval
+
+        return args
+
+    def jobs(self, filename, **fields):
+        """Return the graphics for all intervals, to be generated later
+           into "<filename><interval>.png". The placeholders are filled
+           in only once, as they're the same for every interval."""
+        args = self._fill(fields)
+
+        jobs = []
+        for interval in INTERVALS:
+            args[1] = "-" + interval
+            jobs.append(GraphJob(interval, filename + interval + ".png", *args))
+
+        return jobs
+
+
+# EOF - graphspec.py
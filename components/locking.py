@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# locking.py - keep runs from overlapping
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Locks keeping several processes from working on the same data at once."""
+
+
+import os
+import errno
+import fcntl
+
+from time import sleep
+
+from components.common import *
+
+
+class RunLock(object):
+    """Held while collecting data or generating the graphics and pages.
+
+       The lock is a file in the data directory, holding the process ID of
+       its owner. The operating system releases it if the owner dies, so
+       there are never any stale locks to remove."""
+    def __init__(self, role):
+        self.filename = "%s/%s.lock" % (properties["data"], role)
+        self.f = None
+
+    def acquire(self, timeout=0):
+        """Try to get the lock, waiting up to "timeout" seconds for
+           some other process to release it. Return True on success."""
+        # Opening for appending keeps the contents (ie. the owner) intact.
+        self.f = open(self.filename, "a+")
+
+        deadline = monotonic() + timeout
+
+        while True:
+            try:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except IOError, e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+
+            if monotonic() >= deadline:
+                self.f.close()
+                self.f = None
+                return False
+
+            sleep(1)
+
+        self.f.truncate(0)
+        self.f.write("%d\n" % os.getpid())
+        self.f.flush()
+
+        return True
+
+    def owner(self):
+        """Return the process ID of the current owner, if any."""
+        try:
+            f = open(self.filename, "r")
+            try:
+                return int(f.readline())
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+
+    def release(self):
+        if self.f is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+            self.f.close()
+            self.f = None
+
+
+# EOF - locking.py
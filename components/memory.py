@@ -24,11 +24,10 @@
 
 
 import os
-import rrdtool
-import re
 
 from components.common import *
-from templates.memory.index import index as MemoryPage
+from components import storage
+from components.graphspec import GraphSpec
 
 
 #
@@ -37,6 +36,32 @@ from templates.memory.index import index as MemoryPage
 DATA_SOURCE = "/proc/meminfo"
 
 
+def _usage_graph():
+    spec = GraphSpec("memory and swap usage (bytes)", "bytes", base=1024)
+
+    for name in ("memused", "buffers", "cached", "swapused"):
+        spec.define(name, name)
+
+    for name in ("memused", "buffers", "cached", "swapused"):
+        spec.compute(name + "_mb", name + ",1024,1024,*,/")
+
+    spec.area("memused", "#a0df05", "Memory ")
+    spec.summary("memused_mb", "%6.0lf MB")
+    spec.area("buffers", "#dff91f", "Buffers", stack=True)
+    spec.summary("buffers_mb", "%6.0lf MB")
+    spec.area("cached", "#f3fdab", "Cached ", stack=True)
+    spec.summary("cached_mb", "%6.0lf MB", newline=False)
+    spec.comment("        Memory  =  %(memory).0f MB\\n")
+    spec.line("swapused", "#808080", "Swap   ")
+    spec.summary("swapused_mb", "%6.0lf MB", newline=False)
+    spec.comment("        Swap    =  %(swap).0f MB")
+
+    return spec
+
+
+USAGE_GRAPH = _usage_graph()
+
+
 class MemoryUsage(StatsComponent):
     """Memory Usage Statistics."""
     def __init__(self):
@@ -46,10 +71,12 @@ class MemoryUsage(StatsComponent):
 
         self.name = "memory"
 
-        if not os.path.exists(DATA_SOURCE):
+        if not os.path.exists(source_path(DATA_SOURCE)):
             fail(self.name, "cannot find \"%s\"." % DATA_SOURCE)
             raise StatsException(DATA_SOURCE + " does not exist")
         
+        self.sources = [DATA_SOURCE]
+
         self.title = "Memory"
         self.description = "memory and swap usage"
 
@@ -63,13 +90,13 @@ class MemoryUsage(StatsComponent):
         if not os.path.exists(self.graphs_dir):
             os.makedirs(self.graphs_dir)
 
-        if not os.path.exists(self.database):
+        if not storage.exists(self.database):
             #
             # Remember: all "time" values are expressed in seconds.
             #
             refresh = properties["refresh"]
             heartbeat = refresh * 2
-            rrdtool.create(self.database,
+            storage.create(self.database,
                            "--step", "%d" % refresh,
                            "DS:memused:GAUGE:%d:0:U" % heartbeat,
                            "DS:buffers:GAUGE:%d:0:U" % heartbeat,
@@ -85,31 +112,17 @@ class MemoryUsage(StatsComponent):
            as a tuple: (name, title, description)"""
         return (self.name, self.title, self.description)
 
-    def update(self):
-        """Update the historical data."""
-        f = open(DATA_SOURCE, "r")
+    def _parse(self, snapshot):
+        """Parse the current memory and swap usage, in KBytes."""
+        meminfo = snapshot.parsed(DATA_SOURCE, parse_keyed)
 
         # Everything is in KBytes
-        regexp = re.compile("MemTotal:\s+(\d+)" \
-                            ".+\sMemFree:\s+(\d+)" \
-                            ".+\sBuffers:\s+(\d+)" \
-                            ".+\sCached:\s+(\d+)" \
-                            ".+\sSwapTotal:\s+(\d+)" \
-                            ".+\sSwapFree:\s+(\d+)")
-
-        lines = [line.strip() for line in f]
-        text = " ".join(lines)
-
-        f.close()        
-
-        match = regexp.search(text)
-        if not match:
+        try:
+            memtotal, memfree, buffers, cached, swaptotal, swapfree = \
+                [int(meminfo[key][0]) for key in ("MemTotal", "MemFree", "Buffers",
+                                                  "Cached", "SwapTotal", "SwapFree")]
+        except (KeyError, IndexError, ValueError):
             raise StatsError("cannot parse " + DATA_SOURCE)
-
-        memtotal, memfree, buffers, cached, swaptotal, swapfree = match.groups()
-        
-        memtotal, memfree, buffers, cached = int(memtotal), int(memfree), int(buffers), int(cached)
-        swaptotal, swapfree = int(swaptotal), int(swapfree)
         
         memused = memtotal - (memfree + buffers + cached)
         swapused = swaptotal - swapfree
@@ -117,62 +130,32 @@ class MemoryUsage(StatsComponent):
         self.memory = memtotal
         self.swap = swaptotal
 
-        rrdtool.update(self.database,
-                       "--template", "memused:buffers:cached:swapused",
-                       "N:%d:%d:%d:%d" % (memused * 1024, buffers * 1024, cached * 1024, swapused * 1024))
+        return (memused, buffers, cached, swapused)
+
+    def load(self):
+        """Read the total memory and swap, for the graphics' legend."""
+        self._parse(Snapshot(self.sources))
+
+    def update(self, snapshot):
+        """Update the historical data."""
+        memused, buffers, cached, swapused = self._parse(snapshot)
+
+        storage.update(self.database,
+                       "memused:buffers:cached:swapused",
+                       "%d:%d:%d:%d" % (memused * 1024, buffers * 1024, cached * 1024, swapused * 1024),
+                       snapshot.time)
                        
-    def make_graphs(self):
-        """Generate the daily, weekly and monthly graphics."""
-        height = str(properties["height"])
-        width = str(properties["width"])
-        refresh = properties["refresh"]
-        background = properties["background"]
-        border = properties["border"]
-
-        for interval in ("1day", "1week", "1month", "1year"):
-            rrdtool.graph("%s/graph-%s.png" % (self.graphs_dir, interval), 
-                          "--start", "-%s" % interval,
-                          "--end", "-%d" % refresh,  # because the last data point is still *unknown*
-                          "--title", "memory and swap usage (bytes)",
-                          "--lazy",
-                          "--base", "1024",
-                          "--height", height,
-                          "--width", width,
-                          "--lower-limit", "0",
-                          "--imgformat", "PNG",
-                          "--vertical-label", "bytes",
-                          "--color", "BACK%s" % background,
-                          "--color", "SHADEA%s" % border,
-                          "--color", "SHADEB%s" % border,
-                          "DEF:memused=%s:memused:AVERAGE" % self.database,
-                          "DEF:buffers=%s:buffers:AVERAGE" % self.database,
-                          "DEF:cached=%s:cached:AVERAGE" % self.database,
-                          "DEF:swapused=%s:swapused:AVERAGE" % self.database,
-                          "CDEF:memused_mb=memused,1024,1024,*,/",
-                          "CDEF:buffers_mb=buffers,1024,1024,*,/",
-                          "CDEF:cached_mb=cached,1024,1024,*,/",
-                          "CDEF:swapused_mb=swapused,1024,1024,*,/",
-                          "AREA:memused#a0df05:Memory ",
-                          "GPRINT:memused_mb:LAST:\\: %6.0lf MB (now)",
-                          "GPRINT:memused_mb:MAX:%6.0lf MB (max)",
-                          "GPRINT:memused_mb:AVERAGE:%6.0lf MB (avg)\\n",
-                          "STACK:buffers#dff91f:Buffers",
-                          "GPRINT:buffers_mb:LAST:\\: %6.0lf MB (now)",
-                          "GPRINT:buffers_mb:MAX:%6.0lf MB (max)",
-                          "GPRINT:buffers_mb:AVERAGE:%6.0lf MB (avg)\\n",
-                          "STACK:cached#f3fdab:Cached ",
-                          "GPRINT:cached_mb:LAST:\\: %6.0lf MB (now)",
-                          "GPRINT:cached_mb:MAX:%6.0lf MB (max)",
-                          "GPRINT:cached_mb:AVERAGE:%6.0lf MB (avg)",
-                          "COMMENT:        Memory  =  %.0f MB\\n" % (float(self.memory) / 1024),
-                          "LINE1:swapused#808080:Swap   ",
-                          "GPRINT:swapused_mb:LAST:\\: %6.0lf MB (now)",
-                          "GPRINT:swapused_mb:MAX:%6.0lf MB (max)",
-                          "GPRINT:swapused_mb:AVERAGE:%6.0lf MB (avg)",
-                          "COMMENT:        Swap    =  %.0f MB" % (float(self.swap) / 1024))
+    def graphs(self):
+        """Return the daily, weekly, monthly and yearly graphics."""
+        return USAGE_GRAPH.jobs(self.graphs_dir + "/graph-",
+                                database=self.database,
+                                memory=float(self.memory) / 1024,
+                                swap=float(self.swap) / 1024)
 
     def make_html(self):
         """Generate the HTML pages."""
+        from templates.memory.index import index as MemoryPage
+
         template = MemoryPage()
         template_fill(template, self.description)
         template_write(template, self.graphs_dir + "/index.html")
@@ -24,13 +24,10 @@
 
 
 import os
-import rrdtool
 
 from components.common import *
-
-from templates.processes.index import index as OverviewPage
-from templates.processes.load import load as LoadAveragePage
-from templates.processes.forks import forks as ForkRatePage
+from components import storage
+from components.graphspec import GraphSpec
 
 
 #
@@ -39,15 +36,41 @@ from templates.processes.forks import forks as ForkRatePage
 DATA_SOURCE = "/proc/loadavg"
 
 
+def _load_graph():
+    spec = GraphSpec("running processes (load average)", "processes", upper=0.5, exponent=0)
+
+    spec.define("avg_5min", "avg_5min")
+    spec.area("avg_5min", "#a0df05", "5 min average")
+    spec.summary("avg_5min", "%6.2lf proc", newline=False)
+
+    return spec
+
+
+def _forks_graph():
+    spec = GraphSpec("process spawning (forks/sec)", "forks/sec", upper=0.5, exponent=0)
+
+    spec.define("proc", "proc")
+    spec.area("proc", "#a0df05", "processes")
+    spec.summary("proc", "%6.2lf forks/sec", newline=False)
+
+    return spec
+
+
+LOAD_GRAPH = _load_graph()
+FORKS_GRAPH = _forks_graph()
+
+
 class Processes(StatsComponent):
     """Statistics for Process Creation and System Load Averages."""
     def __init__(self):
         self.name = "processes"
 
-        if not os.path.exists(DATA_SOURCE):
+        if not os.path.exists(source_path(DATA_SOURCE)):
             fail(self.name, "cannot find \"%s\"." % DATA_SOURCE)
             raise StatsException(DATA_SOURCE + " does not exist")
         
+        self.sources = [DATA_SOURCE]
+
         self.title = "Processes"
         self.description = "system load average and process spawning rates"
 
@@ -63,13 +86,13 @@ class Processes(StatsComponent):
             os.mkdir(self.graphs_dir + "/load")
             os.mkdir(self.graphs_dir + "/forks")
 
-        if not os.path.exists(self.database):
+        if not storage.exists(self.database):
             #
             # Remember: all "time" values are expressed in seconds.
             #
             refresh = properties["refresh"]
             heartbeat = refresh * 2
-            rrdtool.create(self.database,
+            storage.create(self.database,
                            "--step", "%d" % refresh,
                            "DS:avg_1min:GAUGE:%d:0:U" % heartbeat,
                            "DS:avg_5min:GAUGE:%d:0:U" % heartbeat,
@@ -85,72 +108,31 @@ class Processes(StatsComponent):
            as a tuple: (name, title, description)"""
         return (self.name, self.title, self.description)
 
-    def update(self):
+    def update(self, snapshot):
         """Update the historical data."""
-        f = open(DATA_SOURCE, "r")
-        data = f.readline().split()
-        f.close()
+        data = snapshot.parsed(DATA_SOURCE, parse_fields)
 
-        rrdtool.update(self.database,
-                       "--template", "avg_1min:avg_5min:avg_15min:proc",
-                       "N:%s:%s:%s:%s" % (data[0], data[1], data[2], data[4]))
+        storage.update(self.database,
+                       "avg_1min:avg_5min:avg_15min:proc",
+                       "%s:%s:%s:%s" % (data[0], data[1], data[2], data[4]),
+                       snapshot.time)
 
                        
-    def make_graphs(self):
-        """Generate the daily, weekly and monthly graphics."""
-        height = str(properties["height"])
-        width = str(properties["width"])
-        refresh = properties["refresh"]
-        background = properties["background"]
-        border = properties["border"]
-
-        for interval in ("1day", "1week", "1month", "1year"):
-            rrdtool.graph("%s/load/graph-%s.png" % (self.graphs_dir, interval), 
-                          "--start", "-%s" % interval,
-                          "--end", "-%d" % refresh,  # because the last data point is still *unknown*
-                          "--title", "running processes (load average)",
-                          "--lazy",
-                          "--base", "1000",
-                          "--units-exponent", "0",  # disable automatic scaling of units
-                          "--height", height,
-                          "--width", width,
-                          "--lower-limit", "0",
-                          "--upper-limit", "0.5",
-                          "--imgformat", "PNG",
-                          "--vertical-label", "processes",
-                          "--color", "BACK%s" % background,
-                          "--color", "SHADEA%s" % border,
-                          "--color", "SHADEB%s" % border,
-                          "DEF:avg_5min=%s:avg_5min:AVERAGE" % self.database,
-                          "AREA:avg_5min#a0df05:5 min average",
-                          "GPRINT:avg_5min:LAST:\\: %6.2lf proc (now)",
-                          "GPRINT:avg_5min:MAX:%6.2lf proc (max)",
-                          "GPRINT:avg_5min:AVERAGE:%6.2lf proc (avg)")
-
-            rrdtool.graph("%s/forks/graph-%s.png" % (self.graphs_dir, interval), 
-                          "--start", "-%s" % interval,
-                          "--end", "-%d" % refresh,  # because the last data point is still *unknown*
-                          "--title", "process spawning (forks/sec)",
-                          "--lazy",
-                          "--base", "1000",
-                          "--units-exponent", "0",  # disable automatic scaling of units
-                          "--height", height,
-                          "--width", width,
-                          "--lower-limit", "0",
-                          "--upper-limit", "0.5",
-                          "--imgformat", "PNG",
-                          "--vertical-label", "forks/sec",
-                          "--color", "BACK%s" % background,
-                          "--color", "SHADEA%s" % background,
-                          "--color", "SHADEB%s" % background,
-                          "DEF:proc=%s:proc:AVERAGE" % self.database,
-                          "AREA:proc#a0df05:processes",
-                          "GPRINT:proc:LAST:\\: %6.2lf forks/sec (now)",
-                          "GPRINT:proc:MAX:%6.2lf forks/sec (max)",
-                          "GPRINT:proc:AVERAGE:%6.2lf forks/sec (avg)")
+    def graphs(self):
+        """Return the daily, weekly, monthly and yearly graphics."""
+        jobs = []
+
+        jobs.extend(LOAD_GRAPH.jobs(self.graphs_dir + "/load/graph-", database=self.database))
+        jobs.extend(FORKS_GRAPH.jobs(self.graphs_dir + "/forks/graph-", database=self.database))
+
+        return jobs
 
     def make_html(self):
         """Generate the HTML pages."""
+        from templates.processes.index import index as OverviewPage
+        from templates.processes.load import load as LoadAveragePage
+        from templates.processes.forks import forks as ForkRatePage
+
         template = OverviewPage()
         template_fill(template, self.description)
         template_write(template, self.graphs_dir + "/index.html")
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# profiling.py - profiling of a single run
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Profiling of each component's phases, and tracing of all calls into the storage
+   backend (ie. rrdtool, unless the "array" storage is in use)."""
+
+
+import os
+
+from time import time
+
+from components.common import *
+from components import storage
+
+
+#
+# The file (in the profiling directory) where all calls into the storage
+# backend are traced. Each line is a JSON object describing a single call.
+#
+TRACE_FILE = "rrdtool.jsonl"
+
+#
+# The calls into the storage backend that are traced.
+#
+TRACED_CALLS = ("create", "update", "graph")
+
+
+class Profiler(object):
+    """Profiles the phases of each component, and traces the calls into the storage backend."""
+    def __init__(self, directory):
+        # Both only exist since Python 2.5 and 2.6, respectively.
+        try:
+            import cProfile
+            import json
+        except ImportError:
+            raise StatsError("profiling requires Python 2.6 or newer")
+
+        self.cProfile = cProfile
+        self.json = json
+
+        self.directory = directory
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        self.trace = open(self.directory + "/" + TRACE_FILE, "w")
+
+        # The component and phase currently running, for the trace.
+        self.component = None
+        self.phase = None
+
+        # Every component calls into the storage backend through the same
+        # object, so replacing its methods is enough to trace all calls.
+        self.backend = storage.backend()
+        for call in TRACED_CALLS:
+            setattr(self.backend, call, self._traced(call, getattr(self.backend, call)))
+
+    def _traced(self, call, function):
+        def traced(*args):
+            start = time()
+            error = None
+
+            try:
+                try:
+                    return function(*args)
+                except storage.error, e:
+                    error = str(e)
+                    raise
+            finally:
+                self.trace.write(self.json.dumps({ "call"      : call,
+                                                   "component" : self.component,
+                                                   "phase"     : self.phase,
+                                                   "args"      : [str(arg) for arg in args],
+                                                   "start"     : start,
+                                                   "duration"  : time() - start,
+                                                   "error"     : error }) + "\n")
+
+        return traced
+
+    def run(self, component, phase, function, *args):
+        """Call "function" under the profiler, saving the statistics
+           into a file named after the component and phase."""
+        profile = self.cProfile.Profile()
+
+        self.component = component
+        self.phase = phase
+
+        try:
+            return profile.runcall(function, *args)
+        finally:
+            self.component = None
+            self.phase = None
+
+            profile.dump_stats("%s/%s-%s.pstats" % (self.directory, component, phase))
+
+    def close(self):
+        for call in TRACED_CALLS:
+            delattr(self.backend, call)
+
+        self.trace.close()
+
+
+profiler = None
+
+
+def start(directory):
+    """Start profiling, saving everything into "directory"."""
+    global profiler
+    profiler = Profiler(directory)
+
+
+def stop():
+    global profiler
+
+    if profiler is not None:
+        profiler.close()
+        profiler = None
+
+
+def profiled(component, phase, function, *args):
+    """Call "function" for some phase of a component, under the profiler
+       if profiling has been started."""
+    if profiler is None:
+        return function(*args)
+
+    return profiler.run(component, phase, function, *args)
+
+
+# EOF - profiling.py
@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# quicklook.py - Statistics for Quick Look itself
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Statistics for the time and resources used by Quick Look itself."""
+
+
+import os
+import sys
+import resource
+
+from time import time, localtime, strftime
+
+from components.common import *
+from components import storage
+from components import profiling
+from components.graphspec import GraphSpec
+
+
+#
+# Each run either collects data or generates the graphics and pages (or
+# does both, one after the other). These may happen in separate processes,
+# so the measurements for each are kept in separate files.
+#
+# For every component, we measure these phases (as named by the data
+# sources), depending on what the run does.
+#
+PHASES = { "collect" : ("update",),
+           "render"  : ("graphs", "html") }
+
+ROLES = ("collect", "render")
+
+#
+# The file where we keep the most recent occurrence of each event worth
+# showing in the HTML pages (eg. runs skipped or taking too long).
+#
+# Each line refers to a single kind of event, with the following format:
+#
+#   "event time message"
+#
+EVENTS_FILE = "events"
+
+
+def _runs_graph():
+    spec = GraphSpec("time spent per run (seconds)", "seconds")
+
+    for name, source in (("collect", "wall"), ("render", "wall"), ("collect_cpu", "cpu"), ("render_cpu", "cpu"),
+                         ("collect_overrun", "overrun"), ("render_overrun", "overrun")):
+        spec.define(name, source, database=name.split("_")[0])
+
+    spec.compute("cpu", "collect_cpu,UN,0,collect_cpu,IF,render_cpu,UN,0,render_cpu,IF,+")
+    spec.define("collect_skipped", "skipped", database="collect")
+    spec.define("render_skipped", "skipped", database="render")
+    spec.compute("overrun", "collect_overrun,UN,0,collect_overrun,IF,render_overrun,UN,0,render_overrun,IF,MAX")
+    spec.compute("skipped", "collect_skipped,UN,0,collect_skipped,IF,render_skipped,UN,0,render_skipped,IF,MAX")
+
+    spec.area("collect", "#a0df05", "Collecting")
+    spec.summary("collect", "%6.2lf s")
+    spec.area("render", "#dff91f", "Rendering ", stack=True)
+    spec.summary("render", "%6.2lf s")
+    spec.line("cpu", "#808080", "CPU time  ")
+    spec.summary("cpu", "%6.2lf s")
+    spec.tick("overrun", "#dc3c14", "Overrun")
+    spec.comment("(longer than the %(refresh)d seconds between runs)\\n")
+    spec.tick("skipped", "#ffe100", "Skipped (partly or completely)")
+
+    return spec
+
+
+def _memory_graph():
+    spec = GraphSpec("peak memory usage (bytes)", "bytes", base=1024)
+    spec.define("collect", "rss", database="collect")
+    spec.define("render", "rss", database="render")
+    spec.compute("collect_mb", "collect,1024,1024,*,/")
+    spec.compute("render_mb", "render,1024,1024,*,/")
+    spec.line("collect", "#a0df05", "Collecting", width=2)
+    spec.summary("collect_mb", "%6.1lf MB")
+    spec.line("render", "#dc3c14", "Rendering ", width=2)
+    spec.summary("render_mb", "%6.1lf MB", newline=False)
+
+    return spec
+
+
+def _calls_graph():
+    spec = GraphSpec("calls into rrdtool per run", "calls")
+    spec.define("collect", "calls", database="collect")
+    spec.define("render", "calls", database="render")
+    spec.line("collect", "#a0df05", "Collecting", width=2)
+    spec.summary("collect", "%6.0lf")
+    spec.line("render", "#dc3c14", "Rendering ", width=2)
+    spec.summary("render", "%6.0lf", newline=False)
+
+    return spec
+
+
+def _component_graph():
+    spec = GraphSpec("time spent on \"%(name)s\" per run (seconds)", "seconds")
+    spec.define("update", "update_wall", database="collect")
+    spec.define("graphs", "graphs_wall", database="render")
+    spec.define("html", "html_wall", database="render")
+    spec.define("update_cpu", "update_cpu", database="collect")
+    spec.define("graphs_cpu", "graphs_cpu", database="render")
+    spec.define("html_cpu", "html_cpu", database="render")
+    spec.define("collect_calls", "calls", database="collect")
+    spec.define("render_calls", "calls", database="render")
+    spec.compute("cpu", "update_cpu,UN,0,update_cpu,IF,graphs_cpu,UN,0,graphs_cpu,IF,+,html_cpu,UN,0,html_cpu,IF,+")
+    spec.compute("calls", "collect_calls,UN,0,collect_calls,IF,render_calls,UN,0,render_calls,IF,+")
+
+    spec.area("update", "#a0df05", "Data    ")
+    spec.summary("update", "%6.2lf s")
+    spec.area("graphs", "#dff91f", "Graphics", stack=True)
+    spec.summary("graphs", "%6.2lf s")
+    spec.area("html", "#f3fdab", "Pages   ", stack=True)
+    spec.summary("html", "%6.2lf s")
+    spec.line("cpu", "#808080", "CPU time")
+    spec.summary("cpu", "%6.2lf s")
+    spec.value("calls", "AVERAGE", "rrdtool calls per run\\: %.1lf (avg)")
+
+    return spec
+
+
+RUNS_GRAPH = _runs_graph()
+MEMORY_GRAPH = _memory_graph()
+CALLS_GRAPH = _calls_graph()
+COMPONENT_GRAPH = _component_graph()
+
+
+class SelfMonitor(StatsComponent):
+    """Quick Look's Own Statistics."""
+    def __init__(self):
+        self.name = "quicklook"
+        self.title = "Quick Look"
+        self.description = "time and resources spent collecting data and generating the pages"
+
+        self.data_dir = properties["data"] + "/" + self.name
+        self.graphs_dir = properties["output"] + "/" + self.name
+
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+        if not os.path.exists(self.graphs_dir):
+            os.makedirs(self.graphs_dir)
+
+        for role in ROLES:
+            database = "%s/%s.rrd" % (self.data_dir, role)
+            if not storage.exists(database):
+                self._create(database, ["wall", "cpu", "rss", "calls", "overrun", "skipped"])
+
+        # When the current run of each kind started, and its measurements as
+        # a dictionary of dictionaries: component -> phase -> (wall, cpu, calls)
+        self.started = {}
+        self.measurements = {}
+
+    def info(self):
+        """Return some information about the component,
+           as a tuple: (name, title, description)"""
+        return (self.name, self.title, self.description)
+
+    def _create(self, database, names):
+        #
+        # Remember: all "time" values are expressed in seconds.
+        #
+        # Generating the pages may happen less often than collecting data.
+        #
+        refresh = properties["refresh"]
+        heartbeat = max(refresh, properties["redraw"]) * 2
+
+        args = ["--step", "%d" % refresh]
+        for name in names:
+            args.append("DS:%s:GAUGE:%d:0:U" % (name, heartbeat))
+
+        args.extend(["RRA:AVERAGE:0.5:1:%d" % (86400 / refresh),     # 1 day of 'refresh' averages
+                     "RRA:AVERAGE:0.5:%d:672" % (900 / refresh),     # 7 days of 1/4 hour averages
+                     "RRA:AVERAGE:0.5:%d:744" % (3600 / refresh),    # 31 days of 1 hour averages
+                     "RRA:AVERAGE:0.5:%d:730" % (43200 / refresh)])  # 365 days of 1/2 day averages
+
+        storage.create(database, *args)
+
+    def _component_database(self, name, role):
+        return "%s/%s-%s.rrd" % (self.data_dir, name, role)
+
+    def _create_component(self, name):
+        """Create the data files for a component, for both kinds of run."""
+        for role in ROLES:
+            names = []
+            for phase in PHASES[role]:
+                names.extend(["%s_wall" % phase, "%s_cpu" % phase])
+
+            self._create(self._component_database(name, role), names + ["calls"])
+
+    def _monitored(self):
+        """Return the names of all components measured so far."""
+        suffix = "-collect.rrd"
+        names = [filename[:-len(suffix)] for filename in storage.databases(self.data_dir) if filename.endswith(suffix)]
+        names.sort()
+
+        return names
+
+    def start(self, role):
+        """Start measuring a run, either "collect" or "render"."""
+        self.started[role] = (monotonic(), _process_time(), storage.rrdtool_calls.count)
+        self.measurements[role] = {}
+
+    def measure(self, role, component, phase, function, *args):
+        """Call "function" (a method of the component) for
+           a component, measuring how long it takes."""
+        start = monotonic()
+        start_cpu = cpu_time()
+        start_calls = storage.rrdtool_calls.count
+
+        result = profiling.profiled(component.info()[0], function.__name__, function, *args)
+
+        self.record(role, component, phase, monotonic() - start, cpu_time() - start_cpu,
+                    storage.rrdtool_calls.count - start_calls)
+
+        return result
+
+    def record(self, role, component, phase, wall, cpu, calls):
+        """Record the time spent by a component in some phase of a run."""
+        name = component.info()[0]
+        if name == self.name:
+            return
+
+        self.measurements[role].setdefault(name, {})[phase] = (wall, cpu, calls)
+
+    def limits(self, role):
+        """Return when a run started (as returned by monotonic()) and how
+           long it may take (in seconds) before overlapping the next one."""
+        if role == "render" and properties["collect"] and not properties["daemon"]:
+            # Both happen in the same run, which must fit into the refresh interval.
+            return (self.started["collect"][0], properties["refresh"])
+
+        if role == "render":
+            return (self.started[role][0], properties["redraw"])
+
+        return (self.started[role][0], properties["refresh"])
+
+    def _note(self, event, message):
+        """Remember the most recent occurrence of an event, for the HTML pages."""
+        events = self._read_events()
+        events[event] = (int(time()), message)
+
+        f = open(self.data_dir + "/" + EVENTS_FILE + ".tmp", "w")
+        for name, (timestamp, text) in events.items():
+            f.write("%s %d %s\n" % (name, timestamp, text))
+        f.close()
+
+        os.rename(self.data_dir + "/" + EVENTS_FILE + ".tmp", self.data_dir + "/" + EVENTS_FILE)
+
+    def _read_events(self):
+        events = {}
+
+        filename = self.data_dir + "/" + EVENTS_FILE
+        if not os.path.exists(filename):
+            return events
+
+        f = open(filename, "r")
+
+        for line in f:
+            values = line.rstrip("\n").split(None, 2)
+            if len(values) != 3:
+                continue
+
+            try:
+                events[values[0]] = (int(values[1]), values[2])
+            except ValueError:
+                continue
+
+        f.close()
+
+        return events
+
+    def skip(self, role, reason):
+        """Record a run that was skipped."""
+        if role == "collect":
+            message = "Data collection was skipped: %s." % reason
+        else:
+            message = "Generating the graphs and pages was skipped: %s." % reason
+
+        sys.stderr.write("Warning: %s\n" % message)
+
+        self._note(role + "-skipped", message)
+        self.measurements.pop(role, None)
+
+        # Nothing was measured, so only the skip is stored.
+        try:
+            storage.update("%s/%s.rrd" % (self.data_dir, role), "skipped", "1")
+        except storage.error, e:
+            sys.stderr.write("Cannot store the measurements for the last run: %s\n" % e)
+
+    def finish(self, role, timestamp=None, skipped=0):
+        """Store the measurements for a run, where "skipped"
+           graphics were left for the next one."""
+        now = monotonic()
+        start, start_cpu, start_calls = self.started[role]
+
+        wall = now - start
+        cpu = _process_time() - start_cpu
+        calls = storage.rrdtool_calls.count - start_calls
+
+        # The peak is for the whole life of the process (and its children).
+        rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+
+        run_start, limit = self.limits(role)
+        overrun = now - run_start > limit
+
+        if overrun:
+            message = "The last run took %.1f seconds, longer than the %d seconds between runs." % (now - run_start, limit)
+            sys.stderr.write("Warning: %s\n" % message)
+            self._note(role + "-overrun", message)
+
+        # Not a warning, graphs being left for later is how the budget works.
+        if skipped:
+            self._note(role + "-budget", "%d graph(s) were left for the next run, to keep within the time budget." % skipped)
+
+        if timestamp is None:
+            timestamp = int(time())
+
+        try:
+            for name, phases in self.measurements.pop(role).items():
+                if not storage.exists(self._component_database(name, role)):
+                    self._create_component(name)
+
+                template = []
+                values = []
+                component_calls = 0
+                for phase in PHASES[role]:
+                    phase_wall, phase_cpu, phase_calls = phases.get(phase, (0.0, 0.0, 0))
+                    template.extend(["%s_wall" % phase, "%s_cpu" % phase])
+                    values.extend(["%.3f" % phase_wall, "%.3f" % phase_cpu])
+                    component_calls += phase_calls
+
+                storage.update(self._component_database(name, role),
+                               ":".join(template + ["calls"]),
+                               ":".join(values + ["%d" % component_calls]),
+                               timestamp)
+
+            storage.update("%s/%s.rrd" % (self.data_dir, role),
+                           "wall:cpu:rss:calls:overrun:skipped",
+                           "%.3f:%.3f:%d:%d:%d:%d" % (wall, cpu, rss, calls, overrun, skipped > 0),
+                           timestamp)
+        except storage.error, e:
+            # Two runs within the same second, most likely.
+            sys.stderr.write("Cannot store the measurements for the last run: %s\n" % e)
+
+    def update(self, snapshot):
+        """Nothing to collect, measurements are stored at the end of each run."""
+        pass
+
+    def graphs(self):
+        """Return the daily, weekly, monthly and yearly graphics."""
+        jobs = []
+
+        collect_db = self.data_dir + "/collect.rrd"
+        render_db = self.data_dir + "/render.rrd"
+
+        jobs.extend(RUNS_GRAPH.jobs(self.graphs_dir + "/graph-runs-",
+                                    collect=collect_db, render=render_db, refresh=properties["refresh"]))
+        jobs.extend(MEMORY_GRAPH.jobs(self.graphs_dir + "/graph-memory-", collect=collect_db, render=render_db))
+        jobs.extend(CALLS_GRAPH.jobs(self.graphs_dir + "/graph-calls-", collect=collect_db, render=render_db))
+
+        for name in self._monitored():
+            jobs.extend(COMPONENT_GRAPH.jobs("%s/graph-time-%s-" % (self.graphs_dir, name),
+                                             collect=self._component_database(name, "collect"),
+                                             render=self._component_database(name, "render"),
+                                             name=name))
+
+        return jobs
+
+    def make_html(self):
+        """Generate the HTML pages."""
+        from templates.quicklook.index import index as OverviewPage
+        from templates.quicklook.detailed import detailed as DetailsPage
+
+        events = []
+        for timestamp, message in self._read_events().values():
+            events.append((timestamp, strftime("%B %d, %Y - %H:%M:%S", localtime(timestamp)), message))
+        events.sort()
+
+        components = self._monitored()
+
+        template = OverviewPage()
+        template.components = components
+        template.events = [(when, message) for timestamp, when, message in events]
+
+        template_fill(template, self.description)
+        template_write(template, self.graphs_dir + "/index.html")
+
+        for kind in ["runs", "memory", "calls"] + ["time-" + name for name in components]:
+            template = DetailsPage()
+            template.kind = kind
+
+            template_fill(template, self.description)
+            template_write(template, "%s/%s.html" % (self.graphs_dir, kind))
+
+
+def _process_time():
+    """Return the CPU time used by this process and its (finished) children, in seconds."""
+    user, system, children_user, children_system = os.times()[:4]
+    return user + system + children_user + children_system
+
+
+# EOF - quicklook.py
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# render.py - graphics generation, possibly spread over several processes
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Generation of the graphics for all components, as a single batch of jobs."""
+
+
+import os
+import sys
+import signal
+
+from time import time
+
+from components.common import *
+from components import storage
+
+
+#
+# The "multiprocessing" module only exists since Python 2.6,
+# without it all graphics are generated by the main process.
+#
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+
+#
+# The file where we keep track of when each graphic was last generated.
+#
+# Each line refers to a single graphic, with the following format:
+#
+#   "step time filename"
+#
+# The "step" is how often (in seconds) new data is available for the
+# graphic, and "time" is when it was last generated (since the epoch).
+#
+MANIFEST = "render.manifest"
+
+
+class Manifest(object):
+    """Keeps track of when each graphic was last generated."""
+    def __init__(self):
+        self.filename = properties["data"] + "/" + MANIFEST
+        self.graphs = {}
+
+        if not os.path.exists(self.filename):
+            return
+
+        f = open(self.filename, "r")
+
+        for line in f:
+            values = line.split(None, 2)
+            if len(values) != 3:
+                continue
+
+            try:
+                self.graphs[values[2].rstrip("\n")] = (int(values[0]), float(values[1]))
+            except ValueError:
+                continue  # a damaged entry only means generating that graphic again.
+
+        f.close()
+
+    def is_outdated(self, job, now):
+        """Check if new data has been consolidated into the
+           archive feeding a graphic since it was generated."""
+        if job.filename not in self.graphs:
+            return True
+
+        for filename in job.outputs():
+            if not os.path.exists(filename):
+                return True
+
+        step, last = self.graphs[job.filename]
+        if step != job.step():
+            return True
+
+        # The last data point is only shown one step after being consolidated.
+        if job.updated is not None and int(last / step) > int(job.updated / step) + 1:
+            return False
+
+        # Archives consolidate their data points at multiples of "step".
+        return int(now / step) > int(last / step)
+
+    def generated(self, job):
+        """Return when a graphic was last generated (zero if never)."""
+        if job.filename not in self.graphs:
+            return 0
+
+        return self.graphs[job.filename][1]
+
+    def mark(self, job, now):
+        self.graphs[job.filename] = (job.step(), now)
+
+    def save(self):
+        # Write to a temporary file first, so that an interrupted
+        # write doesn't leave behind an incomplete manifest.
+        f = open(self.filename + ".tmp", "w")
+
+        for filename, (step, last) in self.graphs.items():
+            f.write("%d %.0f %s\n" % (step, last, filename))
+
+        f.close()
+        os.rename(self.filename + ".tmp", self.filename)
+
+
+def _init_worker():
+    """Undo the signal handling set up by the daemon mode."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+    # Interrupting is up to the parent process.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_job(task):
+    """Generate a single graphic, unless its deadline (as returned by
+       monotonic()) has already passed. Return a tuple: (generated,
+       error, wall time, CPU time, calls into the storage, latest data
+       points). The error message is None on success (or if skipped),
+       times are in seconds, and the data points are those for the feed,
+       if any (see GraphJob.run())."""
+    job, deadline = task
+
+    start = monotonic()
+    if deadline is not None and start > deadline:
+        return (False, None, 0.0, 0.0, 0, None)
+
+    start_cpu = cpu_time()
+    start_calls = storage.rrdtool_calls.count
+
+    try:
+        points = job.run()
+    except Exception, e:
+        return (False, "%s: %s" % (job, e), monotonic() - start, cpu_time() - start_cpu,
+                storage.rrdtool_calls.count - start_calls, None)
+
+    return (True, None, monotonic() - start, cpu_time() - start_cpu,
+            storage.rrdtool_calls.count - start_calls, points)
+
+
+def _write_feed(name, graphs, now):
+    """Write the latest data points of a component's daily graphics (by
+       their key, see GraphJob.feed()) into its feed, for the pages."""
+    from components import chart
+
+    chart.write_json("%s/%s/%s" % (properties["output"], name, FEED), { "time"   : int(now),
+                                                                       "graphs" : graphs })
+
+
+def render_graphs(components, deadline=None):
+    """Generate the graphics for all components, using
+       as many processes as set by the "jobs" property.
+
+       If a "deadline" is given (as returned by monotonic()), each component
+       gets a time budget to generate its graphics. Those not generated in
+       time are skipped, and are the first generated in the next run.
+
+       Return the time spent on each component, as a dictionary of tuples:
+       (wall time, CPU time, graphics generated, graphics skipped, calls
+       into the storage)"""
+    start = monotonic()
+    now = time()
+
+    manifest = Manifest()
+
+    # The times are added up, so they reflect the work done by the
+    # workers on behalf of each component, not how long it took.
+    times = {}
+
+    pending = []
+    for component in components:
+        name = component.info()[0]
+        times[name] = (0.0, 0.0, 0, 0, 0)
+
+        jobs = []
+        for i, job in enumerate(component.graphs()):
+            if properties["force"] or manifest.is_outdated(job, now):
+                jobs.append((manifest.generated(job), i, job))
+
+        # The graphics generated longest ago go first, so those left out
+        # for lack of time (see "deadline") aren't the same every run.
+        jobs.sort()
+        jobs = [job for generated, i, job in jobs]
+
+        if jobs:
+            pending.append((name, jobs))
+
+    workers = min(properties["jobs"], max([len(jobs) for name, jobs in pending] + [0]))
+
+    # Each process reads each archive only once (workers inherit this).
+    storage.cache_reads(True)
+
+    pool = None
+    if workers > 1 and multiprocessing:
+        pool = multiprocessing.Pool(workers, _init_worker)
+
+    generated = failed = skipped = 0
+
+    try:
+        while pending:
+            name, jobs = pending.pop(0)
+
+            # Components are done one at a time, so that a slow
+            # one can't take time away from the others.
+            job_deadline = None
+            if deadline is not None:
+                # What's left of the time is shared evenly among the remaining components.
+                budget = (deadline - monotonic()) / (len(pending) + 1)
+                if properties["budget"]:
+                    budget = min(budget, properties["budget"])
+
+                job_deadline = monotonic() + budget
+
+            tasks = [(job, job_deadline) for job in jobs]
+
+            if pool:
+                results = pool.map(_run_job, tasks, 1)
+            else:
+                results = [_run_job(task) for task in tasks]
+
+            total_wall, total_cpu, count, left, total_calls = times[name]
+            feed = {}
+
+            for job, (done, error, wall, cpu, calls, points) in zip(jobs, results):
+                total_wall += wall
+                total_cpu += cpu
+                total_calls += calls
+
+                # The calls made by the workers aren't counted in this process.
+                if pool:
+                    storage.rrdtool_calls.add(calls)
+
+                if done:
+                    manifest.mark(job, now)
+                    generated += 1
+                    count += 1
+
+                    if points is not None:
+                        feed[job.feed()[1]] = points
+                elif error:
+                    sys.stderr.write("Cannot generate graphic %s\n" % error)
+                    failed += 1
+                    count += 1
+                else:
+                    skipped += 1
+                    left += 1
+
+            times[name] = (total_wall, total_cpu, count, left, total_calls)
+
+            if feed:
+                _write_feed(name, feed, now)
+
+        if pool:
+            pool.close()
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+        storage.cache_reads(False)
+
+    manifest.save()
+
+    if properties["verbose"]:
+        sys.stderr.write("Generated %d graphic(s) in %.2f seconds, %d failed, %d skipped.\n" \
+                         % (generated, monotonic() - start, failed, skipped))
+
+    return times
+
+
+# EOF - render.py
@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# storage.py - access to the data files
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Access to the data files, with updates optionally buffered to be written in batches.
+   The data files are either rrdtool's own or, with the "array" storage, the
+   memory-mapped arrays of "arraystore.py"."""
+
+
+import os
+import sys
+import shutil
+
+from time import time
+
+from components.common import *
+from components import arraystore
+
+try:
+    import rrdtool
+except ImportError:
+    rrdtool = None  # only the "array" storage is available.
+
+
+#
+# Errors from either kind of data file (as far as they're available).
+#
+error = (arraystore.StoreError,)
+if rrdtool is not None:
+    error = (rrdtool.error,) + error
+
+
+class CallCounter(object):
+    """Counts the calls into the storage backend made by this process."""
+    def __init__(self):
+        self.count = 0
+
+    def add(self, count=1):
+        self.count += count
+
+
+rrdtool_calls = CallCounter()
+
+
+class RRDBackend(object):
+    """Keeps the data files as rrdtool files."""
+    def __init__(self):
+        if rrdtool is None:
+            raise StatsError("the \"rrdtool\" storage requires python-rrd")
+
+        # What was read from each archive while caching (see cache_reads()),
+        # with the time the file was last modified at that point:
+        # { (database, function, resolution) : (modified, data) }
+        self.cache = None
+
+    def path(self, database):
+        return database
+
+    def exists(self, database):
+        return os.path.exists(database)
+
+    def databases(self, directory):
+        return [filename for filename in os.listdir(directory) if filename.endswith(".rrd")]
+
+    def create(self, database, *args):
+        rrdtool.create(database, *args)
+
+    def sources(self, database):
+        info = rrdtool.info(database)
+
+        sources = []
+        for key in info:
+            if key.startswith("ds[") and key.endswith("].index"):
+                sources.append((info[key], key[3:-7]))
+
+        sources.sort()
+        return [name for index, name in sources]
+
+    def extend(self, database, *args):
+        # Only rrdtool 1.5 (or newer) adds data sources to existing files.
+        try:
+            rrdtool.tune(database, *args)
+        except rrdtool.error, e:
+            raise StatsError("rrdtool files can't take new data sources (%s)" % e)
+
+    def remove(self, database, sources=None):
+        if sources is not None:
+            raise StatsError("rrdtool files can't drop data sources")
+
+        os.remove(database)
+
+    def update(self, database, template, samples):
+        rrdtool.update(database, "--template", template, *["%d:%s" % sample for sample in samples])
+
+    def fetch(self, database, function, start, end, resolution=0, sources=None):
+        if arraystore.numpy is None:
+            raise StatsError("reading the data files requires NumPy")
+
+        if self.cache is None:
+            (first, last, step), names, values = self._fetch(database, function, start, end, resolution)
+        else:
+            (first, last, step), names, values = self._cached(database, function, start, end, resolution)
+
+        if sources is not None:
+            for name in sources:
+                if name not in names:
+                    raise rrdtool.error("unknown data source '%s'" % name)
+
+            values = values[[list(names).index(name) for name in sources]]
+            names = tuple(sources)
+
+        return ((first, last, step), names, values)
+
+    def _fetch(self, database, function, start, end, resolution):
+        numpy = arraystore.numpy
+
+        args = [database, function, "--start", "%d" % start, "--end", "%d" % end]
+        if resolution:
+            args.extend(["--resolution", "%d" % resolution])
+
+        rrdtool_calls.add()
+        (first, last, step), names, rows = rrdtool.fetch(*args)
+
+        # Unknown values come as None, which become NaN.
+        values = numpy.array(rows, dtype=float).reshape(len(rows), len(names)).transpose()
+
+        return ((first, last, step), names, values)
+
+    def _cached(self, database, function, start, end, resolution):
+        """Return the data like _fetch(), but taken from an earlier read of
+           the same archive if it covers it and the file hasn't changed."""
+        key = (database, function, resolution)
+        modified = os.stat(database).st_mtime
+
+        if key in self.cache and self.cache[key][0] == modified:
+            (first, last, step), names, values = self.cache[key][1]
+
+            # The rows wanted and those read, counted in steps since the epoch.
+            wanted_first = start // step + 1
+            wanted_last = -(-end // step)
+            offset = wanted_first - (first // step + 1)
+
+            if offset >= 0 and wanted_last <= last // step:
+                return (((wanted_first - 1) * step, wanted_last * step, step), names,
+                        values[:, offset:wanted_last - first // step])
+
+        data = self._fetch(database, function, start, end, resolution)
+        self.cache[key] = (modified, data)
+
+        return data
+
+    def cache_reads(self, enabled):
+        if enabled and arraystore.numpy is not None:
+            self.cache = self.cache or {}
+        else:
+            self.cache = None
+
+    def graph(self, filename, *args):
+        if self.cache is None:
+            # A single call, reading the data files itself.
+            rrdtool_calls.add()
+            rrdtool.graph(filename, *args)
+            return
+
+        from components import chart, storage
+
+        # Drawn from the archives read (once) into memory instead.
+        chart.Chart(args, storage.fetch).write(filename)
+
+    def close(self):
+        pass
+
+
+_backend = None
+
+
+def backend():
+    """Return the storage backend, as set by the "storage" property."""
+    global _backend
+
+    if _backend is None:
+        if properties["storage"] == "array":
+            _backend = arraystore.ArrayBackend()
+        elif properties["storage"] == "rrdtool":
+            _backend = RRDBackend()
+        else:
+            raise StatsError("unknown storage \"%s\"" % properties["storage"])
+
+    return _backend
+
+
+class UpdateBuffer(object):
+    """Holds the data points for each data file until they are flushed."""
+    def __init__(self):
+        self.pending = {}
+        self.last_flush = monotonic()
+
+    def add(self, database, template, values, timestamp):
+        if database in self.pending:
+            if self.pending[database][0] != template:
+                self.flush_database(database)
+
+        if database not in self.pending:
+            self.pending[database] = (template, [])
+
+        self.pending[database][1].append((timestamp, values))
+
+    def is_due(self):
+        return monotonic() - self.last_flush >= properties["flush"]
+
+    def flush_database(self, database):
+        template, samples = self.pending.pop(database)
+
+        try:
+            # A single call updates the file with all the data points.
+            rrdtool_calls.add()
+            backend().update(database, template, samples)
+        except error, e:
+            # The data points are lost, but only for this file.
+            sys.stderr.write("Cannot update \"%s\": %s\n" % (database, e))
+
+    def flush(self):
+        # Updating the files in order keeps the disk seeks to a minimum.
+        databases = self.pending.keys()
+        databases.sort()
+
+        for database in databases:
+            self.flush_database(database)
+
+        self.last_flush = monotonic()
+
+
+pending_updates = UpdateBuffer()
+
+
+def exists(database):
+    """Check if a data file (named like an ".rrd" file) exists."""
+    return backend().exists(database)
+
+
+def databases(directory):
+    """Return the names (like ".rrd" files) of all data files in a directory."""
+    return backend().databases(directory)
+
+
+def sources(database):
+    """Return the names of the data sources in a data file, in order."""
+    return backend().sources(database)
+
+
+def devices(database):
+    """Return the names of the devices in a consolidated data file (holding
+       the data sources of several devices, named "device/source"), in the
+       order they were added."""
+    devices = []
+    seen = {}
+
+    for name in sources(database):
+        device = name.split("/", 1)[0]
+        if device not in seen:
+            seen[device] = True
+            devices.append(device)
+
+    return devices
+
+
+def create(database, *args):
+    """Create a data file, with the same arguments as "rrdtool.create()".
+       If the "start" property is set, the file starts at that time
+       instead of now, so that it may be filled with past data."""
+    if properties["start"] is not None:
+        args = ("--start", "%d" % properties["start"]) + args
+
+    rrdtool_calls.add()
+    backend().create(database, *args)
+
+
+def ensure(database, *args):
+    """Create a data file, like create(), or add to an existing one the data
+       sources ("DS:..." arguments) it doesn't have yet. Adding data sources
+       requires the "array" storage."""
+    if not exists(database):
+        create(database, *args)
+        return
+
+    existing = dict.fromkeys(sources(database))
+
+    missing = []
+    for arg in args:
+        if arg.startswith("DS:") and arg.split(":")[1] not in existing:
+            missing.append(arg)
+
+    if missing:
+        rrdtool_calls.add()
+        backend().extend(database, *missing)
+
+
+def remove(database, sources=None):
+    """Remove a data file or, if given, only some of its data sources
+       (which requires the "array" storage). Any data points still
+       buffered for it are lost."""
+    if database in pending_updates.pending:
+        del pending_updates.pending[database]
+
+    backend().remove(database, sources)
+
+
+def archive(database, directory):
+    """Copy a data file into "directory", which is created if needed."""
+    path = backend().path(database)
+    target = directory + "/" + os.path.basename(path)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    flush()
+
+    if os.path.isdir(path):
+        shutil.copytree(path, target)
+    else:
+        shutil.copy2(path, target)
+
+
+def update(database, template, values, timestamp=None):
+    """Add a data point to a data file. The "template" names the data
+       sources (separated by ":"), and "values" holds their values."""
+    if timestamp is None:
+        timestamp = int(time())
+
+    if properties["flush"]:
+        pending_updates.add(database, template, values, timestamp)
+    else:
+        rrdtool_calls.add()
+        backend().update(database, template, [(timestamp, values)])
+
+
+def fetch(database, function, start, end, resolution=0, sources=None):
+    """Return the data in a data file between "start" and "end", consolidated
+       by "function" (eg. "AVERAGE"), as a tuple: ((start, end, step), names,
+       values). The "values" are an array (NaN for unknown values) with one
+       row per data source, named in "names" (only those in "sources", if
+       given)."""
+    return backend().fetch(database, function, start, end, resolution, sources)
+
+
+def cache_reads(enabled):
+    """Keep (or stop keeping) the archives read from the data files in memory,
+       so that all the graphics drawn from the same archive (eg. of several
+       devices in a consolidated data file, or the summaries below them)
+       read it only once. Data files updated since are read again. With
+       rrdtool files, the graphics are then drawn from that data instead
+       of by rrdtool (which requires NumPy, otherwise nothing changes)."""
+    backend().cache_reads(enabled)
+
+
+def graph(filename, *args):
+    """Generate a graphic, with the same arguments as "rrdtool.graph()"."""
+    backend().graph(filename, *args)
+
+
+def export(filename, *args, **extra):
+    """Write the data for a graphic, given with the same arguments as
+       "rrdtool.graph()", into a JSON file for the pages to draw it.
+       Return the data, as written (see "chart.Chart.export()")."""
+    from components import chart
+
+    return chart.Chart(args, fetch).export(filename, **extra)
+
+
+def flush(when_due=False):
+    """Write all buffered data points into their data files. If "when_due"
+       is set, only do it if the flush interval has already elapsed."""
+    if not when_due or pending_updates.is_due():
+        pending_updates.flush()
+
+
+def close():
+    """Write everything and close all data files."""
+    flush()
+    backend().close()
+
+
+# EOF - storage.py
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# test_arraystore.py - tests for the data files kept as arrays
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Tests for "arraystore.ArrayStore"."""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from components.arraystore import ArrayStore, StoreError, numpy
+
+
+STEP = 60
+
+
+def _samples(values, start=STEP):
+    """One sample per step, from "start" on, with one value each."""
+    return [(start + i * STEP, "U" if value is None else str(value)) for i, value in enumerate(values)]
+
+
+def _known(values):
+    """The values of a fetched row, with unknown ones as None."""
+    return [None if value != value else value for value in values]
+
+
+class ArrayStoreTest(unittest.TestCase):
+    def setUp(self):
+        if numpy is None:
+            self.skipTest("requires NumPy")
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _create(self, kind, *archives):
+        path = self.directory + "/test.ring"
+        ArrayStore.create(path, "--step", str(STEP), "--start", "0",
+                          "DS:value:%s:%d:U:U" % (kind, 2 * STEP), *archives)
+
+        return ArrayStore(path)
+
+    def test_gauge(self):
+        store = self._create("GAUGE", "RRA:AVERAGE:0.5:1:10", "RRA:AVERAGE:0.5:5:4")
+        store.update("value", _samples(range(1, 11)))
+
+        (start, end, step), names, values = store.fetch("AVERAGE", 0, 10 * STEP)
+        self.assertEqual((start, end, step), (0, 10 * STEP, STEP))
+        self.assertEqual(names, ("value",))
+        self.assertEqual(_known(values[0]), range(1, 11))
+
+        (start, end, step), names, values = store.fetch("AVERAGE", 0, 10 * STEP, 5 * STEP)
+        self.assertEqual(step, 5 * STEP)
+        self.assertEqual(_known(values[0])[-2:], [3.0, 8.0])
+
+    def test_derive(self):
+        store = self._create("DERIVE", "RRA:AVERAGE:0.5:1:10")
+
+        # A rate of 1, 2, 3 and 4 per second (the first has no previous value).
+        store.update("value", _samples([1000, 1060, 1180, 1360, 1600]))
+
+        values = store.fetch("AVERAGE", 0, 5 * STEP)[2]
+        self.assertEqual(_known(values[0]), [None, 1.0, 2.0, 3.0, 4.0])
+
+        # Going backwards is a negative rate (unlike counters).
+        store.update("value", _samples([1540], 6 * STEP))
+        self.assertEqual(_known(store.fetch("AVERAGE", 5 * STEP, 6 * STEP)[2][0]), [-1.0])
+
+    def test_heartbeat(self):
+        store = self._create("GAUGE", "RRA:AVERAGE:0.5:1:10")
+        store.update("value", _samples([1, 2]) + _samples([5], 6 * STEP))
+
+        values = store.fetch("AVERAGE", 0, 6 * STEP)[2]
+        self.assertEqual(_known(values[0]), [1, 2, None, None, None, None])
+
+    def test_xff(self):
+        store = self._create("GAUGE", "RRA:AVERAGE:0.5:4:5")
+
+        # Half the data points known is enough, less than that isn't.
+        store.update("value", _samples([2, None, 4, None, 1, None, None, None]))
+
+        values = store.fetch("AVERAGE", 0, 8 * STEP, 4 * STEP)[2]
+        self.assertEqual(_known(values[0])[-2:], [3.0, None])
+
+    def test_wrap(self):
+        store = self._create("GAUGE", "RRA:AVERAGE:0.5:1:10")
+        store.update("value", _samples(range(1, 26)))
+
+        # Only the last rows are kept, in order, past the end of the archive.
+        (start, end, step), names, values = store.fetch("AVERAGE", 0, 25 * STEP)
+        self.assertEqual((start, end), (15 * STEP, 25 * STEP))
+        self.assertEqual(_known(values[0]), range(16, 26))
+
+        # Also when reading from memory.
+        store.cache_reads(True)
+        values = store.fetch("AVERAGE", 20 * STEP, 25 * STEP)[2]
+        self.assertEqual(_known(values[0]), range(21, 26))
+
+    def test_cache(self):
+        store = self._create("GAUGE", "RRA:AVERAGE:0.5:1:10")
+        store.update("value", _samples([1, 2, 3]))
+        store.cache_reads(True)
+
+        # Read once, straight from the data file, then from a copy.
+        first = store.fetch("AVERAGE", 0, 3 * STEP)[2]
+        self.assertTrue(numpy.may_share_memory(first, store.data[0]))
+
+        second = store.fetch("AVERAGE", 0, 3 * STEP)[2]
+        self.assertFalse(numpy.may_share_memory(second, store.data[0]))
+        self.assertEqual(_known(second[0]), [1, 2, 3])
+
+        # Updates aren't missed.
+        store.update("value", _samples([4], 4 * STEP))
+        self.assertEqual(_known(store.fetch("AVERAGE", 0, 4 * STEP)[2][0]), [1, 2, 3, 4])
+
+    def test_reopen(self):
+        store = self._create("GAUGE", "RRA:AVERAGE:0.5:1:10")
+        store.update("value", _samples([1, 2, 3]))
+        store.close()
+
+        store = ArrayStore(self.directory + "/test.ring")
+        self.assertEqual(store.last_update(), 3 * STEP)
+        self.assertEqual(_known(store.fetch("AVERAGE", 0, 3 * STEP)[2][0]), [1, 2, 3])
+
+    def test_interrupted_create(self):
+        # Whatever a create interrupted halfway left behind is replaced.
+        path = self.directory + "/test.ring"
+        for leftover in (path, path + ".tmp"):
+            os.makedirs(leftover)
+            open(leftover + "/clock", "wb").close()
+
+        store = self._create("GAUGE", "RRA:AVERAGE:0.5:1:10")
+        store.update("value", _samples([1]))
+
+        self.assertEqual(store.last_update(), STEP)
+        self.assertFalse(os.path.exists(path + ".tmp"))
+
+        # But not a complete data file.
+        self.assertRaises(EnvironmentError, self._create, "GAUGE", "RRA:AVERAGE:0.5:1:10")
+        self.assertEqual(ArrayStore(path).last_update(), STEP)
+
+    def test_errors(self):
+        store = self._create("GAUGE", "RRA:AVERAGE:0.5:1:10")
+        store.update("value", _samples([1]))
+
+        self.assertRaises(StoreError, store.update, "value", _samples([2], STEP))
+        self.assertRaises(StoreError, store.update, "other", _samples([2], 2 * STEP))
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# EOF - test_arraystore.py
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# test_chart.py - tests for the graphics drawn without rrdtool
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Tests for "chart.rpn()"."""
+
+
+import unittest
+
+from components.common import StatsError
+from components.chart import rpn, numpy
+
+
+def _known(values):
+    """The values of a series, with unknown ones as None."""
+    return [None if value != value else value for value in values]
+
+
+class RPNTest(unittest.TestCase):
+    def setUp(self):
+        if numpy is None:
+            self.skipTest("requires NumPy")
+
+        self.variables = { "a" : numpy.array([1.0, 2.0, numpy.nan, 4.0]),
+                           "b" : numpy.array([4.0, 2.0, 1.0, numpy.nan]) }
+
+        # Comparing with unknown values is expected.
+        self.errors = numpy.seterr(invalid="ignore")
+
+    def tearDown(self):
+        numpy.seterr(**self.errors)
+
+    def _eval(self, expression):
+        return _known(rpn(expression, self.variables))
+
+    def test_arithmetic(self):
+        self.assertEqual(self._eval("a,b,+"), [5.0, 4.0, None, None])
+        self.assertEqual(self._eval("a,b,-"), [-3.0, 0.0, None, None])
+        self.assertEqual(self._eval("a,8,*"), [8.0, 16.0, None, 32.0])
+        self.assertEqual(self._eval("a,b,/"), [0.25, 1.0, None, None])
+        self.assertEqual(self._eval("a,3,%"), [1.0, 2.0, None, 1.0])
+        self.assertEqual(self._eval("a,b,+,2,/"), [2.5, 2.0, None, None])
+
+    def test_constants(self):
+        self.assertEqual(rpn("2,3,*", {}), 6.0)
+        self.assertEqual(self._eval("a,-1,*,ABS"), [1.0, 2.0, None, 4.0])
+        self.assertEqual(self._eval("a,UNKN,MAX"), [None, None, None, None])
+        self.assertTrue(rpn("INF", {}) > 0 and rpn("NEGINF", {}) < 0)
+
+    def test_comparisons(self):
+        # Unknown on either side makes the result unknown.
+        self.assertEqual(self._eval("a,b,LT"), [1.0, 0.0, None, None])
+        self.assertEqual(self._eval("a,b,GE"), [0.0, 1.0, None, None])
+        self.assertEqual(self._eval("a,b,EQ"), [0.0, 1.0, None, None])
+        self.assertEqual(self._eval("a,b,MIN"), [1.0, 2.0, None, None])
+
+    def test_conditions(self):
+        # The usual way of treating unknown values as zero.
+        self.assertEqual(self._eval("a,UN,0,a,IF"), [1.0, 2.0, 0.0, 4.0])
+        self.assertEqual(self._eval("a,UN"), [0.0, 0.0, 1.0, 0.0])
+
+        # An unknown condition is false.
+        self.assertEqual(self._eval("a,b,GT,a,b,IF"), [4.0, 2.0, 1.0, None])
+
+    def test_errors(self):
+        self.assertRaises(StatsError, rpn, "a,b,FOO", self.variables)
+        self.assertRaises(StatsError, rpn, "a,b", self.variables)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# EOF - test_chart.py
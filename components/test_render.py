@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# test_render.py - tests for deciding which graphics to generate
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Tests for "render.Manifest"."""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from components.common import properties, GraphJob
+from components.render import Manifest, MANIFEST
+
+
+WEEK_STEP = 900  # the step of the archive feeding the weekly graphics.
+
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        self.saved = properties.copy()
+        properties.update(data=self.directory, charts="png", refresh=300)
+
+        self.job = GraphJob("1week", self.directory + "/graph-1week.png")
+        self._touch(self.job.filename)
+
+    def tearDown(self):
+        properties.clear()
+        properties.update(self.saved)
+
+        shutil.rmtree(self.directory)
+
+    def _touch(self, filename):
+        open(filename, "w").close()
+
+    def test_unknown(self):
+        self.assertTrue(Manifest().is_outdated(self.job, 100 * WEEK_STEP))
+
+    def test_step(self):
+        manifest = Manifest()
+        manifest.mark(self.job, 100 * WEEK_STEP)
+
+        # New data only shows up once the archive consolidates it.
+        self.assertFalse(manifest.is_outdated(self.job, 100 * WEEK_STEP + 1))
+        self.assertFalse(manifest.is_outdated(self.job, 101 * WEEK_STEP - 1))
+        self.assertTrue(manifest.is_outdated(self.job, 101 * WEEK_STEP))
+
+    def test_missing(self):
+        manifest = Manifest()
+        manifest.mark(self.job, 100 * WEEK_STEP)
+
+        os.remove(self.job.filename)
+        self.assertTrue(manifest.is_outdated(self.job, 100 * WEEK_STEP + 1))
+
+    def test_outputs(self):
+        manifest = Manifest()
+        manifest.mark(self.job, 100 * WEEK_STEP)
+
+        # Exporting the data as well needs another file.
+        properties["charts"] = "both"
+        self.assertTrue(manifest.is_outdated(self.job, 100 * WEEK_STEP + 1))
+
+        self._touch(self.job.filename.replace(".png", ".json"))
+        self.assertFalse(manifest.is_outdated(self.job, 100 * WEEK_STEP + 1))
+
+    def test_changed_step(self):
+        manifest = Manifest()
+        manifest.mark(self.job, 100 * WEEK_STEP)
+
+        job = GraphJob("1month", self.job.filename)
+        self.assertTrue(manifest.is_outdated(job, 100 * WEEK_STEP + 1))
+
+    def test_no_new_data(self):
+        manifest = Manifest()
+        manifest.mark(self.job, 100 * WEEK_STEP)
+
+        # Generated after its last data point was shown, it's never outdated.
+        self.job.updated = 98 * WEEK_STEP
+        self.assertFalse(manifest.is_outdated(self.job, 200 * WEEK_STEP))
+
+        # But it still is if that data point wasn't showing yet.
+        self.job.updated = 99 * WEEK_STEP
+        self.assertTrue(manifest.is_outdated(self.job, 200 * WEEK_STEP))
+
+    def test_generated(self):
+        manifest = Manifest()
+        self.assertEqual(manifest.generated(self.job), 0)
+
+        manifest.mark(self.job, 100 * WEEK_STEP)
+        self.assertEqual(manifest.generated(self.job), 100 * WEEK_STEP)
+
+    def test_save(self):
+        manifest = Manifest()
+        manifest.mark(self.job, 100 * WEEK_STEP)
+        manifest.save()
+
+        f = open(self.directory + "/" + MANIFEST, "a")
+        f.write("damaged entry\n")
+        f.write("x 100 " + self.directory + "/graph-other.png\n")
+        f.close()
+
+        manifest = Manifest()
+        self.assertEqual(manifest.graphs, { self.job.filename : (WEEK_STEP, 100 * WEEK_STEP) })
+        self.assertFalse(manifest.is_outdated(self.job, 100 * WEEK_STEP + 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# EOF - test_render.py
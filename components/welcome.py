@@ -26,7 +26,6 @@
 import os
 
 from components.common import *
-from templates.welcome.index import index as WelcomePage
 
 
 #
@@ -43,10 +42,12 @@ class Welcome(StatsComponent):
         
         self.name = "welcome"
 
-        if not os.path.exists(DATA_SOURCE):
+        if not os.path.exists(source_path(DATA_SOURCE)):
             fail(self.name, "cannot find \"%s\"." % DATA_SOURCE)
             raise StatsException(DATA_SOURCE + " does not exist")
         
+        self.sources = [DATA_SOURCE]
+
         self.title = "Welcome"
         self.description = "Welcome Page"
 
@@ -60,17 +61,14 @@ class Welcome(StatsComponent):
            as a tuple: (name, title, description)"""
         return (self.name, self.title, self.description)
 
-    def update(self):
+    def update(self, snapshot):
         """Update the dynamic data."""
-        f = open(DATA_SOURCE, "r")
-        
-        data = f.readline().split()
-        self.uptime = float(data[0])
-
-        f.close()
+        self.uptime = float(snapshot.parsed(DATA_SOURCE, parse_fields)[0])
 
     def make_html(self):
         """Generate the HTML pages."""
+        from templates.welcome.index import index as WelcomePage
+
         template = WelcomePage()
         template.components = [component.info() for component in self.components]
         
@@ -87,5 +85,29 @@ class Welcome(StatsComponent):
         template_fill(template, "available statistics components", True)
         template_write(template, self.output_dir + "/index.html")
 
+        if template.client:
+            self._write_script()
+
+    def _write_script(self):
+        """Write the script shared by all pages, if not there already (or outdated)."""
+        from templates.charts import charts as ChartsScript
+
+        filename = os.path.join(self.output_dir, CHARTS_SCRIPT)
+        script = str(ChartsScript())
+
+        if os.path.exists(filename):
+            f = open(filename)
+            current = f.read()
+            f.close()
+
+            if current == script:
+                return
+
+        f = open(filename + ".tmp", "w")
+        f.write(script)
+        f.close()
+
+        os.rename(filename + ".tmp", filename)
+
         
 # EOF - welcome.py
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# benchmark.py - time the components against fake data sources
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Time each phase of the components against fake data sources, built
+   to resemble a host of any size (processors, disks, network interfaces
+   and tracked connections). The results are printed as JSON objects,
+   one per line, so that they can be compared between versions."""
+
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+from math import pi, sin, cos
+
+from getopt import getopt, GetoptError
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from components.common import *
+from components import storage
+from components.render import render_graphs
+from components.processes import Processes
+from components.counters import NetworkCounters
+from components.connections import NetworkConnections
+from components.memory import MemoryUsage
+from components.cpu import CPUUsage
+from components.disks import DiskStats
+
+
+#
+# The size of the fake host, and the ranges it is meant to cover.
+#
+shape = { "cpus"        : 4,      # 1 to 256
+          "disks"       : 10,     # 10 to 5000
+          "interfaces"  : 10,     # 10 to 20000
+          "connections" : 1000 }  # up to 2000000
+
+CLASSES = (CPUUsage, MemoryUsage, Processes, DiskStats, NetworkCounters, NetworkConnections)
+
+PHASES = ("update", "graphs", "html")
+
+
+def print_usage():
+    sys.stdout.write("USAGE: %s" \
+                     " [--cpus=<count>]" \
+                     " [--disks=<count>]" \
+                     " [--interfaces=<count>]" \
+                     " [--connections=<count>]" \
+                     " [--cycles=<count>]" \
+                     " [--phases=<phase,...>]" \
+                     " [--jobs=<count>]" \
+                     " [--root=<directory>]" \
+                     " [--storage=rrdtool|array]" \
+                     " [--consolidate]" \
+                     "\n\n" % os.path.basename(sys.argv[0]))
+
+    sys.stdout.write("Builds fake data sources under \"root\" (a temporary directory by default)\n" \
+                     "for a host with the given number of processors, disks, network interfaces\n" \
+                     "and tracked connections, and times each component over a number of\n" \
+                     "cycles (the default is 2). The phases timed are \"%s\" (all, by default),\n" \
+                     "and each result is printed as a JSON object on a line of its own. The data\n" \
+                     "files are kept as set by \"storage\" (the default is \"rrdtool\"), one\n" \
+                     "per component with \"consolidate\".\n\n" \
+                     % "\", \"".join(PHASES))
+
+
+#
+# Fake data sources. The counters grow with each cycle, so that there's
+# something to compute the rates from. Rates and other values follow a
+# daily pattern, so that the graphics look somewhat realistic.
+#
+
+def counter(cycle, rate):
+    """Return the value of a counter growing at "rate" (per cycle) on average."""
+    day = 86400.0 / properties["refresh"]
+    return int(rate * (cycle + day / (2 * pi) * 0.5 * sin(2 * pi * cycle / day)))
+
+
+def gauge(cycle, value):
+    """Return a value going between half and one and a half times "value"."""
+    day = 86400.0 / properties["refresh"]
+    return int(value * (1 - 0.5 * cos(2 * pi * cycle / day)))
+
+
+def write_file(root, path, lines):
+    filename = root + path
+    if not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+
+    f = open(filename, "w")
+    f.write("\n".join(lines) + "\n")
+    f.close()
+
+
+def write_stat(root, cycle):
+    # user, nice, system, idle, iowait, irq, softirq and steal (some processors busier than others).
+    rates = (1000, 10, 500, 2000, 200, 20, 50, 5)
+
+    lines = ["cpu  %d %d %d %d %d %d %d %d" % tuple([counter(cycle, rate) * shape["cpus"] for rate in rates])]
+    for cpu in xrange(shape["cpus"]):
+        lines.append("cpu%d %d %d %d %d %d %d %d %d" % ((cpu,) + tuple([counter(cycle, rate * (1 + cpu % 4) / 2) for rate in rates])))
+
+    lines.extend(["intr %d" % (counter(cycle, 100000)),
+                  "ctxt %d" % (counter(cycle, 200000)),
+                  "btime 1000000000",
+                  "processes %d" % (counter(cycle, 100)),
+                  "procs_running 1",
+                  "procs_blocked 0"])
+
+    write_file(root, "/proc/stat", lines)
+
+
+def write_meminfo(root, cycle):
+    write_file(root, "/proc/meminfo", ["MemTotal:      %d kB" % 16777216,
+                                       "MemFree:       %d kB" % gauge(cycle, 4194304),
+                                       "Buffers:       %d kB" % 524288,
+                                       "Cached:        %d kB" % 8388608,
+                                       "SwapCached:          0 kB",
+                                       "SwapTotal:     %d kB" % 2097152,
+                                       "SwapFree:      %d kB" % 2097152])
+
+
+def write_loadavg(root, cycle):
+    write_file(root, "/proc/loadavg", ["%.2f 0.50 0.25 1/%d %d" % (gauge(cycle, shape["cpus"]) / 2.0, shape["cpus"] * 50, counter(cycle, 100))])
+
+
+def write_uptime(root, cycle):
+    write_file(root, "/proc/uptime", ["%d.00 %d.00" % (86400 + cycle * properties["refresh"], 80000 + cycle * properties["refresh"])])
+
+
+def write_diskstats(root, cycle):
+    # All disks are equally busy.
+    values = (counter(cycle, 10), 0, counter(cycle, 800), counter(cycle, 5), counter(cycle, 20), 0,
+              counter(cycle, 1600), counter(cycle, 7), 0, counter(cycle, 9), counter(cycle, 12))
+    stats = "%d %d %d %d %d %d %d %d %d %d %d" % values
+
+    lines = []
+    for disk in xrange(shape["disks"]):
+        lines.append("%4d %7d disk%d %s" % (8, disk * 16, disk, stats))
+
+    write_file(root, "/proc/diskstats", lines)
+
+
+def write_net_dev(root, cycle):
+    lines = ["Inter-|   Receive                                                |  Transmit",
+             " face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed",
+             "    lo:%d %d 0 0 0 0 0 0 %d %d 0 0 0 0 0 0" % (counter(cycle, 1000), counter(cycle, 10), counter(cycle, 1000), counter(cycle, 10))]
+
+    # All interfaces are equally busy.
+    stats = "%d %d 0 0 0 0 0 0 %d %d 0 0 0 0 0 0" % (counter(cycle, 150000), counter(cycle, 1000),
+                                                    counter(cycle, 90000), counter(cycle, 800))
+
+    for interface in xrange(shape["interfaces"]):
+        lines.append("eth%d:%s" % (interface, stats))
+
+    write_file(root, "/proc/net/dev", lines)
+
+
+def write_conntrack(root, cycle):
+    count = shape["connections"]
+
+    write_file(root, "/proc/sys/net/netfilter/nf_conntrack_count", ["%d" % count])
+
+    # A few hundred distinct addresses, with some far more frequent than others.
+    states = ("ESTABLISHED", "ESTABLISHED", "ESTABLISHED", "TIME_WAIT", "SYN_SENT", "CLOSE_WAIT")
+
+    filename = root + "/proc/net/nf_conntrack"
+    f = open(filename, "w")
+
+    lines = []
+    for entry in xrange(count):
+        source = "10.0.%d.%d" % ((entry * entry) % 7, entry % 251)
+        destination = "192.168.%d.%d" % (entry % 3, (entry * 7) % 13)
+
+        if entry % 5 == 4:
+            lines.append("ipv4     2 udp      17 29 src=%s dst=%s sport=%d dport=53 src=%s dst=%s sport=53 dport=%d mark=0 use=2\n" \
+                         % (source, destination, 1024 + entry % 60000, destination, source, 1024 + entry % 60000))
+        else:
+            lines.append("ipv4     2 tcp      6 431999 %s src=%s dst=%s sport=%d dport=443 src=%s dst=%s sport=443 dport=%d [ASSURED] mark=0 use=2\n" \
+                         % (states[entry % len(states)], source, destination, 1024 + entry % 60000, destination, source, 1024 + entry % 60000))
+
+        if len(lines) == 10000:
+            f.write("".join(lines))
+            lines = []
+
+    f.write("".join(lines))
+    f.close()
+
+
+def write_sources(root, cycle):
+    """Build (or rebuild, for a new cycle) all data sources under "root"."""
+    for writer in (write_stat, write_meminfo, write_loadavg, write_uptime, write_diskstats, write_net_dev):
+        writer(root, cycle)
+
+    # The table is the same on every cycle, so it's only written once.
+    if cycle == 0:
+        write_conntrack(root, cycle)
+
+
+#
+# Measurements.
+#
+
+def report(component, phase, cycle, wall, cpu, **extra):
+    result = { "component" : component,
+               "phase"     : phase,
+               "cycle"     : cycle,
+               "wall"      : round(wall, 4),
+               "cpu"       : round(cpu, 4) }
+    result.update(shape)
+    result.update(extra)
+
+    sys.stdout.write(json.dumps(result, sort_keys=True) + "\n")
+    sys.stdout.flush()
+
+
+def timed(function, *args):
+    """Call "function", returning a tuple: (result, wall time, CPU time)."""
+    start = time()
+    start_cpu = cpu_time()
+
+    result = function(*args)
+
+    return (result, time() - start, cpu_time() - start_cpu)
+
+
+def run(root, cycles, phases):
+    components = []
+    for cls in CLASSES:
+        try:
+            component, wall, cpu = timed(cls)
+        except StatsException, e:
+            sys.stderr.write("Cannot start component \"%s\": %s\n" % (cls.__name__, e))
+            continue
+
+        components.append(component)
+        report(component.info()[0], "init", 0, wall, cpu)
+
+    # Every cycle stands for a full refresh interval.
+    start = int(time())
+
+    for cycle in xrange(1, cycles + 1):
+        write_sources(root, cycle)
+
+        sources = []
+        scanners = {}
+        for component in components:
+            sources.extend(component.sources)
+            scanners.update(component.scanners)
+
+        snapshot, wall, cpu = timed(Snapshot, sources, scanners, start + cycle * properties["refresh"])
+        report("all", "snapshot", cycle, wall, cpu)
+
+        if "update" in phases:
+            for component in components:
+                result, wall, cpu = timed(component.update, snapshot)
+                report(component.info()[0], "update", cycle, wall, cpu)
+
+            storage.flush()
+
+    if "graphs" in phases:
+        properties["force"] = True
+
+        times, wall, cpu = timed(render_graphs, components)
+        report("all", "graphs", cycles, wall, cpu)
+
+        for component in components:
+            component_wall, component_cpu, count, skipped, calls = times[component.info()[0]]
+            report(component.info()[0], "graphs", cycles, component_wall, component_cpu, graphs=count, calls=calls)
+
+    if "html" in phases:
+        for component in components:
+            try:
+                result, wall, cpu = timed(component.make_html)
+            except ImportError, e:
+                sys.stderr.write("Cannot generate the pages (run \"make\" first): %s\n" % e)
+                break
+
+            report(component.info()[0], "html", cycles, wall, cpu)
+
+
+def main():
+    try:
+        options, remaining = getopt(sys.argv[1:], "h", ["help", "cpus=", "disks=", "interfaces=", "connections=",
+                                                        "cycles=", "phases=", "jobs=", "root=", "storage=", "consolidate"])
+    except GetoptError, e:
+        sys.stderr.write("Error: %s\n" % e)
+        print_usage()
+        sys.exit(1)
+
+    cycles = 2
+    phases = PHASES
+    root = None
+
+    try:
+        for option, value in options:
+            if option in ("-h", "--help"):
+                print_usage()
+                sys.exit(0)
+            elif option == "--cycles":
+                cycles = max(int(value), 1)
+            elif option == "--phases":
+                phases = value.split(",")
+            elif option == "--jobs":
+                properties["jobs"] = max(int(value), 1)
+            elif option == "--root":
+                root = os.path.abspath(value)
+            elif option == "--storage":
+                properties["storage"] = value
+            elif option == "--consolidate":
+                properties["consolidate"] = True
+            else:
+                shape[option[2:]] = max(int(value), 0)
+    except ValueError:
+        sys.stderr.write("Error: %s must be a numeric value\n" % option)
+        sys.exit(1)
+
+    for phase in phases:
+        if phase not in PHASES:
+            sys.stderr.write("Error: unknown phase \"%s\"\n" % phase)
+            sys.exit(1)
+
+    try:
+        if properties["consolidate"] and properties["storage"] != "array":
+            raise StatsError("--consolidate requires --storage=array")
+
+        storage.backend()
+    except StatsError, e:
+        sys.stderr.write("Error: %s\n" % e.value)
+        sys.exit(1)
+
+    # The data files and pages are thrown away, the data sources only if temporary.
+    work_dir = tempfile.mkdtemp(prefix="quicklook-benchmark-")
+
+    if root is None:
+        root = work_dir + "/root"
+
+    properties["root"] = root
+    properties["data"] = work_dir + "/data"
+    properties["output"] = work_dir + "/output"
+
+    try:
+        write_sources(root, 0)
+        run(root, cycles, phases)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# EOF - benchmark.py
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# migrate.py - convert the rrdtool data files for the "array" storage
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Import every rrdtool data file under a data directory into the memory-mapped
+   arrays used by the "array" storage, with the same data sources and archives.
+   The archives are copied as they are (nothing is consolidated again), along
+   with the last value of each data source, so that counters carry on."""
+
+
+import os
+import sys
+import shutil
+import rrdtool
+
+from getopt import getopt, GetoptError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from components.common import *
+from components.arraystore import ArrayStore, ArrayBackend, numpy
+
+
+def print_usage():
+    sys.stdout.write("USAGE: %s --data=<directory> [--remove] [--verbose]\n\n" % os.path.basename(sys.argv[0]))
+
+    sys.stdout.write("Converts all rrdtool data files (\".rrd\") under the data directory, to be\n" \
+                     "used with \"--storage=array\". Files already converted are skipped. The\n" \
+                     "original files are kept, unless \"--remove\" is given. Quick Look must not\n" \
+                     "be running while they are converted.\n\n")
+
+
+def definition(info):
+    """Return the arguments to create a data file like the one described
+       by "rrdtool.info()", and the names of its data sources (in order)."""
+    sources = []
+    archives = []
+
+    for key in info:
+        if key.startswith("ds[") and key.endswith("].index"):
+            sources.append((info[key], key[3:-7]))
+        elif key.startswith("rra[") and key.endswith("].cf"):
+            archives.append(int(key[4:-4]))
+
+    sources.sort()
+    archives.sort()
+
+    args = ["--step", "%d" % info["step"], "--start", "%d" % info["last_update"]]
+
+    names = []
+    for index, name in sources:
+        limits = []
+        for limit in ("min", "max"):
+            value = info["ds[%s].%s" % (name, limit)]
+            if value is None:
+                limits.append("U")
+            else:
+                limits.append(repr(float(value)))
+
+        args.append("DS:%s:%s:%d:%s:%s" % (name, info["ds[%s].type" % name],
+                                           info["ds[%s].minimal_heartbeat" % name], limits[0], limits[1]))
+        names.append(name)
+
+    for i in archives:
+        args.append("RRA:%s:%s:%d:%d" % (info["rra[%d].cf" % i], info["rra[%d].xff" % i],
+                                         info["rra[%d].pdp_per_row" % i], info["rra[%d].rows" % i]))
+
+    return (args, names)
+
+
+def migrate(database, path):
+    info = rrdtool.info(database)
+    args, names = definition(info)
+
+    ArrayStore.create(path, *args)
+    store = ArrayStore(path)
+
+    last_update = info["last_update"]
+
+    try:
+        for i, (function, xff, steps, rows) in enumerate(store.archives):
+            seconds = steps * store.step
+            end = last_update / seconds * seconds
+
+            (first, last, step), fetched_names, fetched = rrdtool.fetch(database, function,
+                                                                        "--resolution", "%d" % seconds,
+                                                                        "--start", "%d" % (end - rows * seconds),
+                                                                        "--end", "%d" % end)
+
+            if step != seconds:
+                # This archive can't be told apart from another one.
+                sys.stderr.write("Warning: \"%s\": archive %d was left empty\n" % (database, i))
+                continue
+
+            values = numpy.array(fetched, dtype=float).reshape(len(fetched), len(fetched_names)).transpose()
+            order = [list(fetched_names).index(name) for name in names]
+
+            store.load(i, last, values[order])
+
+        last_values = []
+        for name in names:
+            value = info.get("ds[%s].last_ds" % name, "U")
+            try:
+                last_values.append(float(value))
+            except (TypeError, ValueError):
+                last_values.append(float("nan"))
+
+        store.set_state(last_update, last_values)
+    finally:
+        store.close()
+
+
+def main():
+    try:
+        options, remaining = getopt(sys.argv[1:], "hv", ["help", "verbose", "data=", "remove"])
+    except GetoptError, e:
+        sys.stderr.write("Error: %s\n" % e)
+        print_usage()
+        sys.exit(1)
+
+    data = None
+    remove = False
+
+    for option, value in options:
+        if option in ("-h", "--help"):
+            print_usage()
+            sys.exit(0)
+        elif option in ("-v", "--verbose"):
+            properties["verbose"] = True
+        elif option == "--data":
+            data = os.path.abspath(value)
+        elif option == "--remove":
+            remove = True
+
+    if data is None:
+        sys.stderr.write("Error: not enough parameters\n")
+        print_usage()
+        sys.exit(1)
+
+    try:
+        backend = ArrayBackend()
+    except StatsError, e:
+        sys.stderr.write("Error: %s\n" % e.value)
+        sys.exit(1)
+
+    converted = failed = 0
+
+    for directory, subdirectories, filenames in os.walk(data):
+        for filename in filenames:
+            if not filename.endswith(".rrd"):
+                continue
+
+            database = os.path.join(directory, filename)
+            path = backend.path(database)
+
+            if os.path.exists(path):
+                continue
+
+            try:
+                migrate(database, path)
+            except (rrdtool.error, EnvironmentError, KeyError, ValueError), e:
+                sys.stderr.write("Cannot convert \"%s\": %s\n" % (database, e))
+                shutil.rmtree(path, True)
+                failed += 1
+                continue
+
+            if remove:
+                os.remove(database)
+
+            converted += 1
+
+            if properties["verbose"]:
+                sys.stderr.write("Converted \"%s\".\n" % database)
+
+    if properties["verbose"]:
+        sys.stderr.write("Converted %d data file(s), %d failed.\n" % (converted, failed))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# EOF - migrate.py
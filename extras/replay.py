@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: iso8859-1 -*-
+#
+# replay.py - fill the data files with past data, as fast as possible
+#
+# Copyright (c) 2005-2007, Carlos Rodrigues <cefrodrigues@mail.telepac.pt>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License (version 2) as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+
+"""Feed snapshots of the data sources through the components, each with the
+   timestamp it would have had if collected at the refresh interval over
+   the past days (a year, by default). This fills every archive of the data
+   files, and then the time taken to generate the graphics for each interval
+   is measured. The snapshots are either fake (as built by "benchmark.py")
+   or recorded on a real host, with "--record".
+
+   The results are printed as JSON objects, one per line."""
+
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+from getopt import getopt, GetoptError
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from components.common import *
+from components import storage
+
+from benchmark import CLASSES, shape, write_sources, report, timed
+
+
+def print_usage():
+    sys.stdout.write("USAGE: %s" \
+                     " [--days=<count>]" \
+                     " [--refresh=<minutes>]" \
+                     " [--snapshots=<directory>]" \
+                     " [--batch=<count>]" \
+                     " [--data=<directory>]" \
+                     " [--output=<directory>]" \
+                     " [--cpus=<count>]" \
+                     " [--disks=<count>]" \
+                     " [--interfaces=<count>]" \
+                     " [--connections=<count>]" \
+                     " [--storage=rrdtool|array]" \
+                     " [--consolidate]" \
+                     "\n" \
+                     "       %s --record=<directory>" \
+                     "\n\n" % (os.path.basename(sys.argv[0]), os.path.basename(sys.argv[0])))
+
+    sys.stdout.write("Replays snapshots of the data sources over the past \"days\" (the default\n" \
+                     "is 365), at the given refresh interval (the default is %d minutes).\n" \
+                     "Updates are written in batches of \"count\" snapshots (the default is a\n" \
+                     "day's worth). Then, all graphs are generated and timed by interval.\n\n" \
+                     "The snapshots are fake, for a host of the given size, unless taken from\n" \
+                     "a directory of recorded snapshots. Each run with \"--record\" adds a new\n" \
+                     "snapshot of this host's data sources to that directory, and they are\n" \
+                     "replayed in order (and over again, if there aren't enough).\n\n" \
+                     "The data files (kept as set by \"storage\", \"rrdtool\" by default, one\n" \
+                     "per component with \"consolidate\") and graphs are thrown away, unless\n" \
+                     "their directories are given.\n\n" % (properties["refresh"] / 60))
+
+
+def load_components():
+    components = []
+    for cls in CLASSES:
+        try:
+            components.append(cls())
+        except StatsException, e:
+            sys.stderr.write("Cannot start component \"%s\": %s\n" % (cls.__name__, e))
+
+    return components
+
+
+def record(directory):
+    """Copy the current contents of all data sources into a new snapshot."""
+    components = load_components()
+
+    snapshot_dir = "%s/%d" % (directory, time())
+    for component in components:
+        for source in component.sources + component.scanners.keys():
+            filename = snapshot_dir + source
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+
+            f = open(filename, "w")
+            f.write(registry.read(source))
+            f.close()
+
+
+def replay(days, batch, snapshots, root):
+    refresh = properties["refresh"]
+    cycles = days * 86400 / refresh
+
+    # The last data point is the latest the graphics can show.
+    end = int(time() / refresh) * refresh
+    start = end - cycles * refresh
+
+    # The data files must start before the first data point.
+    properties["start"] = start - refresh
+
+    if snapshots is None:
+        properties["root"] = root
+        write_sources(root, 0)
+    else:
+        properties["root"] = snapshots[0]
+
+    components = load_components()
+
+    sources = []
+    scanners = {}
+    for component in components:
+        sources.extend(component.sources)
+        scanners.update(component.scanners)
+
+    # Buffer all updates, and write each batch at once.
+    properties["flush"] = batch * refresh
+
+    replay_start = time()
+    replay_cpu = cpu_time()
+    calls = storage.rrdtool_calls.count
+
+    for cycle in xrange(1, cycles + 1):
+        if snapshots is None:
+            write_sources(root, cycle)
+        else:
+            properties["root"] = snapshots[cycle % len(snapshots)]
+
+        snapshot = Snapshot(sources, scanners, start + cycle * refresh)
+
+        for component in components:
+            component.update(snapshot)
+
+        if cycle % batch == 0:
+            storage.flush()
+
+    storage.flush()
+
+    wall = time() - replay_start
+    report("all", "replay", cycles, wall, cpu_time() - replay_cpu,
+           days=days, updates=storage.rrdtool_calls.count - calls, snapshots_per_second=round(cycles / wall, 1))
+
+    # The times are added up by component and interval, with
+    # reads from the data files cached as when rendering.
+    storage.cache_reads(True)
+
+    for component in components:
+        times = {}
+        for interval in INTERVALS:
+            times[interval] = (0.0, 0.0, 0)
+
+        for job in component.graphs():
+            result, wall, cpu = timed(job.run)
+
+            total_wall, total_cpu, count = times[job.interval]
+            times[job.interval] = (total_wall + wall, total_cpu + cpu, count + 1)
+
+        for interval in INTERVALS:
+            wall, cpu, count = times[interval]
+            report(component.info()[0], "graphs", cycles, wall, cpu, interval=interval, graphs=count)
+
+
+def main():
+    try:
+        options, remaining = getopt(sys.argv[1:], "h", ["help", "days=", "refresh=", "snapshots=", "batch=", "data=", "output=",
+                                                        "record=", "storage=", "consolidate", "cpus=", "disks=", "interfaces=", "connections="])
+    except GetoptError, e:
+        sys.stderr.write("Error: %s\n" % e)
+        print_usage()
+        sys.exit(1)
+
+    days = 365
+    batch = None
+    snapshots = None
+    data = output = None
+
+    try:
+        for option, value in options:
+            if option in ("-h", "--help"):
+                print_usage()
+                sys.exit(0)
+            elif option == "--record":
+                record(os.path.abspath(value))
+                sys.exit(0)
+            elif option == "--days":
+                days = max(int(value), 1)
+            elif option == "--refresh":
+                properties["refresh"] = max(int(value), 1) * 60
+            elif option == "--batch":
+                batch = max(int(value), 1)
+            elif option == "--snapshots":
+                directory = os.path.abspath(value)
+                snapshots = [directory + "/" + name for name in os.listdir(directory)]
+                snapshots.sort()
+            elif option == "--data":
+                data = os.path.abspath(value)
+            elif option == "--output":
+                output = os.path.abspath(value)
+            elif option == "--storage":
+                properties["storage"] = value
+            elif option == "--consolidate":
+                properties["consolidate"] = True
+            else:
+                shape[option[2:]] = max(int(value), 0)
+    except ValueError:
+        sys.stderr.write("Error: %s must be a numeric value\n" % option)
+        sys.exit(1)
+
+    if snapshots is not None and not snapshots:
+        sys.stderr.write("Error: no recorded snapshots to replay\n")
+        sys.exit(1)
+
+    try:
+        if properties["consolidate"] and properties["storage"] != "array":
+            raise StatsError("--consolidate requires --storage=array")
+
+        storage.backend()
+    except StatsError, e:
+        sys.stderr.write("Error: %s\n" % e.value)
+        sys.exit(1)
+
+    if batch is None:
+        batch = 86400 / properties["refresh"]
+
+    work_dir = tempfile.mkdtemp(prefix="quicklook-replay-")
+
+    properties["data"] = data or work_dir + "/data"
+    properties["output"] = output or work_dir + "/output"
+
+    try:
+        replay(days, batch, snapshots, work_dir + "/root")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# EOF - replay.py
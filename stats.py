@@ -22,17 +22,33 @@
 
 import os
 import sys
+import signal
 
+from time import sleep, strftime
 from getopt import getopt, GetoptError
 
 from components.common import *
+from components import storage
+from components import arraystore
+from components import chart
+from components import profiling
+from components.locking import RunLock
+from components.render import render_graphs
 from components.welcome import Welcome
 from components.processes import Processes
-from components.counters import NetworkCounters
+from components.counters import NetworkCounters, DEFAULT_EXCLUDE as INTERFACES_EXCLUDE
 from components.connections import NetworkConnections
 from components.memory import MemoryUsage
 from components.cpu import CPUUsage
-from components.disks import DiskStats
+from components.disks import DiskStats, DEFAULT_EXCLUDE as DISKS_EXCLUDE
+from components.quicklook import SelfMonitor
+
+
+#
+# The errors a run recovers from, besides our own: data sources that can't
+# be read or parsed (eg. truncated reads from "/proc") and failing data files.
+#
+RUN_ERRORS = READ_ERRORS + storage.error
 
 
 def print_usage():
@@ -40,6 +56,27 @@ def print_usage():
                      " --data=<data directory>" \
                      " --output=<output directory>" \
                      " [--refresh=<minutes>]" \
+                     " [--daemon]" \
+                     " [--collect-only | --render-only]" \
+                     " [--redraw=<minutes>]" \
+                     " [--jobs=<count>]" \
+                     " [--force]" \
+                     " [--flush=<minutes>]" \
+                     " [--conntrack=<seconds>]" \
+                     " [--talkers=<count>]" \
+                     " [--budget=<seconds>]" \
+                     " [--profile=<directory>]" \
+                     " [--root=<directory>]" \
+                     " [--storage=rrdtool|array]" \
+                     " [--consolidate]" \
+                     " [--expire=<days>]" \
+                     " [--gc [--archive=<directory>]]" \
+                     " [--include=<component>:<pattern,...>]" \
+                     " [--exclude=<component>:<pattern,...>]" \
+                     " [--top=<count>]" \
+                     " [--draw=<component>:<pattern,...>]" \
+                     " [--heatmap=<count>]" \
+                     " [--charts=png|json|both]" \
                      " [--verbose]" \
                      "\n\n" % os.path.basename(sys.argv[0]))
 
@@ -63,6 +100,132 @@ def print_usage():
                      " just stick with\n\tthe default value of %d minutes (by" \
                      " omitting this option).\n\n" % (properties["refresh"] / 60))
 
+    sys.stdout.write("--daemon (optional)\n\tStay in the foreground and collect data every" \
+                     " \"refresh\" minutes, instead of\n\trunning once and exiting." \
+                     " This avoids the startup cost of each run, and\n\treplaces the" \
+                     " cron job. Send SIGHUP to reload all components (eg. to\n\tforget" \
+                     " about devices that are gone), or SIGTERM to exit after the\n\tcurrent" \
+                     " run.\n\n")
+
+    sys.stdout.write("--collect-only, --render-only (optional)\n\tOnly collect data," \
+                     " or only generate the graphs and HTML pages from the\n\tdata" \
+                     " already collected. Rendering can be slow, so running it as a" \
+                     " separate\n\tprocess keeps it from delaying the collection of" \
+                     " data.\n\n")
+
+    sys.stdout.write("--redraw=<minutes> (optional)\n\tIn daemon mode, generate the" \
+                     " graphs and HTML pages at \"minutes\" intervals.\n\tThe default" \
+                     " is to generate them every time data is collected.\n\n")
+
+    sys.stdout.write("--jobs=<count> (optional)\n\tGenerate the graphs using" \
+                     " \"count\" processes at once. On hosts with many\n\tdisks or" \
+                     " network interfaces, setting this to the number of processors\n\t" \
+                     "may make generating the graphs much faster.\n\n")
+
+    sys.stdout.write("--force (optional)\n\tGenerate all graphs. Usually, a graph is" \
+                     " only generated again when new\n\tdata is available for it, which" \
+                     " happens less often for the graphs\n\tcovering longer periods" \
+                     " (eg. every 12 hours, for the yearly graphs).\n\n")
+
+    sys.stdout.write("--flush=<minutes> (optional)\n\tIn daemon mode, keep the collected" \
+                     " data in memory and write it into\n\tthe data files at \"minutes\"" \
+                     " intervals, with a single update per file. This\n\treduces the disk" \
+                     " I/O, but the data not yet written is lost if the program\n\tis killed" \
+                     " (SIGTERM is safe). The data is always written before\n\tgenerating" \
+                     " the graphs, but not when they are generated by another process.\n\n")
+
+    sys.stdout.write("--conntrack=<seconds> (optional)\n\tStop counting the tracked" \
+                     " network connections by protocol if it takes\n\tlonger than" \
+                     " \"seconds\" (the default is %d). From then on, only their\n\ttotal" \
+                     " number is collected. Setting this to zero does it right away,\n\twhich" \
+                     " may be a good idea on firewalls tracking many connections. This\n\tis" \
+                     " remembered in the \"scan-limit\" file, in the data directory for\n\tthe" \
+                     " connections (remove it to try again).\n\n" \
+                     % properties["conntrack"])
+
+    sys.stdout.write("--talkers=<count> (optional)\n\tShow the top \"count\" source and" \
+                     " destination addresses among the\n\ttracked network connections," \
+                     " and graph TCP connections by state.\n\tThis requires parsing every" \
+                     " entry in the connections table, which is\n\tmuch slower than" \
+                     " counting them, so it's disabled by default (zero).\n\tIf it takes" \
+                     " longer than half the \"--conntrack\" time limit, only\n\tthe" \
+                     " counting by protocol goes on, as above.\n\n")
+
+    sys.stdout.write("--budget=<seconds> (optional)\n\tLimit the time spent generating" \
+                     " the graphs of each component to\n\t\"seconds\". The graphs must then also" \
+                     " be generated before the next run\n\tis due, so the time available is" \
+                     " shared among all components. Any\n\tgraphs left out are the first ones" \
+                     " generated in the next run.\n\tOverlapping runs are always detected:" \
+                     " collecting data waits for up to\n\thalf the refresh interval, generating" \
+                     " the graphs and pages is skipped\n\tright away.\n\n")
+
+    sys.stdout.write("--profile=<directory> (optional)\n\tRun once (in a single process)" \
+                     " under the Python profiler, saving the\n\tstatistics for each component" \
+                     " and phase into \"directory\" (eg.\n\t\"cpu-update.pstats\"), along with" \
+                     " a trace of all calls into the\n\tdata files (\"%s\"). Combine it with --force" \
+                     " to profile generating all\n\tthe graphs.\n\n" % profiling.TRACE_FILE)
+
+    sys.stdout.write("--root=<directory> (optional)\n\tRead the data sources (eg." \
+                     " \"/proc/stat\") from under \"directory\"\n\tinstead of \"/\". This is" \
+                     " meant for testing with fake data sources,\n\tsuch as those built by" \
+                     " \"extras/benchmark.py\".\n\n")
+
+    sys.stdout.write("--storage=rrdtool|array (optional)\n\tThe kind of data files to keep." \
+                     " The default is rrdtool's own files,\n\t\"array\" keeps them as" \
+                     " memory-mapped arrays instead (this requires NumPy),\n\tand draws the" \
+                     " graphs without rrdtool. Whatever the choice, you must\n\tstick with it," \
+                     " but existing rrdtool files can be converted with\n\t\"extras/migrate.py\".\n\n")
+
+    sys.stdout.write("--consolidate (optional)\n\tKeep the data for all disks (and for all" \
+                     " network interfaces) in a\n\tsingle data file, updated all at once, instead" \
+                     " of one data file for\n\teach. New devices are added to the existing file." \
+                     " This is meant for\n\thosts with many devices, and requires" \
+                     " \"--storage=array\".\n\n")
+
+    sys.stdout.write("--expire=<days> (optional)\n\tStop generating the graphs and pages" \
+                     " for disks and network interfaces\n\tnot seen for \"days\" (the default" \
+                     " is %d). Setting this to zero keeps\n\tthem forever. Devices missing" \
+                     " from the last run have their graphs\n\tgenerated once more, and then" \
+                     " only if they come back.\n\n" % (properties["expire"] / 86400))
+
+    sys.stdout.write("--gc (optional)\n\tRemove the data files and graphs of the devices" \
+                     " expired as above, and\n\texit. Run it now and then on hosts where" \
+                     " devices come and go (eg.\n\tvirtual network interfaces for containers).\n\n")
+
+    sys.stdout.write("--archive=<directory> (optional)\n\tWith --gc, copy the data files into" \
+                     " \"directory\" before removing\n\tanything from them, under a subdirectory" \
+                     " for the date and time.\n\n")
+
+    sys.stdout.write("--include=<component>:<pattern,...>, --exclude=<component>:<pattern,...>\n\t" \
+                     "(optional) Only track the devices of \"component\" (\"disks\" or" \
+                     " \"counters\",\n\tfor network interfaces) with names matching any of the" \
+                     " glob\n\tpatterns included, and none of those excluded. Devices left out" \
+                     " have\n\tno data files or graphs. For example, \"--include=counters:eth*,bond*\"" \
+                     "\n\ton a host with lots of virtual network interfaces. Unless others" \
+                     " are\n\tgiven, the disks excluded are \"%s\" and the\n\tnetwork" \
+                     " interfaces excluded are \"%s\".\n\n" % (",".join(DISKS_EXCLUDE), ",".join(INTERFACES_EXCLUDE)))
+
+    sys.stdout.write("--top=<count> (optional)\n\tOnly graph in detail the \"count\" busiest disks" \
+                     " and network interfaces,\n\tby their throughput over the last hour. The others" \
+                     " are listed by\n\tthroughput, and all of them are also graphed added up" \
+                     " (this is\n\talways the case). This requires NumPy.\n\n")
+
+    sys.stdout.write("--draw=<component>:<pattern,...> (optional)\n\tGraph the devices of" \
+                     " \"component\" matching any of the glob patterns in\n\tdetail, even if" \
+                     " not among the busiest. For a device to be graphed\n\tjust once, combine" \
+                     " it with --render-only.\n\n")
+
+    sys.stdout.write("--heatmap=<count> (optional)\n\tOn hosts with more than \"count\" processors" \
+                     " (the default is %d),\n\tonly draw the heatmap showing all of them, instead of" \
+                     " also graphing\n\teach one. Disks and network interfaces always get a heatmap" \
+                     " too.\n\tHeatmaps require NumPy.\n\n" % properties["heatmap"])
+
+    sys.stdout.write("--charts=png|json|both (optional)\n\tGenerate the graphics as images" \
+                     " (\"png\", the default), or only export\n\ttheir data (\"json\"), for the" \
+                     " pages to draw them in the browser.\n\tWith \"both\", the data is exported" \
+                     " along with the images, which the\n\tpages still show. Exporting the data" \
+                     " requires NumPy and Python 2.6\n\tor newer.\n\n")
+
     sys.stdout.write("--verbose (optional)\n\tThis program doesn't print any" \
                      " messages unless they are clearly errors.\n\tThis means that" \
                      " no error is printed if a particular component isn't\n\tloaded" \
@@ -79,13 +242,18 @@ def print_usage():
 
 def process_cmdline():
     try:
-        options, remaining = getopt(sys.argv[1:], "vd:o:r:", ["verbose", "data=", "output=", "refresh="])
+        options, remaining = getopt(sys.argv[1:], "vd:o:r:DCRw:j:fF:c:t:b:P:", ["verbose", "data=", "output=", "refresh=", "daemon",
+                                                                "collect-only", "render-only", "redraw=", "jobs=", "force", "flush=", "conntrack=", "talkers=", "budget=", "profile=", "root=", "storage=", "consolidate",
+                                                                "expire=", "gc", "archive=", "include=", "exclude=",
+                                                                "top=", "draw=", "heatmap=", "charts="])
     except GetoptError, exception:
         raise StatsError(str(exception))
 
     # These options are mandatory.
     data = output = False
 
+    redraw = None
+
     for option, value in options:
         if option in ("-v", "--verbose"):
             properties["verbose"] = True
@@ -100,10 +268,120 @@ def process_cmdline():
                 properties["refresh"] = int(value) * 60
             except ValueError, e:
                 raise StatsError("refresh must be a numeric value")
+        elif option in ("-D", "--daemon"):
+            properties["daemon"] = True
+        elif option in ("-C", "--collect-only"):
+            properties["render"] = False
+        elif option in ("-R", "--render-only"):
+            properties["collect"] = False
+        elif option in ("-w", "--redraw"):
+            try:
+                redraw = int(value) * 60
+            except ValueError, e:
+                raise StatsError("redraw must be a numeric value")
+        elif option in ("-j", "--jobs"):
+            try:
+                properties["jobs"] = max(int(value), 1)
+            except ValueError, e:
+                raise StatsError("jobs must be a numeric value")
+        elif option in ("-f", "--force"):
+            properties["force"] = True
+        elif option in ("-F", "--flush"):
+            try:
+                properties["flush"] = int(value) * 60
+            except ValueError, e:
+                raise StatsError("flush must be a numeric value")
+        elif option in ("-c", "--conntrack"):
+            try:
+                properties["conntrack"] = int(value)
+            except ValueError, e:
+                raise StatsError("conntrack must be a numeric value")
+        elif option in ("-t", "--talkers"):
+            try:
+                properties["talkers"] = int(value)
+            except ValueError, e:
+                raise StatsError("talkers must be a numeric value")
+        elif option in ("-b", "--budget"):
+            try:
+                properties["budget"] = int(value)
+            except ValueError, e:
+                raise StatsError("budget must be a numeric value")
+        elif option in ("-P", "--profile"):
+            properties["profile"] = os.path.normpath(value)
+        elif option == "--root":
+            properties["root"] = os.path.normpath(os.path.abspath(value)).rstrip("/")
+        elif option == "--storage":
+            if value not in ("rrdtool", "array"):
+                raise StatsError("storage must be either \"rrdtool\" or \"array\"")
+            properties["storage"] = value
+        elif option == "--consolidate":
+            properties["consolidate"] = True
+        elif option == "--expire":
+            try:
+                properties["expire"] = int(value) * 86400
+            except ValueError, e:
+                raise StatsError("expire must be a numeric value")
+        elif option == "--gc":
+            properties["gc"] = True
+        elif option == "--archive":
+            properties["archive"] = os.path.normpath(value)
+        elif option == "--top":
+            try:
+                properties["top"] = max(int(value), 0)
+            except ValueError, e:
+                raise StatsError("top must be a numeric value")
+        elif option == "--heatmap":
+            try:
+                properties["heatmap"] = max(int(value), 1)
+            except ValueError, e:
+                raise StatsError("heatmap must be a numeric value")
+        elif option == "--charts":
+            if value not in ("png", "json", "both"):
+                raise StatsError("charts must be either \"png\", \"json\" or \"both\"")
+            properties["charts"] = value
+        elif option in ("--include", "--exclude", "--draw"):
+            fields = value.split(":", 1)
+            if fields[0] not in ("disks", "counters") or len(fields) != 2:
+                raise StatsError("%s must be given as \"disks:...\" or \"counters:...\"" % option[2:])
+
+            # Repeating the option adds to the patterns.
+            component, patterns = fields
+            properties[option[2:]].setdefault(component, []).extend([pattern for pattern in patterns.split(",") if pattern])
 
     if not data or not output:
         raise StatsError("not enough parameters")
 
+    if not properties["collect"] and not properties["render"]:
+        raise StatsError("--collect-only and --render-only are mutually exclusive")
+
+    if redraw:
+        properties["redraw"] = redraw
+    else:
+        properties["redraw"] = properties["refresh"]
+
+    if properties["profile"]:
+        # The profiler only sees what happens in this process.
+        properties["daemon"] = False
+        properties["jobs"] = 1
+
+    if properties["consolidate"] and properties["storage"] != "array":
+        raise StatsError("--consolidate requires --storage=array")
+
+    if properties["gc"] and not properties["expire"]:
+        raise StatsError("--gc requires devices to expire")
+
+    if properties["archive"] and not properties["gc"]:
+        raise StatsError("--archive requires --gc")
+
+    if properties["top"] and arraystore.numpy is None:
+        raise StatsError("--top requires NumPy")
+
+    if properties["charts"] != "png" and (arraystore.numpy is None or chart.json is None):
+        raise StatsError("--charts=%s requires NumPy and Python 2.6 or newer" % properties["charts"])
+
+    # Fail now if the storage isn't available (eg. for lack of NumPy).
+    storage.backend()
+
         
 def load_components():
     classes = ["CPUUsage", "MemoryUsage", "Processes", "DiskStats", "NetworkCounters", "NetworkConnections"]
@@ -116,9 +394,228 @@ def load_components():
         except StatsException, e:
             pass
 
+    # Quick Look's own statistics come last, as they cover all the others.
+    components.append(SelfMonitor())
+
     return components
 
 
+def collect(components):
+    """Collect data for all components."""
+    monitor = components[-1]
+    monitor.start("collect")
+
+    # Wait a while for another process still collecting data, so that
+    # no data is lost for a run that is only slightly late. But not too
+    # long, or processes would pile up waiting for each other.
+    lock = RunLock("collect")
+    if not lock.acquire(properties["refresh"] / 2):
+        monitor.skip("collect", "process %s was still collecting data" % lock.owner())
+        return
+
+    try:
+        _collect(components, monitor)
+    finally:
+        lock.release()
+
+
+def _collect(components, monitor):
+    sources = []
+    scanners = {}
+    for component in components:
+        sources.extend(component.sources)
+        scanners.update(component.scanners)
+
+    # Read everything first, so that all the data refers to the same instant.
+    snapshot = Snapshot(sources, scanners)
+
+    # A component failing to update only loses its own data point.
+    for component in components:
+        try:
+            monitor.measure("collect", component, "update", component.update, snapshot)
+        except RUN_ERRORS, e:
+            sys.stderr.write("Cannot update \"%s\": %s\n" % (component.info()[0], e))
+
+    storage.flush(when_due=True)
+
+    monitor.finish("collect", snapshot.time)
+
+
+def render(components):
+    """Generate the graphs and pages for all components."""
+    monitor = components[-1]
+    monitor.start("render")
+
+    # Collecting data comes first, so if another process is still
+    # busy generating the graphs, we skip doing it ourselves.
+    lock = RunLock("render")
+    if not lock.acquire():
+        monitor.skip("render", "process %s was still generating them" % lock.owner())
+        return
+
+    try:
+        _render(components, monitor)
+    finally:
+        lock.release()
+
+
+def _render(components, monitor):
+    if not properties["collect"]:
+        # The data is being collected by some other process.
+        for component in components:
+            component.load()
+
+    # The graphs must include all the data collected so far.
+    storage.flush()
+
+    welcome = Welcome(components)
+    welcome.update(Snapshot(welcome.sources))
+    welcome.make_html()
+
+    # With a time budget, the graphs must also be done before the next
+    # run is due, leaving some time for the pages.
+    deadline = None
+    if properties["budget"]:
+        start, limit = monitor.limits("render")
+        deadline = start + limit * 0.9
+
+    if profiling.profiler:
+        # Generate the graphs of each component separately, so they can be told apart.
+        times = {}
+        for component in components:
+            name = component.info()[0]
+            times.update(profiling.profiled(name, "make_graphs", render_graphs, [component], deadline))
+    else:
+        times = render_graphs(components, deadline)
+
+    skipped = 0
+    for component in components:
+        wall, cpu, count, left, calls = times[component.info()[0]]
+        monitor.record("render", component, "graphs", wall, cpu, calls)
+        skipped += left
+
+        monitor.measure("render", component, "html", component.make_html)
+
+    monitor.finish("render", skipped=skipped)
+
+
+def collect_garbage(components):
+    """Remove the data files and graphs of the devices gone for too long."""
+    # Collecting data at the same time could bring them back half-removed.
+    lock = RunLock("collect")
+    if not lock.acquire(properties["refresh"] / 2):
+        raise StatsError("process %s is still collecting data" % lock.owner())
+
+    archive = None
+    if properties["archive"]:
+        archive = properties["archive"] + "/" + strftime("%Y%m%d-%H%M%S")
+
+    try:
+        for component in components:
+            name = component.info()[0]
+
+            if archive is None:
+                removed = component.collect_garbage()
+            else:
+                removed = component.collect_garbage(archive + "/" + name)
+
+            if properties["verbose"] and removed:
+                sys.stderr.write("Removed from \"%s\": %s\n" % (name, ", ".join(removed)))
+    finally:
+        lock.release()
+
+
+def run_once(components):
+    if properties["collect"]:
+        collect(components)
+
+    if properties["render"]:
+        render(components)
+
+    storage.flush()
+
+
+#
+# Signals received while in daemon mode. The handlers only set
+# these flags, the main loop acts on them between runs.
+#
+signals = { "stop"   : False,
+            "reload" : False }
+
+
+def handle_signal(signum, frame):
+    if signum == signal.SIGHUP:
+        signals["reload"] = True
+    else:
+        signals["stop"] = True
+
+
+def run_daemon(components):
+    """Run every "refresh" seconds until told to stop."""
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGHUP, handle_signal)
+
+    # Collecting and rendering run on independent schedules,
+    # each one kept as a list: [next run, interval, function]
+    schedules = []
+    now = monotonic()
+
+    if properties["collect"]:
+        schedules.append([now, properties["refresh"], collect])
+
+    if properties["render"]:
+        schedules.append([now, properties["redraw"], render])
+
+    while not signals["stop"]:
+        if signals["reload"]:
+            signals["reload"] = False
+            registry.close()
+
+            try:
+                reloaded = load_components()
+                if len(reloaded) == 1:  # only Quick Look's own statistics
+                    raise StatsError("no components could be loaded")
+
+                components = reloaded
+            except RUN_ERRORS, e:
+                # Keep running with the components we already had.
+                sys.stderr.write("Cannot reload: " + str(e) + "\n")
+            else:
+                if properties["verbose"]:
+                    sys.stderr.write("Reloaded %d component(s).\n" % len(components))
+
+        schedule = schedules[0]
+        for other in schedules[1:]:
+            if other[0] < schedule[0]:
+                schedule = other
+
+        next_run, interval, function = schedule
+
+        now = monotonic()
+        if now < next_run:
+            # Any signal interrupts the sleep, so we get to check the flags.
+            sleep(next_run - now)
+            continue
+
+        try:
+            function(components)
+        except RUN_ERRORS, e:
+            # A bad run must not bring the daemon down.
+            sys.stderr.write("Error: " + str(e) + "\n")
+
+        # Stay on schedule, skipping any runs we have missed by overrunning.
+        next_run += interval
+        now = monotonic()
+        if next_run <= now:
+            next_run += (int((now - next_run) / interval) + 1) * interval
+
+        schedule[0] = next_run
+
+    storage.close()
+    registry.close()
+
+
 if __name__ == "__main__":
     try:
         process_cmdline()
@@ -127,19 +624,31 @@ if __name__ == "__main__":
         print_usage()
         sys.exit(1)
 
+    if properties["profile"]:
+        try:
+            profiling.start(properties["profile"])
+        except (StatsError, EnvironmentError), e:
+            sys.stderr.write("Error: " + str(e) + "\n")
+            sys.exit(1)
+
     components = load_components()
-    if len(components) == 0:
+    if len(components) == 1:  # only Quick Look's own statistics
         sys.stderr.write("Error: no components could be loaded.")
         sys.exit(1)
 
-    welcome = Welcome(components)
-    welcome.update()
-    welcome.make_html()
-
-    for component in components:
-        component.update()
-        component.make_graphs()
-        component.make_html()
+    if properties["gc"]:
+        try:
+            collect_garbage(components)
+        except (StatsError, EnvironmentError, storage.error), e:
+            sys.stderr.write("Error: " + str(e) + "\n")
+            sys.exit(1)
+    elif properties["daemon"]:
+        run_daemon(components)
+    else:
+        try:
+            run_once(components)
+        finally:
+            profiling.stop()
 
 
 # EOF - stats.py
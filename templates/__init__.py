@@ -18,7 +18,7 @@
 #
 
 
-__all__ = ["skeleton", "counters", "connections", "processes", "cpu", "disks", "memory", "welcome"]
+__all__ = ["skeleton", "charts", "counters", "connections", "processes", "cpu", "disks", "memory", "quicklook", "welcome"]
 
 
 # EOF - __init__.py